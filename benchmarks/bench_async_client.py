@@ -0,0 +1,96 @@
+# benchmarks/bench_async_client.py
+#
+#
+# Fan-out of REST calls: sync client, threaded sync client and AsyncClient
+#
+# Usage:
+#   python benchmarks/bench_async_client.py [--calls N] [--latency MS] [--concurrency C]
+#
+# Starts a local aiohttp server answering `get_product` after `--latency`
+# milliseconds, then times `--calls` calls made one after the other with
+# `Client`, from a pool of `--concurrency` threads sharing one `Client`, and
+# with `AsyncClient.gather` at the same concurrency.
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiohttp import web
+
+from cbadv.async_client import AsyncClient
+from cbadv.cbadv_client import Client
+from cbadv.rate_limit import RateLimiter
+
+
+def start_server(latency):
+    """ Serve `GET /products/{id}` in a background thread. Returns the api url. """
+    async def product(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'product_id': request.match_info['product_id'],
+                                  'price': '30000.00'})
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get('/api/v3/brokerage/products/{product_id}', product)
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0, backlog=1024)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}/api/v3/brokerage'.format(port)
+
+
+def limiter():
+    # The benchmark measures the transport, not the request budget.
+    return RateLimiter(private_rate=1e6, public_rate=1e6)
+
+
+def run_sync(url, ids, concurrency):
+    client = Client('key', 'secret', url, rate_limiter=limiter())
+    for product_id in ids:
+        client.get_product(product_id)
+
+
+def run_threaded(url, ids, concurrency):
+    client = Client('key', 'secret', url, rate_limiter=limiter())
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client.get_product, ids))
+
+
+def run_async(url, ids, concurrency):
+    async def main():
+        async with AsyncClient('key', 'secret', url, rate_limiter=limiter()) as client:
+            await client.gather(*(client.get_product(p) for p in ids),
+                                concurrency=concurrency)
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=50.,
+                        help='server latency in milliseconds')
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    url = start_server(args.latency / 1000.)
+    ids = ['P{}-USD'.format(i) for i in range(args.calls)]
+    print('{} get_product calls, {:.0f} ms latency, concurrency {}'.format(
+        args.calls, args.latency, args.concurrency))
+    for name, run in (('sync', run_sync), ('threaded sync', run_threaded),
+                      ('async gather', run_async)):
+        start = time.perf_counter()
+        run(url, ids, args.concurrency)
+        elapsed = time.perf_counter() - start
+        print('{:<14} {:8.3f} s  {:8.0f} calls/s'.format(name, elapsed, args.calls / elapsed))
+
+
+if __name__ == '__main__':
+    main()
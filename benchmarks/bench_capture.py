@@ -0,0 +1,83 @@
+# benchmarks/bench_capture.py
+#
+#
+# Capture write throughput, index load time and seek latency of `book_at`
+#
+# Usage:
+#   python benchmarks/bench_capture.py [--updates N] [--rate R] [--checkpoint S]
+#
+# Records a synthetic level2 stream of `--updates` frames received at `--rate`
+# frames/sec (the default is a day at ~10 frames/sec), with a book checkpoint
+# every `--checkpoint` seconds, then rebuilds the book at random times.
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_order_book import synthetic_stream
+from cbadv.capture import CaptureReader, CaptureWriter
+from cbadv.order_book import OrderBook
+
+
+def record(path, frames, rate, checkpoint):
+    book = OrderBook('BTC-USD')
+    start = time.perf_counter()
+    next_checkpoint = 0.
+    with CaptureWriter(path, batch_size=1000) as writer:
+        for i, frame in enumerate(frames):
+            timestamp = i / rate
+            writer.write(frame, timestamp)
+            if checkpoint:
+                # What OrderBooks does: apply, then checkpoint when due.
+                event = json.loads(frame)['events'][0]
+                if event['type'] == 'snapshot':
+                    book.create_book(event['updates'])
+                else:
+                    book.update(event['updates'])
+                if timestamp >= next_checkpoint:
+                    writer.checkpoint({'BTC-USD': book}, timestamp)
+                    next_checkpoint = timestamp + checkpoint
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=864000)
+    parser.add_argument('--rate', type=float, default=10.)
+    parser.add_argument('--checkpoint', type=float, default=30.)
+    parser.add_argument('--seeks', type=int, default=20)
+    args = parser.parse_args()
+
+    frames = [json.dumps(dict(msg, sequence_num=i), separators=(',', ':'))
+              for i, msg in enumerate(synthetic_stream(args.updates))]
+    path = os.path.join(tempfile.mkdtemp(), 'bench.cap')
+    elapsed = record(path, frames, args.rate, args.checkpoint)
+    print('recorded {} frames in {:.1f}s, {:.1f} MB'.format(
+        len(frames), elapsed, os.path.getsize(path) / 1e6))
+
+    start = time.perf_counter()
+    reader = CaptureReader(path)
+    print('opened and indexed {} blocks, {} checkpoints in {:.3f}s'.format(
+        len(reader.blocks), len(reader.checkpoints), time.perf_counter() - start))
+
+    rng = random.Random(0)
+    timings = []
+    for _ in range(args.seeks):
+        timestamp = rng.uniform(reader.start_time, reader.end_time)
+        start = time.perf_counter()
+        reader.book_at('BTC-USD', timestamp)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print('book_at: median {:.3f}s, max {:.3f}s'.format(timings[len(timings) // 2], timings[-1]))
+    reader.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/bench_decoder.py
+#
+#
+# Frames/sec decoded, and decoded + applied to OrderBooks, per decoder
+#
+# Usage:
+#   python benchmarks/bench_decoder.py [--capture feed.cap] [--updates N]
+#
+# `--capture` takes a file written by `OrderBooks(log_to=...)`; its messages
+# are renumbered and serialized back to compact JSON frames.
+
+import argparse
+import copy
+import functools
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_order_book import load_capture, synthetic_stream
+from cbadv.decoder import get_decoder
+from cbadv.order_book import OrderBook
+from cbadv.order_books import OrderBooks
+from cbadv.tick_order_book import TickOrderBook
+
+
+def to_frames(messages):
+    frames = []
+    for sequence_num, msg in enumerate(messages):
+        msg = dict(msg, sequence_num=sequence_num)
+        frames.append(json.dumps(msg, separators=(',', ':'), default=str))
+    return frames
+
+
+def decoders():
+    candidates = [('json', {}), ('orjson', {}), ('msgspec', {}),
+                  ('msgspec', {'typed': True}), ('msgspec', {'typed': True, 'number': float})]
+    for backend, kwargs in candidates:
+        try:
+            decoder = get_decoder(backend, **kwargs)
+        except ImportError:
+            continue
+        label = decoder.name
+        if kwargs.get('number') is float:
+            label += ' (float)'
+        yield label, decoder, kwargs.get('number', Decimal)
+
+
+def bench_decode(frames, decoder):
+    decode = decoder.decode
+    start = time.perf_counter()
+    for frame in frames:
+        decode(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def bench_apply(frames, decoder, book_class, products):
+    books = OrderBooks('key', 'secret', product_id=products, book_class=book_class,
+                       decoder=decoder)
+    decode = decoder.decode
+    on_message = books.on_message
+    start = time.perf_counter()
+    for frame in frames:
+        on_message(decode(frame))
+    return len(frames) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--capture', help='capture written by OrderBooks(log_to=...)')
+    parser.add_argument('--updates', type=int, default=100000)
+    parser.add_argument('--quote-increment', default='0.01')
+    parser.add_argument('--base-increment', default='0.00000001')
+    args = parser.parse_args()
+
+    if args.capture:
+        messages = load_capture(args.capture)
+    else:
+        messages = synthetic_stream(args.updates)
+    frames = to_frames(copy.deepcopy(messages))
+    products = sorted({event['product_id'] for msg in messages for event in msg['events']
+                       if 'product_id' in event})
+    tick_book = functools.partial(TickOrderBook, quote_increment=args.quote_increment,
+                                  base_increment=args.base_increment)
+
+    print('{} frames, {} products'.format(len(frames), len(products)))
+    print('{:<24} {:>14} {:>22} {:>22}'.format(
+        'decoder', 'decode/s', 'apply OrderBook/s', 'apply TickOrderBook/s'))
+    for label, decoder, number in decoders():
+        row = [bench_decode(frames, decoder)]
+        # Exact Decimal books need Decimal (or string) prices.
+        row.append(bench_apply(frames, decoder, OrderBook, products)
+                   if number is Decimal else float('nan'))
+        row.append(bench_apply(frames, decoder, tick_book, products))
+        print('{:<24} {:>14,.0f} {:>22,.0f} {:>22,.0f}'.format(label, *row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/bench_load.py
+#
+#
+# Load tests against the local `MockExchange`: REST latency percentiles,
+# websocket frames/sec and order book update throughput
+#
+# Usage:
+#   python -m pytest benchmarks/bench_load.py [--benchmark-json=results.json]
+#
+# Needs `pytest-benchmark` and `aiohttp`; no network access. Compare two
+# releases with `--benchmark-save` and `--benchmark-compare`.
+
+import functools
+import json
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('aiohttp')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from websocket import create_connection
+
+from cbadv.cbadv_client import Client
+from cbadv.mock_server import MockExchange
+from cbadv.order_books import OrderBooks
+from cbadv.rate_limit import RateLimiter
+from cbadv.tick_order_book import TickOrderBook
+
+FRAMES = 10000
+
+
+def percentiles(data, points=(50, 90, 99)):
+    data = sorted(data)
+    return {'p{}_ms'.format(point): 1000 * data[min(len(data) - 1, len(data) * point // 100)]
+            for point in points}
+
+
+@pytest.fixture(scope='module')
+def exchange():
+    with MockExchange(rate=None, depth=100) as exchange:
+        yield exchange
+
+
+@pytest.fixture
+def client(exchange):
+    client = Client('key', 'secret', api_url=exchange.rest_url, prewarm=1,
+                    rate_limiter=RateLimiter(private_rate=100000, public_rate=100000))
+    yield client
+    client.close()
+
+
+def test_rest_latency(benchmark, client):
+    benchmark.pedantic(client.get_product, args=('BTC-USD',), rounds=500, warmup_rounds=20)
+    benchmark.extra_info.update(percentiles(benchmark.stats.stats.data))
+
+
+def test_rest_list_orders_page(benchmark, client):
+    client.place_orders([{'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+                          'price': '{}.00'.format(20000 + i), 'size': '0.01'}
+                         for i in range(100)])
+    benchmark.pedantic(client.list_orders, kwargs={'limit': 100}, rounds=100, warmup_rounds=5)
+    benchmark.extra_info.update(percentiles(benchmark.stats.stats.data))
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_place_40_orders(benchmark, exchange, client, batch):
+    exchange.faults.latency = 0.005
+    orders = [{'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+               'price': '{}.00'.format(20000 + i), 'size': '0.01'} for i in range(40)]
+
+    def place():
+        if batch:
+            return client.place_orders(orders)
+        return [client.create_order(**order) for order in orders]
+
+    try:
+        benchmark.pedantic(place, rounds=10, warmup_rounds=1)
+    finally:
+        exchange.faults.latency = 0.
+
+
+def test_websocket_frames_per_sec(benchmark, exchange):
+    ws = create_connection(exchange.ws_url)
+    ws.send(json.dumps({'type': 'subscribe', 'channel': 'level2',
+                        'product_ids': ['BTC-USD', 'ETH-USD']}))
+
+    def receive():
+        for _ in range(FRAMES):
+            ws.recv()
+
+    try:
+        benchmark.pedantic(receive, rounds=5, warmup_rounds=1)
+    finally:
+        ws.close()
+    benchmark.extra_info['frames_per_sec'] = FRAMES / benchmark.stats.stats.mean
+
+
+@pytest.mark.parametrize('engine', ['OrderBook', 'TickOrderBook'])
+def test_book_updates_per_sec(benchmark, exchange, engine):
+    kwargs = {}
+    if engine == 'TickOrderBook':
+        # The increments of every `MockExchange` product.
+        kwargs['book_class'] = functools.partial(TickOrderBook, quote_increment='0.01',
+                                                 base_increment='0.00000001')
+    books = OrderBooks('key', 'secret', product_id=['BTC-USD', 'ETH-USD'], **kwargs)
+    books.on_open = lambda: None
+    books.on_close = lambda: None
+    books.url = exchange.ws_url
+    books.start()
+
+    def consume():
+        target = books.stats.messages + FRAMES
+        while books.stats.messages < target:
+            time.sleep(0.001)
+
+    try:
+        benchmark.pedantic(consume, rounds=5, warmup_rounds=1)
+    finally:
+        books.close()
+    assert books.gap_count == 0
+    benchmark.extra_info['messages_per_sec'] = FRAMES / benchmark.stats.stats.mean
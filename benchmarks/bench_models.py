@@ -0,0 +1,109 @@
+# benchmarks/bench_models.py
+#
+#
+# Memory and throughput of typed response models against plain dicts
+#
+# Usage:
+#   python benchmarks/bench_models.py [--fills N]
+#
+# Decodes a synthetic `list_fills` page of `--fills` fills, then measures the
+# memory held by the page, the time to build it, and the time to sum the
+# prices with dicts, models (first and later reads) and `columns`.
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cbadv.models import columns, decode_response
+
+
+def synthetic_page(fills):
+    return json.dumps({'fills': [{
+        'entry_id': '{:08d}-2222-2222-2222-222222222222'.format(i),
+        'trade_id': '{:08d}-1111-1111-1111-111111111111'.format(i),
+        'order_id': '0000-000000-000000',
+        'trade_time': '2023-05-31T09:59:59.{:06d}Z'.format(i % 1000000),
+        'trade_type': 'FILL',
+        'price': '{:.2f}'.format(26000 + (i % 500) / 100.),
+        'size': '0.{:08d}'.format(i % 10000000 + 1),
+        'commission': '0.25',
+        'product_id': 'BTC-USD',
+        'sequence_timestamp': '2023-05-31T09:59:59.{:06d}Z'.format(i % 1000000),
+        'liquidity_indicator': 'MAKER',
+        'size_in_quote': False,
+        'user_id': '3333-333333-3333333',
+        'side': 'BUY',
+    } for i in range(fills)], 'cursor': ''})
+
+
+def build(body, typed):
+    page = json.loads(body)
+    if typed:
+        page = decode_response('GET', '/orders/historical/fills', page)
+    return page
+
+
+def measure_memory(body, typed):
+    gc.collect()
+    tracemalloc.start()
+    page = build(body, typed)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del page
+    return size
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def sum_dicts(fills):
+    return sum(Decimal(fill['price']) for fill in fills)
+
+
+def sum_models(fills):
+    return sum(fill.price for fill in fills)
+
+
+def sum_columns(fills):
+    return sum(columns(fills, ['price'])['price'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fills', type=int, default=100000)
+    args = parser.parse_args()
+
+    body = synthetic_page(args.fills)
+    print('{} fills, {:.1f} MB of JSON'.format(args.fills, len(body) / 1e6))
+    print('{:<8} {:>12} {:>12} {:>16} {:>16} {:>16}'.format(
+        'result', 'memory MB', 'decode s', 'sum price s', 'sum again s', 'columns s'))
+    for label, typed in (('dict', False), ('model', True)):
+        memory = measure_memory(body, typed)
+        decode, page = timed(build, body, typed)
+        fills = page['fills']
+        if typed:
+            columns_time = timed(sum_columns, fills)[0]
+            first = timed(sum_models, fills)[0]
+            again = timed(sum_models, fills)[0]
+        else:
+            columns_time = float('nan')
+            first = timed(sum_dicts, fills)[0]
+            # Dicts keep strings: every pass parses again.
+            again = timed(sum_dicts, fills)[0]
+        print('{:<8} {:>12.1f} {:>12.3f} {:>16.3f} {:>16.3f} {:>16.3f}'.format(
+            label, memory / 1e6, decode, first, again, columns_time))
+
+
+if __name__ == '__main__':
+    main()
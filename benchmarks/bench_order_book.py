@@ -0,0 +1,101 @@
+# benchmarks/bench_order_book.py
+#
+#
+# Compares order book engines on a recorded (or synthetic) level2 stream
+#
+# Usage:
+#   python benchmarks/bench_order_book.py [--capture feed.cap] [--updates N]
+#
+# `--capture` takes a file written by `OrderBooks(log_to=...)`.
+
+import argparse
+import copy
+import os
+import json
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cbadv.capture import CaptureReader
+from cbadv.order_book import OrderBook
+from cbadv.tick_order_book import TickOrderBook
+
+
+def load_capture(path):
+    return [json.loads(frame) for _, frame in CaptureReader(path)]
+
+
+def synthetic_stream(n_updates, product_id='BTC-USD', depth=500, seed=42):
+    """ Level2 messages around a random-walking mid, most updates near the top. """
+    rng = random.Random(seed)
+    mid = 3000000
+
+    def event(side, tick, size):
+        return {'side': side, 'event_time': '2023-06-01T00:00:00.000000Z',
+                'price_level': '{}.{:02d}'.format(tick // 100, tick % 100),
+                'new_quantity': size}
+
+    snapshot = [event('bid', mid - i, '{:.8f}'.format(rng.random())) for i in range(1, depth)]
+    snapshot += [event('offer', mid + i, '{:.8f}'.format(rng.random())) for i in range(depth)]
+    messages = [{'channel': 'l2_data', 'events': [
+        {'type': 'snapshot', 'product_id': product_id, 'updates': snapshot}]}]
+    for _ in range(n_updates):
+        mid += rng.choice((-1, 0, 0, 1))
+        updates = []
+        for _ in range(rng.randint(1, 4)):
+            side = rng.choice(('bid', 'offer'))
+            distance = int(rng.expovariate(0.1))
+            tick = mid - 1 - distance if side == 'bid' else mid + distance
+            size = '0' if rng.random() < 0.3 else '{:.8f}'.format(rng.random())
+            updates.append(event(side, tick, size))
+        messages.append({'channel': 'l2_data', 'events': [
+            {'type': 'update', 'product_id': product_id, 'updates': updates}]})
+    return messages
+
+
+def run(messages, make_book):
+    books = {}
+    n_levels = 0
+    start = time.perf_counter()
+    for msg in messages:
+        for event in msg['events']:
+            if 'subscriptions' in event:
+                continue
+            book = books.get(event['product_id'])
+            if book is None:
+                book = books[event['product_id']] = make_book(event['product_id'])
+            book._message(event['updates'])
+            n_levels += len(event['updates'])
+            book.get_bid()
+            book.get_ask()
+    return time.perf_counter() - start, n_levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--capture', help='capture written by OrderBooks(log_to=...)')
+    parser.add_argument('--updates', type=int, default=200000)
+    parser.add_argument('--quote-increment', default='0.01')
+    parser.add_argument('--base-increment', default='0.00000001')
+    args = parser.parse_args()
+
+    if args.capture:
+        messages = load_capture(args.capture)
+    else:
+        messages = synthetic_stream(args.updates)
+
+    engines = [
+        ('OrderBook (SortedDict)', lambda product_id: OrderBook(product_id)),
+        ('TickOrderBook (arrays)', lambda product_id: TickOrderBook(
+            product_id, args.quote_increment, args.base_increment)),
+    ]
+    for name, make_book in engines:
+        # OrderBook mutates the events it receives; give every engine a fresh copy.
+        elapsed, n_levels = run(copy.deepcopy(messages), make_book)
+        print('{:<24} {:>8.3f}s  {:>12,.0f} levels/s'.format(name, elapsed, n_levels / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 from cbadv.websocket_client import WebsocketClient
+from cbadv.async_websocket_client import AsyncWebsocketClient
 from cbadv.order_book import OrderBook
+from cbadv.tick_order_book import TickOrderBook
 from cbadv.order_books import OrderBooks
 from cbadv.cbadv_auth import CBAdvAuth
 from cbadv.cbadv_client import Client
+from cbadv.async_client import AsyncClient
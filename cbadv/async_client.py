@@ -0,0 +1,248 @@
+# cbadv/async_client.py
+#
+#
+# asyncio client for the Coinbase Advanced Trade API
+#
+# Requires the `aiohttp` package (pip install cbadv[async]).
+
+import asyncio
+import time
+from urllib.parse import urlencode, urlsplit
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+from cbadv.cbadv_auth import get_auth_headers
+from cbadv.cbadv_client import Client, OrderResult, _drop_none, _order_bodies
+from cbadv.connection import POOL_MAXSIZE, endpoint_class
+from cbadv.metrics import endpoint_template
+from cbadv.models import decode_response
+from cbadv.products import ProductCatalog
+from cbadv.rate_limit import BULK, priority
+
+
+async def gather(*aws, concurrency=16, return_exceptions=False):
+    """ Like `asyncio.gather`, with at most `concurrency` awaitables running.
+
+    Results come back in the order of `aws`.
+
+        products = await gather(*(client.get_product(p) for p in ids), concurrency=32)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(bounded(aw) for aw in aws),
+                                return_exceptions=return_exceptions)
+
+
+class AsyncClient(Client):
+    """ Asynchronous version of `Client`.
+
+    Every endpoint method of `Client` is available with the same arguments
+    and returns an awaitable; `iter_*` methods return async iterators.
+    Requests share a pooled, keep-alive `aiohttp` connector and go through
+    the same rate limiter as the synchronous clients of the process.
+
+        async with AsyncClient(key, secret) as client:
+            product = await client.get_product('BTC-USD')
+            async for fill in client.iter_fills(product_id='BTC-USD'):
+                ...
+
+    Args:
+        api_key (str): Your coinbase advanced trade API key.
+        api_secret (str): Your coinbase advanced trade API secret.
+        api_url (str): The api url for this client instance to use.
+        rate_limiter (Optional[RateLimiter]): Request scheduler.
+        max_retries (int): Times a request throttled with a 429 is sent again.
+        connections (int): Size of the connection pool.
+        pool_maxsize (Optional[int or dict]): Connections to one host, at
+            most `connections`. A {host: size} dict as taken by `Client` is
+            read for the host of `api_url`.
+        timeout (float): Total timeout of a request, in seconds.
+        timeouts (Optional[dict]): (connect, read) timeouts by endpoint
+            class, see `Client`.
+        cache (Optional[ResponseCache]): Cache of reference-data responses,
+            see `Client`.
+        typed (bool): Return response models, see `Client`.
+        metrics (Optional[object]): Sink of request latencies, see `Client`.
+    """
+    def __init__(self, api_key=None, api_secret=None,
+                 api_url='https://api.coinbase.com/api/v3/brokerage', rate_limiter=None,
+                 max_retries=2, connections=100, timeout=30, timeouts=None, typed=False,
+                 metrics=None, pool_maxsize=None, cache=None):
+        if aiohttp is None:
+            raise ImportError('AsyncClient requires the `aiohttp` package')
+        super(AsyncClient, self).__init__(api_key, api_secret, api_url, rate_limiter,
+                                          max_retries, pool_maxsize=pool_maxsize,
+                                          timeouts=timeouts, cache=cache, typed=typed,
+                                          metrics=metrics)
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.connections = connections
+        self.timeout = timeout
+        self._path = urlsplit(api_url).path.rstrip('/')
+
+    def _init_transport(self, pool_connections, pool_maxsize, prewarm, keepalive):
+        # The aiohttp session is created by the first request, in its loop.
+        self.session = None
+        if isinstance(pool_maxsize, dict):
+            host = (urlsplit(self.url).hostname or '').lower()
+            sizes = dict((key.lower(), size) for key, size in pool_maxsize.items())
+            pool_maxsize = sizes.get(host, sizes.get('*', POOL_MAXSIZE))
+        self.pool_maxsize = pool_maxsize
+
+    async def prewarm(self, connections=1):
+        """ Open `connections` connections to the API ahead of requests.
+
+        Unlike `Client.prewarm`, a request is needed to open a connection
+        with aiohttp: an unsigned HEAD of `url`, outside the rate limiter.
+        Its response, an error, does not matter.
+
+        Args:
+            connections (int): Connections wanted; capped at `pool_maxsize`
+                and `connections` of the client.
+
+        Returns:
+            int: Connections warmed, whether already open or not.
+        """
+        session = self._session()
+        timeout = self.timeouts['order']
+        if isinstance(timeout, tuple):
+            timeout = timeout[0]
+        connections = min(connections, self.connections, self.pool_maxsize or connections)
+
+        async def head():
+            async with session.head(self.url, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                await r.read()
+
+        # Started together, each request holds a connection of its own.
+        results = await asyncio.gather(*(head() for _ in range(connections)),
+                                       return_exceptions=True)
+        return sum(1 for result in results if not isinstance(result, Exception))
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections,
+                                             limit_per_host=self.pool_maxsize or 0,
+                                             ttl_dns_cache=300, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    def _headers(self, method, path, body):
+        timestamp = str(int(time.time()))
+        message = timestamp + method + path + (body or '')
+        headers = get_auth_headers(timestamp, message, self.api_key or '', self.api_secret or '')
+        headers['Content-Type'] = 'application/json'
+        return headers
+
+    async def _send_message(self, method, endpoint, params=None, data=None):
+        """ Send API request. See `Client._send_message`. """
+        if self.cache is not None:
+            async def load():
+                return await self._request(method, endpoint, params, data)
+            body = await self.cache.fetch_async(method, endpoint, params, load)
+        else:
+            body = (await self._request(method, endpoint, params, data))[0]
+        if self.typed:
+            body = decode_response(method, endpoint, body)
+        return body
+
+    async def _request(self, method, endpoint, params=None, data=None):
+        """ Send API request under the rate limiter; return (body, ok). """
+        method = method.upper()
+        query = urlencode(params, doseq=True) if params else ''
+        path = self._path + endpoint + ('?' + query if query else '')
+        # The exact signed path is sent, without re-encoding.
+        url = URL(self.url + endpoint + ('?' + query if query else ''), encoded=True)
+        session = self._session()
+        limiter = self.rate_limiter
+        timeout = self.timeouts[endpoint_class(method, endpoint)]
+        if isinstance(timeout, tuple):
+            timeout = aiohttp.ClientTimeout(total=self.timeout, sock_connect=timeout[0],
+                                            sock_read=timeout[1])
+        else:
+            timeout = aiohttp.ClientTimeout(total=min(self.timeout, timeout))
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            await limiter.acquire_async(method, endpoint)
+            async with session.request(method, url, data=data, timeout=timeout,
+                                       headers=self._headers(method, path, data)) as r:
+                body = await r.json(content_type=None)
+                wait = limiter.observe(endpoint, r.status, r.headers)
+            if self.metrics is not None:
+                self.metrics.observe('rest.latency', time.perf_counter() - start, {
+                    'method': method, 'endpoint': endpoint_template(endpoint),
+                    'status': r.status})
+            if not wait:
+                break
+        return body, r.status < 400
+
+    async def load_catalog(self):
+        """ Build or refresh `catalog`. See `Client.load_catalog`. """
+        catalog = self.catalog or ProductCatalog()
+        catalog.update(await self.list_products(), prune=True)
+        self.catalog = catalog
+        return catalog
+
+    async def place_orders(self, orders, workers=8):
+        """ Place several orders concurrently. See `Client.place_orders`. """
+        orders = list(orders)
+        bodies = _order_bodies(orders, self.catalog)
+        responses = await gather(*(self._send_message('POST', '/orders', data=body)
+                                   for body in bodies),
+                                 concurrency=max(1, workers), return_exceptions=True)
+        # A cancelled request comes back as a CancelledError, a BaseException.
+        return [OrderResult(order, None, response) if isinstance(response, BaseException)
+                else OrderResult(order, response, None)
+                for order, response in zip(orders, responses)]
+
+    async def _paginate(self, endpoint, key, params, prefetch=False):
+        """ Async version of `Client._paginate`. """
+        params = _drop_none(params)
+
+        async def fetch(cursor):
+            page_params = dict(params, cursor=cursor) if cursor else params
+            with priority(BULK):
+                return await self._send_message('GET', endpoint, params=page_params or None)
+
+        pending = asyncio.ensure_future(fetch(None))
+        try:
+            while pending is not None:
+                page = await pending
+                cursor = page.get('cursor')
+                if not cursor or page.get('has_next') is False or not page.get(key):
+                    pending = None
+                elif prefetch:
+                    pending = asyncio.ensure_future(fetch(cursor))
+                else:
+                    pending = fetch(cursor)
+                for item in page.get(key) or ():
+                    yield item
+        finally:
+            if pending is not None:
+                if asyncio.isfuture(pending):
+                    pending.cancel()
+                else:
+                    pending.close()
+
+    async def gather(self, *aws, concurrency=16, return_exceptions=False):
+        """ Run many calls with bounded concurrency. See `cbadv.async_client.gather`. """
+        return await gather(*aws, concurrency=concurrency, return_exceptions=return_exceptions)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
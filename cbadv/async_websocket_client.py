@@ -0,0 +1,307 @@
+# cbadv/async_websocket_client.py
+#
+#
+# asyncio client for the Coinbase Advanced Trade Websocket Feed
+#
+# Requires the `websockets` package (pip install cbadv[async]).
+
+import asyncio
+import json
+import time
+from collections import deque
+
+try:
+    import websockets
+except ImportError:  # pragma: no cover - optional dependency
+    websockets = None
+
+from cbadv.decoder import get_decoder
+from cbadv.websocket_client import parse_timestamp, subscription_message
+
+
+def product_key(msg):
+    """ Default coalescing key: the channel and product of a message. """
+    events = msg.get('events') or ({},)
+    event = events[0]
+    product_id = event.get('product_id')
+    if product_id is None and event.get('tickers'):
+        product_id = event['tickers'][0].get('product_id')
+    return msg.get('channel'), product_id
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class MessageQueue(object):
+    """ Bounded queue between the socket reader and its consumer.
+
+    What happens when a message arrives while the queue is full depends on
+    `overflow`:
+        'block'       The reader waits for the consumer. Nothing is lost, but
+                      the socket is not read meanwhile.
+        'drop_oldest' The oldest pending message is discarded.
+        'coalesce'    A pending message with the same key (channel and
+                      product by default) is replaced by the new one; if
+                      there is none the oldest message is discarded. Only
+                      suitable for channels where the latest message
+                      supersedes the previous ones, like ticker: coalescing
+                      level2 updates loses deltas.
+
+    Attributes:
+        dropped (int): Messages discarded by 'drop_oldest' or 'coalesce'.
+        coalesced (int): Messages replaced by a newer one with the same key.
+    """
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    COALESCE = 'coalesce'
+
+    def __init__(self, maxsize=1000, overflow='block', key=product_key):
+        if overflow not in (self.BLOCK, self.DROP_OLDEST, self.COALESCE):
+            raise ValueError('Invalid overflow policy: {}'.format(overflow))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._key = key
+        self._items = deque()
+        self._latest = {}
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    async def put(self, msg):
+        if self._closed:
+            raise QueueClosed()
+        key = self._key(msg) if self.overflow == self.COALESCE else None
+        while len(self._items) >= self.maxsize:
+            if self.overflow == self.BLOCK:
+                self._not_full.clear()
+                await self._not_full.wait()
+                if self._closed:
+                    raise QueueClosed()
+                continue
+            if key is not None and key in self._latest:
+                self._latest[key][1] = msg
+                self.coalesced += 1
+                return
+            oldest = self._items.popleft()
+            if oldest[0] is not None and self._latest.get(oldest[0]) is oldest:
+                del self._latest[oldest[0]]
+            self.dropped += 1
+        entry = [key, msg]
+        self._items.append(entry)
+        if key is not None:
+            self._latest[key] = entry
+        self._not_empty.set()
+
+    async def get(self):
+        while not self._items:
+            if self._closed:
+                raise QueueClosed()
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        key, msg = entry = self._items.popleft()
+        if key is not None and self._latest.get(key) is entry:
+            del self._latest[key]
+        self._not_full.set()
+        return msg
+
+    def close(self):
+        """ Wake up every waiter. Pending messages can still be consumed. """
+        self._closed = True
+        self._not_empty.set()
+        self._not_full.set()
+
+
+class AsyncWebsocketClient(object):
+    """ Websocket feed client for asyncio.
+
+    Messages are read by a background task into a bounded `MessageQueue`
+    and consumed with `async for`, so a slow consumer never stalls the
+    socket read (unless `overflow='block'`). Many clients can share one
+    event loop.
+
+        async with AsyncWebsocketClient(key, secret, products=['BTC-USD'],
+                                        channel='ticker') as ws:
+            async for msg in ws:
+                ...
+
+    Args:
+        api_key (str): Your coinbase advanced trade API key.
+        api_secret (str): Your coinbase advanced trade API secret.
+        url (str): Websocket endpoint.
+        products (list): Products to subscribe to.
+        channel (str): Channel to subscribe to.
+        max_queue (int): Capacity of the message queue.
+        overflow (str): Queue overflow policy, see `MessageQueue`.
+        reconnect_delay (float): Initial delay before reconnecting; doubles
+            on each consecutive failure up to `max_reconnect_delay`.
+        metrics (Optional[object]): Sink of latency, decode time and queue
+            depth measurements, see `cbadv.metrics`.
+        decoder (Optional[object]): Frame decoder, see `cbadv.decoder`.
+            Defaults to the fastest installed backend.
+    """
+    def __init__(self, api_key, api_secret, url="wss://advanced-trade-ws.coinbase.com",
+                 products=None, channel='ticker', max_queue=1000, overflow='block',
+                 key=product_key, ping_interval=20, reconnect_delay=0.1,
+                 max_reconnect_delay=30, metrics=None, decoder=None):
+        if websockets is None:
+            raise ImportError('AsyncWebsocketClient requires the `websockets` package')
+        if products is None:
+            products = ["BTC-USD"]
+        elif not isinstance(products, list):
+            products = [products]
+        else:
+            # Own copy: `subscribe` and `unsubscribe` change it.
+            products = list(products)
+        self.url = url.rstrip('/')
+        self.products = products
+        self.channel = channel
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.queue = MessageQueue(max_queue, overflow, key)
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.metrics = metrics
+        self.decoder = decoder or get_decoder()
+        self.ws = None
+        self.error = None
+        self.reconnects = 0
+        self._task = None
+        self._connected = None
+        self._failure = None
+
+    async def start(self):
+        """ Connect, subscribe and start reading in a background task. """
+        self._connected = asyncio.get_running_loop().create_future()
+        self._task = asyncio.ensure_future(self._run())
+        await asyncio.shield(self._connected)
+
+    async def _connect(self):
+        self.ws = await websockets.connect(self.url, ping_interval=self.ping_interval)
+        await self.ws.send(json.dumps(subscription_message(
+            'subscribe', self.channel, self.products, self.api_key, self.api_secret)))
+
+    async def _run(self):
+        try:
+            await self._read()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Handed to the consumer once the pending messages are read.
+            self.error = self._failure = e
+        finally:
+            self.queue.close()
+
+    async def _read(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                await self._connect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self._connected.done():
+                    self._connected.set_exception(e)
+                    return
+                self.error = e
+            else:
+                if not self._connected.done():
+                    self._connected.set_result(None)
+                delay = self.reconnect_delay
+                try:
+                    async for frame in self.ws:
+                        if self.metrics is None:
+                            await self.queue.put(self.decoder.decode(frame))
+                        else:
+                            await self._put_measured(frame)
+                except (websockets.exceptions.ConnectionClosed, ValueError) as e:
+                    self.error = e
+                except QueueClosed:
+                    return
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _put_measured(self, frame):
+        metrics = self.metrics
+        received = time.time()
+        start = time.perf_counter()
+        msg = self.decoder.decode(frame)
+        tags = {'channel': msg.get('channel')}
+        metrics.observe('ws.decode', time.perf_counter() - start, tags)
+        timestamp = msg.get('timestamp')
+        if timestamp:
+            metrics.observe('ws.latency', received - parse_timestamp(timestamp), tags)
+        await self.queue.put(msg)
+        metrics.gauge('ws.queue_depth', len(self.queue))
+
+    async def subscribe(self, products):
+        """ Add products; they are subscribed again after a reconnection. """
+        self.products.extend(product_id for product_id in products
+                             if product_id not in self.products)
+        await self._send_live('subscribe', products)
+
+    async def unsubscribe(self, products):
+        """ Remove products, for this and later connections. """
+        self.products[:] = [product_id for product_id in self.products
+                            if product_id not in products]
+        await self._send_live('unsubscribe', products)
+
+    async def _send_live(self, message_type, products):
+        if self.ws is None:
+            return
+        try:
+            await self.ws.send(json.dumps(subscription_message(
+                message_type, self.channel, products, self.api_key, self.api_secret)))
+        except websockets.exceptions.ConnectionClosed:
+            # The next connection subscribes to `self.products`.
+            pass
+
+    async def recv(self):
+        """ Next message. Raises `QueueClosed` once closed and drained, or
+        the exception that stopped the reader task. """
+        try:
+            return await self.queue.get()
+        except QueueClosed:
+            if self._failure is not None:
+                raise self._failure
+            raise
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.queue.get()
+        except QueueClosed:
+            if self._failure is not None:
+                raise self._failure
+            raise StopAsyncIteration
+
+    async def close(self):
+        """ Cancel the reader task, close the socket and end iteration. """
+        self.queue.close()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,180 @@
+# cbadv/book_features.py
+#
+#
+# Order book aggregates maintained incrementally
+#
+# A book created with `features=BookFeatures(...)` updates these aggregates
+# as each of its levels changes, instead of having them recomputed from the
+# levels after every update (compare `cbadv.book_analytics`, which computes
+# the same figures from a depth snapshot):
+#
+#     total size and level count    O(1) per level change
+#     size of the top K levels      O(log n) per level change and K
+#     size within N bps of mid      O(1) per level change and N, plus the
+#                                   levels the band edge crosses when the
+#                                   best bid or ask moves
+#
+# Sizes are summed in the book's own units (`Decimal` for `OrderBook`,
+# integer lots for `TickOrderBook`), so they never drift, and converted to
+# floats when read.
+#
+# Book engines provide `_feature_count(side)`, `_feature_best(side)`,
+# `_feature_size_at(side, rank)` and `_feature_sum(side, low, high)`, where
+# a level's key orders it from worst to best on both sides: its price for
+# bids, minus its price for asks.
+
+BID, ASK = 0, 1
+
+
+class BookFeatures(object):
+    """ Aggregates of one order book kept up to date by the book itself.
+
+        book = OrderBook('BTC-USD', features=BookFeatures(top_k=[5], bands=[10, 50]))
+        ...
+        book.features.top(5)          # (bid size, ask size) of the best 5 levels
+        book.features.within(10)      # (bid size, ask size) within 10 bps of mid
+        book.features.imbalance(k=5)
+
+    Each book needs its own instance; `OrderBooks(features={...})` creates
+    one per book from these arguments.
+
+    Args:
+        top_k (iterable): Numbers of best levels whose size is summed.
+        bands (iterable): Distances from mid, in basis points, within which
+            size is summed. Inclusive, like `book_analytics.depth_within_bps`.
+    """
+    def __init__(self, top_k=(), bands=()):
+        self.top_k = tuple(sorted(set(top_k)))
+        self.bands = tuple(sorted(set(bands)))
+        self._book = None
+        self._float = float
+        self.reset()
+
+    def attach(self, book, to_float=float):
+        """ Called by the book engine that owns these features. """
+        self._book = book
+        self._float = to_float
+
+    def reset(self):
+        """ Back to an empty book. """
+        self._total = [0, 0]
+        self._count = [0, 0]
+        self._top = [[0] * len(self.top_k) for _ in (BID, ASK)]
+        self._band = [[0] * len(self.bands) for _ in (BID, ASK)]
+        self._bounds = [[None] * len(self.bands) for _ in (BID, ASK)]
+        self._mid = None
+
+    def rebuild(self):
+        """ Compute everything from the book's levels, after a snapshot. """
+        book = self._book
+        self.reset()
+        for side in (BID, ASK):
+            self._count[side] = book._feature_count(side)
+            self._total[side] = book._feature_sum(side, None, None)
+            size, rank = 0, 0
+            for j, k in enumerate(self.top_k):
+                while rank < min(k, self._count[side]):
+                    size += book._feature_size_at(side, rank)
+                    rank += 1
+                self._top[side][j] = size
+        self._move_bands()
+
+    def change(self, side, key, old, new, rank):
+        """ Account for one level going from size `old` to `new`.
+
+        Args:
+            side (int): `BID` or `ASK`.
+            key (number): Key of the level.
+            old: Previous size, 0 for a new level.
+            new: New size, 0 for a removed level.
+            rank (int): Number of better levels on its side.
+        """
+        delta = new - old
+        self._total[side] += delta
+        if not old:
+            self._count[side] += 1
+        elif not new:
+            self._count[side] -= 1
+        top = self._top[side]
+        for j, k in enumerate(self.top_k):
+            if rank < k:
+                top[j] += delta
+                if not old:
+                    # The level pushed out of the top k.
+                    top[j] -= self._book._feature_size_at(side, k)
+                elif not new:
+                    # The level pulled into it.
+                    top[j] += self._book._feature_size_at(side, k - 1)
+        bounds = self._bounds[side]
+        band = self._band[side]
+        for j, bound in enumerate(bounds):
+            if bound is not None and key >= bound:
+                band[j] += delta
+        if rank == 0 and not (old and new):
+            self._move_bands()
+
+    def _move_bands(self):
+        # The best bid or ask moved: slide each band edge with the mid,
+        # adding or removing the levels it crosses.
+        book = self._book
+        bid, ask = book._feature_best(BID), book._feature_best(ASK)
+        mid = None if bid is None or ask is None else (float(bid) - float(ask)) / 2
+        if mid == self._mid:
+            return
+        self._mid = mid
+        for side in (BID, ASK):
+            bounds = self._bounds[side]
+            band = self._band[side]
+            for j, bps in enumerate(self.bands):
+                if mid is None:
+                    bounds[j] = None
+                    band[j] = 0
+                    continue
+                if side == BID:
+                    bound = mid * (1 - bps / 1e4)
+                else:
+                    bound = -mid * (1 + bps / 1e4)
+                old = bounds[j]
+                if old is None:
+                    band[j] = book._feature_sum(side, bound, None)
+                elif bound < old:
+                    band[j] += book._feature_sum(side, bound, old)
+                elif bound > old:
+                    band[j] -= book._feature_sum(side, old, bound)
+                bounds[j] = bound
+
+    def total(self):
+        """ (bid size, ask size) of the whole book. """
+        return self._float(self._total[BID]), self._float(self._total[ASK])
+
+    def levels(self):
+        """ (bid levels, ask levels). """
+        return self._count[BID], self._count[ASK]
+
+    def top(self, k):
+        """ (bid size, ask size) of the best `k` levels, one of `top_k`. """
+        j = self.top_k.index(k)
+        return self._float(self._top[BID][j]), self._float(self._top[ASK][j])
+
+    def within(self, bps):
+        """ (bid size, ask size) within `bps` of mid, one of `bands`; zero
+        while a side is empty. """
+        j = self.bands.index(bps)
+        return self._float(self._band[BID][j]), self._float(self._band[ASK][j])
+
+    def imbalance(self, k=None, bps=None):
+        """ (bid size - ask size) / (bid size + ask size) over the best `k`
+        levels, the `bps` band or, by default, the whole book.
+
+        Returns:
+            Optional[float]: None when both sides are empty.
+        """
+        if k is not None:
+            bid, ask = self.top(k)
+        elif bps is not None:
+            bid, ask = self.within(bps)
+        else:
+            bid, ask = self.total()
+        if not bid + ask:
+            return None
+        return (bid - ask) / (bid + ask)
@@ -0,0 +1,224 @@
+# cbadv/cache.py
+#
+#
+# Response cache for reference-data endpoints
+#
+# Products and the transactions summary change slowly, yet strategies ask
+# for them over and over. A `ResponseCache` given to a `Client` answers those
+# GETs from memory for a few seconds, which saves the round trip and the
+# rate limit token. Only endpoints listed in `TTLS` are cached; orders and
+# accounts never are, whatever the configuration.
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from cbadv.rate_limit import BULK, priority
+
+# Seconds a response stays fresh, by endpoint. Patterns must match the whole
+# endpoint; the first match wins.
+TTLS = (
+    (r'/products', 60),
+    (r'/products/[^/]+', 10),
+    (r'/transactions_summary', 300),
+)
+
+# Endpoints that are never cached, even when a TTL matches them.
+NEVER_CACHED = ('/orders', '/accounts')
+
+
+class CacheStats(namedtuple('CacheStats', ['hits', 'stale', 'misses', 'evictions',
+                                           'refreshes', 'size'])):
+    """ Counters of a `ResponseCache`.
+
+    `stale` counts the expired responses served while they were refreshed;
+    they are not counted in `hits`.
+    """
+    __slots__ = ()
+
+    @property
+    def hit_rate(self):
+        served = self.hits + self.stale
+        total = served + self.misses
+        return served / total if total else 0.
+
+
+class ResponseCache(object):
+    """ Thread-safe LRU cache of GET responses.
+
+    Entries are keyed on method, endpoint and params. An entry is served
+    while fresh; for `stale` more seconds it is still served, and a
+    background request refreshes it. Error responses are not stored.
+
+    Cached responses are shared between callers: treat them as read-only.
+
+        client = Client(key, secret, cache=ResponseCache(maxsize=512, stale=30))
+        client.get_product('BTC-USD')
+        client.cache.invalidate('/products/BTC-USD')
+
+    Args:
+        ttls (Optional[dict]): TTL in seconds by endpoint pattern, added in
+            front of `TTLS`. A TTL of 0 disables caching of the endpoint.
+        maxsize (int): Entries kept; the least recently used go first.
+        stale (float): Seconds an expired entry may still be served while
+            it is refreshed.
+    """
+    def __init__(self, ttls=None, maxsize=256, stale=0, clock=time.monotonic):
+        rules = list((ttls or {}).items()) + list(TTLS)
+        self._rules = [(re.compile(pattern), ttl) for pattern, ttl in rules]
+        self.maxsize = maxsize
+        self.stale = stale
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._hits = self._stale = self._misses = self._evictions = self._refreshes = 0
+
+    def ttl(self, method, endpoint):
+        """ Seconds a response of `endpoint` stays fresh, None if not cached. """
+        if method.upper() != 'GET' or endpoint.startswith(NEVER_CACHED):
+            return None
+        for pattern, ttl in self._rules:
+            if pattern.fullmatch(endpoint):
+                return ttl or None
+        return None
+
+    def fetch(self, method, endpoint, params, load):
+        """ Return the cached response of a request, or `load` it.
+
+        Args:
+            method (str): HTTP method.
+            endpoint (str): Endpoint of the request.
+            params (Optional[dict]): Query parameters.
+            load (callable): Sends the request; returns (response, ok)
+                where `ok` is false for error responses.
+        """
+        ttl = self.ttl(method, endpoint)
+        if ttl is None:
+            return load()[0]
+        key = self._key(method, endpoint, params)
+        found = self._lookup(key)
+        if found is not None:
+            value, refresh = found
+            if refresh:
+                threading.Thread(target=self._refresh, args=(key, ttl, load),
+                                 name='cbadv-cache-refresh', daemon=True).start()
+            return value
+        value, ok = load()
+        if ok:
+            self._store(key, value, ttl)
+        return value
+
+    async def fetch_async(self, method, endpoint, params, load):
+        """ Like `fetch`, for a coroutine function `load`. Stale entries are
+        refreshed by a task of the running loop. """
+        ttl = self.ttl(method, endpoint)
+        if ttl is None:
+            return (await load())[0]
+        key = self._key(method, endpoint, params)
+        found = self._lookup(key)
+        if found is not None:
+            value, refresh = found
+            if refresh:
+                asyncio.ensure_future(self._refresh_async(key, ttl, load))
+            return value
+        value, ok = await load()
+        if ok:
+            self._store(key, value, ttl)
+        return value
+
+    @staticmethod
+    def _key(method, endpoint, params):
+        return method.upper(), endpoint, json.dumps(params, sort_keys=True, default=str)
+
+    def _lookup(self, key):
+        """ (value, refresh) of a servable entry, None on a miss. `refresh`
+        is true when the caller has to refresh the stale entry. """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value, False
+                if now < expires + self.stale:
+                    self._entries.move_to_end(key)
+                    self._stale += 1
+                    refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                    return value, refresh
+            self._misses += 1
+        return None
+
+    def _refresh(self, key, ttl, load):
+        try:
+            # Refreshes are never urgent: they must not hold back orders.
+            with priority(BULK):
+                value, ok = load()
+            self._refreshed(key, value, ok, ttl)
+        except Exception:
+            # The stale entry expires; the next request reports the error.
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _refresh_async(self, key, ttl, load):
+        try:
+            with priority(BULK):
+                value, ok = await load()
+            self._refreshed(key, value, ok, ttl)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refreshed(self, key, value, ok, ttl):
+        if ok:
+            self._store(key, value, ttl)
+            with self._lock:
+                self._refreshes += 1
+
+    def _store(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, endpoint=None):
+        """ Drop the entries of `endpoint` and the endpoints below it.
+
+        Args:
+            endpoint (Optional[str]): e.g. '/products/BTC-USD', or
+                '/products' for every product. None drops everything.
+
+        Returns:
+            int: Entries dropped.
+        """
+        with self._lock:
+            if endpoint is None:
+                keys = list(self._entries)
+            else:
+                prefix = endpoint.rstrip('/') + '/'
+                keys = [key for key in self._entries
+                        if key[1] == endpoint or key[1].startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self):
+        """ Current `CacheStats`. """
+        with self._lock:
+            return CacheStats(self._hits, self._stale, self._misses, self._evictions,
+                              self._refreshes, len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,247 @@
+# cbadv/candles.py
+#
+#
+# Bulk historical candle downloads
+#
+# `get_product_candles` returns at most `MAX_CANDLES` candles per call. The
+# `CandleDownloader` splits any range into windows of that size, fetches the
+# windows of every product concurrently under a shared request budget, and
+# merges them into columns.
+
+import csv
+import os
+import time
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from cbadv.rate_limit import BULK, TokenBucket, priority
+
+GRANULARITIES = {
+    'ONE_MINUTE': 60,
+    'FIVE_MINUTE': 300,
+    'FIFTEEN_MINUTE': 900,
+    'THIRTY_MINUTE': 1800,
+    'ONE_HOUR': 3600,
+    'TWO_HOUR': 7200,
+    'SIX_HOUR': 21600,
+    'ONE_DAY': 86400,
+}
+
+MAX_CANDLES = 300
+
+FIELDS = ('start', 'low', 'high', 'open', 'close', 'volume')
+
+
+class Candles(namedtuple('Candles', FIELDS)):
+    """ Candles of one product as columns, oldest first.
+
+    `start` is an `array('q')` of epoch seconds, the other columns are
+    `array('d')`. Arrays support the buffer protocol, so
+    `numpy.frombuffer(candles.close)` is a free conversion.
+    """
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.start)
+
+    def rows(self):
+        return zip(*self)
+
+
+class CandleError(Exception):
+    """ Raised when windows still fail after every retry. """
+    def __init__(self, failures):
+        self.failures = failures
+        product_id, start, end, error = failures[0]
+        super(CandleError, self).__init__(
+            '{} window(s) failed, first {} [{}, {}]: {}'.format(
+                len(failures), product_id, start, end, error))
+
+
+def _seconds(granularity):
+    try:
+        return GRANULARITIES[granularity]
+    except KeyError:
+        raise ValueError('Unknown granularity: {}'.format(granularity))
+
+
+def windows(start, end, granularity, max_candles=MAX_CANDLES):
+    """ Split [start, end] into windows of at most `max_candles` candles.
+
+    Args:
+        start (int): Epoch seconds, rounded down to the granularity.
+        end (int): Epoch seconds, inclusive.
+        granularity (str): One of `GRANULARITIES`.
+
+    Returns:
+        list of (int, int): Inclusive (start, end) of each window.
+    """
+    step = _seconds(granularity)
+    start = int(start) - int(start) % step
+    end = int(end)
+    span = step * (max_candles - 1)
+    result = []
+    while start <= end:
+        result.append((start, min(start + span, end)))
+        start += span + step
+    return result
+
+
+class CandleDownloader(object):
+    """ Concurrent, rate limited, retrying candle downloads.
+
+    Every window of every product goes to one pool of `workers` threads.
+    Requests are sent at `BULK` priority through the client's rate limiter,
+    so they use the spare request budget without delaying orders.
+    Throughput is then set by that budget rather than by the round trip
+    time, as long as `workers` covers rate x latency.
+
+    Args:
+        client (Client): Client used for `get_product_candles`.
+        rate (Optional[float]): Further caps this job to `rate` requests per
+            second.
+        limiter (Optional[TokenBucket]): Further budget, shared with other
+            jobs.
+        workers (int): Concurrent requests.
+        retries (int): Attempts after the first failure of a window.
+        backoff (float): Delay before the first retry, doubled on each one.
+        max_candles (int): Candles per request.
+    """
+    def __init__(self, client, rate=None, limiter=None, workers=8, retries=3, backoff=0.5,
+                 max_candles=MAX_CANDLES):
+        self.client = client
+        if limiter is None and rate is not None:
+            limiter = TokenBucket(rate)
+        self.limiter = limiter
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_candles = max_candles
+        self.requests = 0
+        self.retried = 0
+        # Workers update the counters concurrently.
+        self._counters = Lock()
+
+    def _fetch_window(self, product_id, start, end, granularity):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            with self._counters:
+                self.requests += 1
+            try:
+                with priority(BULK):
+                    response = self.client.get_product_candles(product_id, str(start), str(end),
+                                                               granularity)
+                candles = response['candles']
+            except Exception:
+                # Error responses come back as JSON without `candles`.
+                if attempt == self.retries:
+                    raise
+                with self._counters:
+                    self.retried += 1
+                time.sleep(delay)
+                delay *= 2
+            else:
+                return candles
+
+    def _stream(self, product_ids, start, end, granularity):
+        """ Yield (product_id, Candles) in order as each product completes.
+
+        Windows are submitted in product order with at most 2 x `workers`
+        in flight, so memory holds a few windows rather than the whole range.
+        A product with a failed window is not yielded; CandleError is raised
+        once every other product has been.
+        """
+        jobs = deque((product_id, window_start, window_end)
+                     for product_id in product_ids
+                     for window_start, window_end in windows(start, end, granularity,
+                                                             self.max_candles))
+        remaining = {product_id: len(windows(start, end, granularity, self.max_candles))
+                     for product_id in product_ids}
+        pages = {product_id: [] for product_id in product_ids}
+        failures = []
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while jobs or in_flight:
+                while jobs and len(in_flight) < 2 * self.workers:
+                    job = jobs.popleft()
+                    in_flight.append((job, executor.submit(self._fetch_window, *job,
+                                                           granularity)))
+                (product_id, window_start, window_end), future = in_flight.popleft()
+                try:
+                    pages[product_id].append(future.result())
+                except Exception as e:
+                    failures.append((product_id, window_start, window_end, e))
+                remaining[product_id] -= 1
+                if not remaining[product_id]:
+                    product_pages = pages.pop(product_id)
+                    if not any(failure[0] == product_id for failure in failures):
+                        yield product_id, self._merge(product_pages, int(start), int(end))
+        if failures:
+            raise CandleError(failures)
+
+    @staticmethod
+    def _merge(pages, start, end):
+        # Windows may overlap at their bounds; the same candle is kept once.
+        by_start = {}
+        for page in pages:
+            for candle in page:
+                timestamp = int(candle['start'])
+                if start <= timestamp <= end:
+                    by_start[timestamp] = candle
+        columns = Candles(array('q'), array('d'), array('d'), array('d'), array('d'),
+                          array('d'))
+        for timestamp in sorted(by_start):
+            candle = by_start[timestamp]
+            columns.start.append(timestamp)
+            for field, column in zip(FIELDS[1:], columns[1:]):
+                column.append(float(candle[field]))
+        return columns
+
+    def fetch_many(self, product_ids, start, end, granularity='ONE_MINUTE'):
+        """ Candles of several products over [start, end].
+
+        Args:
+            product_ids (list): Products to fetch.
+            start (int): Epoch seconds.
+            end (int): Epoch seconds, inclusive.
+            granularity (str): One of `GRANULARITIES`.
+
+        Returns:
+            dict: `Candles` by product.
+
+        Raises:
+            CandleError: Some windows failed after every retry.
+        """
+        return dict(self._stream(product_ids, start, end, granularity))
+
+    def fetch(self, product_id, start, end, granularity='ONE_MINUTE'):
+        """ Candles of `product_id` over [start, end]. See `fetch_many`. """
+        return self.fetch_many([product_id], start, end, granularity)[product_id]
+
+    def download(self, product_ids, start, end, directory, granularity='ONE_MINUTE'):
+        """ Fetch candles and write one CSV file per product to `directory`.
+
+        Each file is written as soon as its product completes, so only the
+        candles of the products in progress are held in memory.
+
+        Returns:
+            dict: Path of the file written for each product.
+
+        Raises:
+            CandleError: Some windows failed after every retry. The files of
+                the other products are written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = {}
+        for product_id, candles in self._stream(product_ids, start, end, granularity):
+            path = os.path.join(directory, '{}_{}.csv'.format(product_id, granularity))
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(FIELDS)
+                writer.writerows(candles.rows())
+            paths[product_id] = path
+        return paths
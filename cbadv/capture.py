@@ -0,0 +1,468 @@
+# cbadv/capture.py
+#
+#
+# Recording and replay of raw websocket frames
+#
+# A capture file is a header followed by append-only blocks:
+#
+#   header   magic b'CBADVCAP', version                     8s H 6x
+#   block    kind, codec, count, stored size, raw size,      B B 2x I I I
+#            first and last receive time                    d d
+#            payload, zlib compressed when codec is 1
+#
+# A frames block (kind 1) holds a run of records, each the receive time
+# (epoch seconds), the frame length and the frame bytes exactly as read from
+# the socket:
+#
+#   record   time, length, frame                             d I
+#
+# A checkpoint block (kind 2) holds the JSON state of some books at that point
+# of the stream, {"time": t, "books": {product_id: [level, ...]}}, so a book
+# can be rebuilt at any time from the checkpoint before it.
+#
+# Blocks are self-delimiting, so a file cut short by a crash is readable up to
+# its last complete block.
+
+import json
+import mmap
+import os
+import queue
+import struct
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from threading import Thread
+
+from cbadv.order_book import OrderBook
+
+MAGIC = b'CBADVCAP'
+VERSION = 1
+
+FILE_HEADER = struct.Struct('<8sH6x')
+BLOCK_HEADER = struct.Struct('<BB2xIIIdd')
+RECORD_HEADER = struct.Struct('<dI')
+
+FRAMES, CHECKPOINT = 1, 2
+
+RAW, ZLIB = 0, 1
+
+_STOP = object()
+
+BlockInfo = namedtuple('BlockInfo', ['offset', 'kind', 'count', 'first_time', 'last_time',
+                                     'first_record'])
+
+
+class _Checkpoint(object):
+    __slots__ = ('timestamp', 'books')
+
+    def __init__(self, timestamp, books):
+        self.timestamp = timestamp
+        self.books = books
+
+
+class CaptureError(ValueError):
+    pass
+
+
+def _as_bytes(frame):
+    return frame if frame.__class__ is bytes else frame.encode('utf-8')
+
+
+class CaptureWriter(object):
+    """ Records raw frames with their receive time, off the receive thread.
+
+    `write` only timestamps the frame and puts it on a queue. A background
+    thread batches frames into blocks of up to `batch_size` frames, or
+    whatever arrived within `flush_interval` seconds, compresses them and
+    appends them to the file.
+
+    Args:
+        target (str or file): Path of the capture, created or appended to, or
+            a binary file object positioned where the capture starts.
+        compress (bool): Compress blocks with zlib.
+        level (int): zlib compression level; 1 keeps up with busy feeds.
+        batch_size (int): Frames per block.
+        flush_interval (float): Longest delay, in seconds, before a frame is
+            written.
+
+    Attributes:
+        frames (int): Frames written to the file.
+        blocks (int): Blocks written to the file.
+        bytes_written (int): Bytes written, headers included.
+    """
+    def __init__(self, target, compress=True, level=1, batch_size=1000, flush_interval=1.0):
+        if isinstance(target, (str, bytes, os.PathLike)):
+            self._file = open(target, 'ab')
+            self._owns_file = True
+        else:
+            assert hasattr(target, 'write')
+            self._file = target
+            self._owns_file = False
+        self.compress = compress
+        self.level = level
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self.blocks = 0
+        self.bytes_written = 0
+        self.error = None
+        if self._file.tell() == 0:
+            self._write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._queue = queue.SimpleQueue()
+        self._thread = Thread(target=self._run, name='CaptureWriter', daemon=True)
+        self._thread.start()
+
+    def write(self, frame, timestamp=None):
+        """ Queue a frame (str or bytes) received at `timestamp` (default: now). """
+        self._queue.put((time.time() if timestamp is None else timestamp, frame))
+
+    def checkpoint(self, books, timestamp=None):
+        """ Record the state of `books` at this point of the stream.
+
+        Call it from the thread that applies the frames, right after applying
+        one, so the checkpoint lands between the frames it follows and the
+        ones it precedes. Books still waiting for their snapshot are skipped.
+        Only the copy of the books is made here; they are serialized and
+        compressed by the writer thread.
+
+        Args:
+            books (dict): Books (`OrderBook` or `TickOrderBook`) by product.
+            timestamp (Optional[float]): Time of the state. Defaults to now.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        state = {product_id: book.snapshot() for product_id, book in books.items()
+                 if book._sequence != 0}
+        self._queue.put(_Checkpoint(timestamp, state))
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def _run(self):
+        get = self._queue.get
+        item = get()
+        while item is not _STOP:
+            if item.__class__ is _Checkpoint:
+                self._write_checkpoint(item)
+                item = get()
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            item = None
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                    break
+                if item is _STOP or item.__class__ is _Checkpoint:
+                    break
+                batch.append(item)
+                item = None
+            self._write_block(batch)
+            if item is None:
+                item = get()
+
+    def _write_checkpoint(self, checkpoint):
+        raw = json.dumps({'time': checkpoint.timestamp, 'books': checkpoint.books},
+                         separators=(',', ':')).encode('utf-8')
+        payload = zlib.compress(raw, self.level)
+        try:
+            self._write(BLOCK_HEADER.pack(CHECKPOINT, ZLIB, 1, len(payload),
+                                          len(raw), checkpoint.timestamp,
+                                          checkpoint.timestamp))
+            self._write(payload)
+            self._file.flush()
+        except Exception as e:
+            self.error = e
+            return
+        self.blocks += 1
+
+    def _write_block(self, batch):
+        parts = []
+        pack = RECORD_HEADER.pack
+        for timestamp, frame in batch:
+            frame = _as_bytes(frame)
+            parts.append(pack(timestamp, len(frame)))
+            parts.append(frame)
+        payload = b''.join(parts)
+        raw_size = len(payload)
+        codec = RAW
+        if self.compress:
+            payload = zlib.compress(payload, self.level)
+            codec = ZLIB
+        try:
+            self._write(BLOCK_HEADER.pack(FRAMES, codec, len(batch), len(payload), raw_size,
+                                          batch[0][0], batch[-1][0]))
+            self._write(payload)
+            self._file.flush()
+        except Exception as e:
+            self.error = e
+            return
+        self.frames += len(batch)
+        self.blocks += 1
+
+    def close(self):
+        """ Write the pending frames and close the file. """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CaptureReader(object):
+    """ Random access to a capture file.
+
+    The file is memory-mapped and only the block headers are read on open,
+    which builds a sparse index of every block: its offset, receive time
+    range and the ordinal of its first frame. Seeking to a time or to a frame
+    ordinal is a binary search on that index, followed by decompressing a
+    single block. `book_at` rebuilds a book from the nearest checkpoint
+    before the requested time plus the frames in between.
+
+    Args:
+        path (str): Capture file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = None
+        self._size = 0
+        self.blocks = []
+        self.checkpoints = []
+        self.frame_count = 0
+        self._scanned = FILE_HEADER.size
+        header = self._file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            self._file.close()
+            raise CaptureError('{} is not a capture file'.format(path))
+        magic, version = FILE_HEADER.unpack(header)
+        if magic != MAGIC:
+            self._file.close()
+            raise CaptureError('{} is not a capture file'.format(path))
+        if version > VERSION:
+            self._file.close()
+            raise CaptureError('Unsupported capture version {}'.format(version))
+        self.refresh()
+
+    def refresh(self):
+        """ Index the blocks appended since the file was opened. """
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._size:
+            return
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        self._size = size
+        unpack_from = BLOCK_HEADER.unpack_from
+        header_size = BLOCK_HEADER.size
+        offset = self._scanned
+        while offset + header_size <= size:
+            kind, codec, count, stored, raw, first, last = unpack_from(self._map, offset)
+            if offset + header_size + stored > size:
+                break
+            info = BlockInfo(offset, kind, count, first, last, self.frame_count)
+            if kind == FRAMES:
+                self.blocks.append(info)
+                self.frame_count += count
+            elif kind == CHECKPOINT:
+                self.checkpoints.append(info)
+            offset += header_size + stored
+        self._scanned = offset
+        self._last_times = [info.last_time for info in self.blocks]
+        self._offsets = [info.offset for info in self.blocks]
+        self._ordinals = [info.first_record for info in self.blocks]
+        self._checkpoint_times = [info.first_time for info in self.checkpoints]
+
+    @property
+    def start_time(self):
+        return self.blocks[0].first_time if self.blocks else None
+
+    @property
+    def end_time(self):
+        return self.blocks[-1].last_time if self.blocks else None
+
+    def _payload(self, info):
+        kind, codec, count, stored, raw, first, last = BLOCK_HEADER.unpack_from(
+            self._map, info.offset)
+        start = info.offset + BLOCK_HEADER.size
+        payload = self._map[start:start + stored]
+        if codec == ZLIB:
+            payload = zlib.decompress(payload)
+        return payload
+
+    @staticmethod
+    def _records(payload):
+        unpack_from = RECORD_HEADER.unpack_from
+        record_size = RECORD_HEADER.size
+        offset = 0
+        end = len(payload)
+        while offset < end:
+            timestamp, length = unpack_from(payload, offset)
+            offset += record_size
+            yield timestamp, payload[offset:offset + length]
+            offset += length
+
+    def frames(self, start=None, end=None, offset=None):
+        """ Yield (receive time, frame bytes) in recording order.
+
+        Args:
+            start (Optional[float]): Skip frames received before this time.
+            end (Optional[float]): Stop after the frames received at this time.
+            offset (Optional[int]): Start at the block holding this file
+                offset, as found in `checkpoints`.
+        """
+        for _, timestamp, frame in self._frames(start, end, offset):
+            yield timestamp, frame
+
+    def _frames(self, start, end, offset):
+        if offset is not None:
+            index = bisect_left(self._offsets, offset)
+        elif start is not None:
+            # Receive times only go forward, so block time ranges are sorted.
+            index = bisect_left(self._last_times, start)
+        else:
+            index = 0
+        for info in self.blocks[index:]:
+            if end is not None and info.first_time > end:
+                return
+            for timestamp, frame in self._records(self._payload(info)):
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    return
+                yield info.offset, timestamp, frame
+
+    def frame(self, ordinal):
+        """ The `ordinal`-th frame of the capture as (receive time, frame bytes). """
+        if not 0 <= ordinal < self.frame_count:
+            raise IndexError(ordinal)
+        index = bisect_right(self._ordinals, ordinal) - 1
+        info = self.blocks[index]
+        for i, record in enumerate(self._records(self._payload(info))):
+            if i == ordinal - info.first_record:
+                return record
+
+    def __iter__(self):
+        return self.frames()
+
+    def checkpoint(self, info):
+        """ Decoded state of a checkpoint block: {'time': t, 'books': {...}}. """
+        return json.loads(self._payload(info))
+
+    def book_at(self, product_id, timestamp, book_class=OrderBook, decoder=None):
+        """ Rebuild the book of `product_id` as it was at `timestamp`.
+
+        Starts from the latest checkpoint holding the product at or before
+        `timestamp`, or from the start of the capture if there is none, and
+        applies the level2 frames received up to `timestamp`.
+
+        Args:
+            product_id (str): Product of the book.
+            timestamp (float): Epoch seconds, in receive time.
+            book_class (type): Book engine.
+            decoder (Optional[object]): Frame decoder, see `cbadv.decoder`.
+
+        Returns:
+            The book. `book._sequence` is 0 when no snapshot was found.
+        """
+        return self.books_at([product_id], timestamp, book_class, decoder)[product_id]
+
+    def books_at(self, product_ids, timestamp, book_class=OrderBook, decoder=None):
+        """ Rebuild several books at `timestamp`, see `book_at`. """
+        from cbadv.decoder import get_decoder
+        decode = (decoder or get_decoder()).decode
+        books = {product_id: book_class(product_id=product_id) for product_id in product_ids}
+        # Offset of the checkpoint each book starts from; 0 for the file start.
+        since = dict.fromkeys(product_ids, 0)
+        missing = set(product_ids)
+        for info in reversed(self.checkpoints[:bisect_right(self._checkpoint_times, timestamp)]):
+            state = self.checkpoint(info)['books']
+            for product_id in list(missing):
+                if product_id in state:
+                    books[product_id].create_book(state[product_id])
+                    since[product_id] = info.offset
+                    missing.discard(product_id)
+            if not missing:
+                break
+        offset = min(since.values()) if since else None
+        for block_offset, _, frame in self._frames(None, timestamp, offset or None):
+            if b'l2_data' not in frame[:64]:
+                continue
+            for event in decode(frame)['events']:
+                product_id = event.get('product_id')
+                book = books.get(product_id)
+                if book is None or block_offset < since[product_id]:
+                    continue
+                if event['type'] == 'snapshot':
+                    book.create_book(event['updates'])
+                elif book._sequence != 0:
+                    book.update(event['updates'])
+        return books
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replay(source, client, speed=None, decode=True, start=None, end=None, sleep=time.sleep):
+    """ Feed a capture to a websocket client as if it came from the socket.
+
+    Each frame is decoded with `client.decoder` and handed to
+    `client.on_message`, so `OrderBooks` and any `WebsocketClient` subclass
+    rebuild exactly the state they had when the capture was recorded.
+
+    Args:
+        source (str or CaptureReader): Capture to replay.
+        client (WebsocketClient): Receives the frames.
+        speed (Optional[float]): 1 replays at the recorded pace, N at N times
+            that pace. None replays as fast as possible.
+        decode (bool): Decode frames with `client.decoder` first.
+        start (Optional[float]): Skip frames received before this time.
+        end (Optional[float]): Stop after the frames received at this time.
+
+    Returns:
+        int: Number of frames replayed.
+    """
+    reader = source if isinstance(source, CaptureReader) else CaptureReader(source)
+    on_message = client.on_message
+    decoder = client.decoder.decode if decode else None
+    count = 0
+    origin = None
+    try:
+        for timestamp, frame in reader.frames(start, end):
+            if speed:
+                if origin is None:
+                    origin = (timestamp, time.monotonic())
+                delay = (timestamp - origin[0]) / speed - (time.monotonic() - origin[1])
+                if delay > 0:
+                    sleep(delay)
+            on_message(decoder(frame) if decoder else frame)
+            count += 1
+    finally:
+        if reader is not source:
+            reader.close()
+    return count
@@ -6,8 +6,32 @@
 
 import requests
 import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from cbadv.cbadv_auth import CBAdvAuth
+from cbadv.connection import TIMEOUTS, PooledAdapter, RequestTiming, endpoint_class
+from cbadv.metrics import endpoint_template
+from cbadv.models import decode_response
+from cbadv.products import ProductCatalog
+from cbadv.rate_limit import BULK, default_limiter, priority
+
+
+class OrderResult(namedtuple('OrderResult', ['order', 'response', 'error'])):
+    """ Outcome of one order of `Client.place_orders`.
+
+    `response` is the JSON response, None when the request raised `error`.
+    An order is placed when `ok`: the request succeeded and the response
+    does not report a failure.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None and self.response.get('success') is not False
+
 
 class Client:
     """ Provides access to Endpoints on the coinbase advanced trade API.
@@ -19,22 +43,144 @@ class Client:
         url (str): The api url for this client instance to use.
         auth (CBAdvAuth): Custom authentication handler for each request.
         session (requests.Session): Persistent HTTP connection object.
+        rate_limiter (RateLimiter): Schedules the requests under the API
+            rate limits; shared by every client of the process by default.
+        timeouts (dict): (connect, read) timeouts by endpoint class, see
+            `cbadv.connection.TIMEOUTS`.
+        last_timing (RequestTiming): Timing of the latest request.
+        cache (Optional[ResponseCache]): Cache of reference-data responses.
+        catalog (Optional[ProductCatalog]): Product rules orders are checked
+            against before they are sent, see `load_catalog`.
+        typed (bool): Return response models rather than dicts.
+        metrics (Optional[object]): Sink of request latencies.
     """
-    def __init__(self, api_key=None, api_secret=None, api_url='https://api.coinbase.com/api/v3/brokerage'):
+    def __init__(self, api_key=None, api_secret=None, api_url='https://api.coinbase.com/api/v3/brokerage',
+                 rate_limiter=None, max_retries=2, pool_connections=4, pool_maxsize=16,
+                 timeouts=None, prewarm=0, keepalive=None, on_timing=None, cache=None,
+                 typed=False, metrics=None):
         """ Initializes a Client instance.
         
         Args:
             api_key (str): Your coinbase advanced trade API key.
             api_secret (str): Your coinbase advanced trade API secret.
             api_url (str): The api url for this client instance to use.
+            rate_limiter (Optional[RateLimiter]): Request scheduler. Defaults
+                to the one shared by the process, see `cbadv.rate_limit`.
+            max_retries (int): Times a request throttled with a 429 is sent
+                again once the limiter allows it.
+            pool_connections (int): Hosts whose connection pools are kept.
+            pool_maxsize (int or dict): Connections kept open per host; at
+                least the number of threads sharing this client. A
+                {host: size} dict sizes hosts apart, '*' setting the size of
+                the others, see `PooledAdapter`.
+            timeouts (Optional[dict]): Overrides of `TIMEOUTS`, by endpoint
+                class ('order', 'public', 'private'). A value is a number
+                or a (connect, read) tuple.
+            prewarm (int): Connections to open now, see `prewarm`.
+            keepalive (Optional[float]): Every `keepalive` seconds, reopen
+                the `prewarm` connections the server closed while idle.
+            on_timing (Optional[callable]): Called with the `RequestTiming`
+                of every request.
+            cache (Optional[ResponseCache]): Answers requests of products
+                and the transactions summary from memory, see
+                `cbadv.cache`. Off by default.
+            typed (bool): Return orders, fills, products, accounts and
+                candles as the slotted models of `cbadv.models`, whose
+                numeric fields are parsed on first access.
+            metrics (Optional[object]): Sink receiving the latency of every
+                request by endpoint, see `cbadv.metrics`.
         """
         self.url = api_url
         self.auth = CBAdvAuth(api_key, api_secret)
+        self.rate_limiter = rate_limiter or default_limiter()
+        self.max_retries = max_retries
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.on_timing = on_timing
+        self.last_timing = None
+        self.cache = cache
+        self.catalog = None
+        self.typed = typed
+        self.metrics = metrics
+        self._init_transport(pool_connections, pool_maxsize, prewarm, keepalive)
+
+    def _init_transport(self, pool_connections, pool_maxsize, prewarm, keepalive):
+        """ Set up the pooled `requests` session; see `__init__`. """
         self.session = requests.Session()
+        self.adapter = PooledAdapter(pool_connections, pool_maxsize)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.pool_maxsize = self.adapter.maxsize(self.url)
+        self._stop_keepalive = threading.Event()
+        self._keepalive_thread = None
+        if prewarm:
+            self.prewarm(prewarm)
+        if keepalive:
+            self._keepalive_thread = threading.Thread(target=self._keepalive,
+                                                      args=(prewarm or 1, keepalive),
+                                                      name='cbadv-keepalive', daemon=True)
+            self._keepalive_thread.start()
+
+    def prewarm(self, connections=1):
+        """ Open `connections` connections to the API ahead of requests.
+
+        DNS, TCP and TLS setup happen now rather than on the first order.
+        No request is sent, so the rate limit budget is untouched.
+
+        Args:
+            connections (int): Connections wanted; capped at `pool_maxsize`.
 
-    def list_accounts(self):
+        Returns:
+            int: Connections opened; those already open are not counted.
+        """
+        connect_timeout = self.timeouts['order']
+        if isinstance(connect_timeout, tuple):
+            connect_timeout = connect_timeout[0]
+        # The verify and cert settings requests will use select the pool.
+        settings = self.session.merge_environment_settings(self.url, {}, None, None, None)
+        return self.adapter.warm(self.url, min(connections, self.pool_maxsize),
+                                 connect_timeout, settings['verify'], settings['cert'])
+
+    def _keepalive(self, connections, interval):
+        while not self._stop_keepalive.wait(interval):
+            try:
+                self.prewarm(connections)
+            except Exception:
+                # Unreachable for now; the next request reports the error.
+                pass
+
+    def close(self):
+        """ Stop the keepalive thread and close pooled connections. """
+        self._stop_keepalive.set()
+        if self._keepalive_thread is not None:
+            self._keepalive_thread.join()
+            self._keepalive_thread = None
+        self.session.close()
+
+    def load_catalog(self):
+        """ Build or refresh `catalog` from `list_products`.
+
+        From then on, `create_order` and `place_orders` check orders against
+        the increments, limits and status of their product before sending
+        them. Call again to refresh; a single product can be refreshed with
+        `client.catalog.update([client.get_product(product_id)])`.
+
+        Returns:
+            ProductCatalog: `catalog`.
+        """
+        catalog = self.catalog or ProductCatalog()
+        catalog.update(self.list_products(), prune=True)
+        self.catalog = catalog
+        return catalog
+
+    def list_accounts(self, limit=None, cursor=None):
         """ List accounts.
 
+        Only one page is returned; see `iter_accounts` to read them all.
+
+        Args:
+            limit (Optional[int]): Accounts per page.
+            cursor (Optional[str]): `cursor` of the previous page.
+
         Returns:
             list of dict: JSON response
             {
@@ -64,7 +210,21 @@ class Client:
             }
 
         """
-        return self._send_message('GET', '/accounts')
+        params = _drop_none({'limit': limit, 'cursor': cursor})
+        return self._send_message('GET', '/accounts', params=params or None)
+
+    def iter_accounts(self, limit=None, prefetch=False):
+        """ Iterate over every account, fetching pages as needed.
+
+        Args:
+            limit (Optional[int]): Accounts per page.
+            prefetch (bool): Fetch the next page in the background while the
+                current one is consumed.
+
+        Yields:
+            dict: Account. See `list_accounts`.
+        """
+        return self._paginate('/accounts', 'accounts', {'limit': limit}, prefetch)
 
     def get_account(self, account_id):
         """ Get account.
@@ -184,37 +344,10 @@ class Client:
             }
 
         """
-        # Margin parameter checks
-        if kwargs.get('overdraft_enabled') is not None and \
-                kwargs.get('funding_amount') is not None:
-            raise ValueError('Margin funding must be specified through use of '
-                             'overdraft or by setting a funding amount, but not'
-                             ' both')
-
-        # Limit order checks
-        if order_type == 'limit':
-            if kwargs.get('cancel_after') is not None and \
-                    kwargs.get('time_in_force') != 'GTT':
-                raise ValueError('May only specify a cancel period when time '
-                                 'in_force is `GTT`')
-            if kwargs.get('post_only') is not None and kwargs.get('time_in_force') in \
-                    ['IOC', 'FOK']:
-                raise ValueError('post_only is invalid when time in force is '
-                                 '`IOC` or `FOK`')
-
-        # Market and stop order checks
-        if order_type == 'market' or kwargs.get('stop'):
-            if not (kwargs.get('size') is None) ^ (kwargs.get('funds') is None):
-                raise ValueError('Either `size` or `funds` must be specified '
-                                 'for market/stop orders (but not both).')
-
-        # Build params dict
-        params = {'product_id': product_id,
-                  'side': side,
-                  'type': order_type}
-        params.update(kwargs)
-
-        return self._send_message('POST', '/orders', data=json.dumps(params))
+        body = _order_body(product_id, side, order_type, **kwargs)
+        if self.catalog is not None:
+            self.catalog.validate(product_id, side, order_type, **kwargs)
+        return self._send_message('POST', '/orders', data=body)
 
     def buy(self, product_id, order_type, **kwargs):
         """Place a buy order.
@@ -408,6 +541,52 @@ class Client:
 
         return self.create_order(**params)
 
+    def place_orders(self, orders, workers=8):
+        """ Place several orders concurrently.
+
+        Every order is checked, against `catalog` too when loaded, and
+        serialized before the first one is sent, so an invalid order aborts
+        the batch with nothing placed. Orders are
+        then sent over the pooled connections by up to `workers` threads,
+        each under the rate limiter like `create_order`. A failed order does
+        not stop the others.
+
+            results = client.place_orders([
+                {'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+                 'price': price, 'size': '0.01'}
+                for price in ladder])
+            failed = [r for r in results if not r.ok]
+
+        Args:
+            orders (list of dict): Arguments of `create_order` for each order.
+            workers (int): Orders in flight at once; capped at
+                `pool_maxsize`.
+
+        Returns:
+            list of OrderResult: One per order, in the order of `orders`.
+
+        Raises:
+            ValueError: An order is invalid; its index is in the message.
+        """
+        orders = list(orders)
+        bodies = _order_bodies(orders, self.catalog)
+
+        def submit(body):
+            try:
+                return self._send_message('POST', '/orders', data=body), None
+            except Exception as e:
+                return None, e
+
+        workers = min(workers, self.pool_maxsize, len(bodies))
+        if workers <= 1:
+            outcomes = [submit(body) for body in bodies]
+        else:
+            with ThreadPoolExecutor(max_workers=workers,
+                                    thread_name_prefix='cbadv-orders') as executor:
+                outcomes = list(executor.map(submit, bodies))
+        return [OrderResult(order, response, error)
+                for order, (response, error) in zip(orders, outcomes)]
+
     def cancel_orders(self, order_ids):
         """ Cancel orders.
 
@@ -427,9 +606,24 @@ class Client:
         """
         return self._send_message('POST', '/orders/batch_cancel', data=json.dumps(order_ids))
 
-    def list_orders(self):
+    def list_orders(self, product_id=None, order_status=None, start_date=None, end_date=None,
+                    limit=None, cursor=None, **kwargs):
         """ List orders.
 
+        Only one page is returned; see `iter_orders` to read them all.
+
+        Args:
+            product_id (Optional[str]): Only orders of this product.
+            order_status (Optional[list]): Only orders with these statuses
+                (eg. ['OPEN']).
+            start_date (Optional[str]): Only orders created at or after this
+                RFC3339 time.
+            end_date (Optional[str]): Only orders created before this RFC3339
+                time.
+            limit (Optional[int]): Orders per page.
+            cursor (Optional[str]): `cursor` of the previous page.
+            **kwargs: Other filters of the endpoint (eg. `order_side`).
+
         Returns:
             dict: JSON response
             {
@@ -496,11 +690,48 @@ class Client:
                 "cursor": "789100"
             }
         """
-        return self._send_message('GET', '/orders/historical/batch')
+        params = _drop_none(dict(kwargs, product_id=product_id, order_status=order_status,
+                                 start_date=start_date, end_date=end_date, limit=limit,
+                                 cursor=cursor))
+        return self._send_message('GET', '/orders/historical/batch', params=params or None)
 
-    def list_fills(self):
+    def iter_orders(self, product_id=None, order_status=None, start_date=None, end_date=None,
+                    limit=None, prefetch=False, **kwargs):
+        """ Iterate over every order matching the filters, fetching pages as needed.
+
+        Pages are requested lazily: stopping the iteration stops the requests,
+        and memory use does not grow with the number of orders.
+
+        Args:
+            product_id, order_status, start_date, end_date, **kwargs: Filters,
+                see `list_orders`.
+            limit (Optional[int]): Orders per page.
+            prefetch (bool): Fetch the next page in the background while the
+                current one is consumed.
+
+        Yields:
+            dict: Order. See `list_orders`.
+        """
+        params = dict(kwargs, product_id=product_id, order_status=order_status,
+                      start_date=start_date, end_date=end_date, limit=limit)
+        return self._paginate('/orders/historical/batch', 'orders', params, prefetch)
+
+    def list_fills(self, order_id=None, product_id=None, start_sequence_timestamp=None,
+                   end_sequence_timestamp=None, limit=None, cursor=None):
         """ List fills.
 
+        Only one page is returned; see `iter_fills` to read them all.
+
+        Args:
+            order_id (Optional[str]): Only fills of this order.
+            product_id (Optional[str]): Only fills of this product.
+            start_sequence_timestamp (Optional[str]): Only fills at or after
+                this RFC3339 time.
+            end_sequence_timestamp (Optional[str]): Only fills before this
+                RFC3339 time.
+            limit (Optional[int]): Fills per page.
+            cursor (Optional[str]): `cursor` of the previous page.
+
         Returns:
             dict: JSON response
             {
@@ -523,7 +754,32 @@ class Client:
                 "cursor": "789100"
             }
         """
-        return self._send_message('GET', '/orders/historical/fills')
+        params = _drop_none({'order_id': order_id, 'product_id': product_id,
+                             'start_sequence_timestamp': start_sequence_timestamp,
+                             'end_sequence_timestamp': end_sequence_timestamp,
+                             'limit': limit, 'cursor': cursor})
+        return self._send_message('GET', '/orders/historical/fills', params=params or None)
+
+    def iter_fills(self, order_id=None, product_id=None, start_sequence_timestamp=None,
+                   end_sequence_timestamp=None, limit=None, prefetch=False):
+        """ Iterate over every fill matching the filters, fetching pages as needed.
+
+        Reconciling a day of fills this way holds at most two pages in memory.
+
+        Args:
+            order_id, product_id, start_sequence_timestamp,
+                end_sequence_timestamp: Filters, see `list_fills`.
+            limit (Optional[int]): Fills per page.
+            prefetch (bool): Fetch the next page in the background while the
+                current one is consumed.
+
+        Yields:
+            dict: Fill. See `list_fills`.
+        """
+        params = {'order_id': order_id, 'product_id': product_id,
+                  'start_sequence_timestamp': start_sequence_timestamp,
+                  'end_sequence_timestamp': end_sequence_timestamp, 'limit': limit}
+        return self._paginate('/orders/historical/fills', 'fills', params, prefetch)
 
     def get_order(self, order_id):
         """ Get order.
@@ -766,6 +1022,60 @@ class Client:
         }
         return self._send_message('GET', '/transactions_summary', params=params)
 
+    def _paginate(self, endpoint, key, params, prefetch=False):
+        """ Yield the `key` items of every page of a cursor paginated endpoint.
+
+        A page is the last one when it has no items, no `cursor`, or
+        `has_next` false (fills pages carry no `has_next`, only an empty
+        cursor once done).
+
+        Args:
+            endpoint (str): Endpoint (to be added to base URL)
+            key (str): Field of the response holding the items.
+            params (dict): Filters sent with every page; None values are
+                dropped.
+            prefetch (bool): Request the next page before yielding the
+                items of the current one.
+        """
+        params = _drop_none(params)
+
+        def fetch(cursor):
+            page_params = dict(params, cursor=cursor) if cursor else params
+            # Pages are bulk reads: they never hold back orders.
+            with priority(BULK):
+                return self._send_message('GET', endpoint, params=page_params or None)
+
+        def next_cursor(page):
+            cursor = page.get('cursor')
+            if not cursor or page.get('has_next') is False or not page.get(key):
+                return None
+            return cursor
+
+        if not prefetch:
+            cursor = None
+            while True:
+                page = fetch(cursor)
+                for item in page.get(key) or ():
+                    yield item
+                cursor = next_cursor(page)
+                if cursor is None:
+                    return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(fetch, None)
+            try:
+                while pending is not None:
+                    page = pending.result()
+                    cursor = next_cursor(page)
+                    pending = executor.submit(fetch, cursor) if cursor else None
+                    for item in page.get(key) or ():
+                        yield item
+            finally:
+                # Iteration stopped early: skip the page requested ahead if
+                # it has not started yet.
+                if pending is not None:
+                    pending.cancel()
+
     def _send_message(self, method, endpoint, params=None, data=None):
         """Send API request.
 
@@ -779,7 +1089,95 @@ class Client:
             dict/list: JSON response
 
         """
+        if self.cache is not None:
+            def load():
+                r = self._request(method, endpoint, params, data)
+                return r.json(), r.ok
+            response = self.cache.fetch(method, endpoint, params, load)
+        else:
+            response = self._request(method, endpoint, params, data).json()
+        if self.typed:
+            response = decode_response(method, endpoint, response)
+        return response
+
+    def _request(self, method, endpoint, params=None, data=None):
+        """ Send API request under the rate limiter; return the response. """
         url = self.url + endpoint
-        r = self.session.request(method, url, params=params, data=data,
-                                 auth=self.auth, timeout=30)
-        return r.json()
\ No newline at end of file
+        limiter = self.rate_limiter
+        timeout = self.timeouts[endpoint_class(method, endpoint)]
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            limiter.acquire(method, endpoint)
+            r = self.session.request(method, url, params=params, data=data,
+                                     auth=self.auth, timeout=timeout)
+            self._record_timing(method, endpoint, r, start)
+            if not limiter.observe(endpoint, r.status_code, r.headers):
+                break
+        return r
+
+    def _record_timing(self, method, endpoint, response, start):
+        connection = getattr(response, 'timing', None)
+        if not isinstance(connection, tuple):
+            # Not built by PooledAdapter, e.g. another adapter was mounted.
+            connection = (False, 0., 0., 0., 0.)
+        timing = RequestTiming(method, endpoint, response.status_code, *connection,
+                               total=time.perf_counter() - start)
+        self.last_timing = timing
+        if self.on_timing is not None:
+            self.on_timing(timing)
+        if self.metrics is not None:
+            self.metrics.observe('rest.latency', timing.total, {
+                'method': method.upper(), 'endpoint': endpoint_template(endpoint),
+                'status': response.status_code})
+
+
+def _order_body(product_id, side, order_type=None, **kwargs):
+    """ Check the arguments of `Client.create_order` and serialize the order. """
+    # Margin parameter checks
+    if kwargs.get('overdraft_enabled') is not None and \
+            kwargs.get('funding_amount') is not None:
+        raise ValueError('Margin funding must be specified through use of '
+                         'overdraft or by setting a funding amount, but not'
+                         ' both')
+
+    # Limit order checks
+    if order_type == 'limit':
+        if kwargs.get('cancel_after') is not None and \
+                kwargs.get('time_in_force') != 'GTT':
+            raise ValueError('May only specify a cancel period when time '
+                             'in_force is `GTT`')
+        if kwargs.get('post_only') is not None and kwargs.get('time_in_force') in \
+                ['IOC', 'FOK']:
+            raise ValueError('post_only is invalid when time in force is '
+                             '`IOC` or `FOK`')
+
+    # Market and stop order checks
+    if order_type == 'market' or kwargs.get('stop'):
+        if not (kwargs.get('size') is None) ^ (kwargs.get('funds') is None):
+            raise ValueError('Either `size` or `funds` must be specified '
+                             'for market/stop orders (but not both).')
+
+    # Build params dict
+    params = {'product_id': product_id,
+              'side': side,
+              'type': order_type}
+    params.update(kwargs)
+
+    return json.dumps(params, default=str)
+
+
+def _order_bodies(orders, catalog=None):
+    """ Serialize every order of a batch, or raise for the first invalid one. """
+    bodies = []
+    for index, order in enumerate(orders):
+        try:
+            bodies.append(_order_body(**order))
+            if catalog is not None:
+                catalog.validate(**order)
+        except (TypeError, ValueError) as e:
+            raise ValueError('order {}: {}'.format(index, e))
+    return bodies
+
+
+def _drop_none(params):
+    return dict((k, v) for k, v in params.items() if v is not None)
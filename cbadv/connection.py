@@ -0,0 +1,248 @@
+# cbadv/connection.py
+#
+#
+# HTTP connection pooling, timeouts and request timing for `Client`
+#
+# `PooledAdapter` is a `requests` transport adapter whose connections record
+# how long name resolution, the TCP connect, the TLS handshake and the wait
+# for the first response byte took. Connections can be opened ahead of time
+# and kept open, so a request after an idle period does not pay for a new
+# handshake.
+
+import socket
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from requests import Request
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.poolmanager import PoolManager
+from urllib3.util.connection import allowed_gai_family
+
+from cbadv.rate_limit import RateLimiter
+
+# (connect, read) timeouts in seconds by endpoint class. Orders fail fast so
+# the caller can decide whether to resend; a long read timeout suits large
+# history pages.
+TIMEOUTS = {
+    'order': (3.05, 10),
+    'public': (3.05, 10),
+    'private': (3.05, 30),
+}
+
+# Connections kept open per host unless set otherwise.
+POOL_MAXSIZE = 16
+
+# Probe the peer after 30 s of silence, so NAT and load balancer entries of
+# pooled connections are not expired.
+KEEPALIVE_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)] + [
+    (socket.IPPROTO_TCP, getattr(socket, name), value)
+    for name, value in (('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+    if hasattr(socket, name)
+]
+
+
+def endpoint_class(method, endpoint):
+    """ Class of an endpoint, one of the keys of `TIMEOUTS`. """
+    if (method.upper(), endpoint) in RateLimiter.HIGH_PRIORITY:
+        return 'order'
+    if endpoint.startswith(RateLimiter.PUBLIC_PREFIXES):
+        return 'public'
+    return 'private'
+
+
+class RequestTiming(namedtuple('RequestTiming', ['method', 'endpoint', 'status', 'reused',
+                                                 'dns', 'connect', 'tls', 'ttfb', 'total'])):
+    """ Timing of one request, in seconds.
+
+    `dns`, `connect` and `tls` are 0 when the request reused a pooled
+    connection. `ttfb` is the time from the request being sent to the
+    response headers being received; `total` also covers queuing for the
+    rate limiter and reading the body.
+    """
+    __slots__ = ()
+
+
+class _TimedConnectionMixin(object):
+    _dns = _connect = _tls = 0.
+    _fresh = False
+    _sent = None
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        host = self._dns_host
+        try:
+            addresses = []
+            for info in socket.getaddrinfo(host, self.port, allowed_gai_family(),
+                                           socket.SOCK_STREAM):
+                if info[4][0] not in addresses:
+                    addresses.append(info[4][0])
+        except socket.gaierror:
+            # Let urllib3 resolve again and raise its own error.
+            addresses = [host]
+        resolved = time.perf_counter()
+        # Each address in turn, as urllib3 does; the certificate is still
+        # checked against `host`.
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    sock = super(_TimedConnectionMixin, self)._new_conn()
+                    break
+                except (ConnectTimeoutError, NewConnectionError):
+                    if address == addresses[-1]:
+                        raise
+        finally:
+            self._dns_host = host
+        self._dns = resolved - start
+        self._connect = time.perf_counter() - resolved
+        return sock
+
+    def connect(self):
+        start = time.perf_counter()
+        super(_TimedConnectionMixin, self).connect()
+        self._tls = max(time.perf_counter() - start - self._dns - self._connect, 0.)
+        self._fresh = True
+
+    def request(self, *args, **kwargs):
+        super(_TimedConnectionMixin, self).request(*args, **kwargs)
+        self._sent = time.perf_counter()
+
+    def getresponse(self, *args, **kwargs):
+        response = super(_TimedConnectionMixin, self).getresponse(*args, **kwargs)
+        ttfb = time.perf_counter() - self._sent if self._sent is not None else 0.
+        if self._fresh:
+            response._cbadv_timing = (False, self._dns, self._connect, self._tls, ttfb)
+        else:
+            response._cbadv_timing = (True, 0., 0., 0., ttfb)
+        self._fresh = False
+        self._sent = None
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class _HostPoolManager(PoolManager):
+    """ `PoolManager` whose pools are sized by host. """
+    def __init__(self, host_maxsize, **kwargs):
+        super(_HostPoolManager, self).__init__(**kwargs)
+        self.host_maxsize = host_maxsize
+        self.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                       'https': _TimedHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        if request_context is None:
+            request_context = self.connection_pool_kw.copy()
+        maxsize = self.host_maxsize.get(host)
+        if maxsize is not None:
+            request_context = dict(request_context, maxsize=maxsize)
+        return super(_HostPoolManager, self)._new_pool(scheme, host, port, request_context)
+
+
+class PooledAdapter(HTTPAdapter):
+    """ `HTTPAdapter` with TCP keepalive, timed connections and pool sizes
+    by host.
+
+    `response.timing` holds (reused, dns, connect, tls, ttfb) for every
+    response it builds.
+
+    Args:
+        pool_connections (int): Hosts whose pools are cached.
+        pool_maxsize (int or dict): Connections kept open per host. Set it
+            to the number of threads sharing the client, or connections are
+            discarded after use and handshaken again. A {host: size} dict
+            sizes each host on its own; its '*' entry, `POOL_MAXSIZE` by
+            default, applies to the other hosts.
+        socket_options (Optional[list]): Options set on new sockets.
+            Defaults to TCP_NODELAY plus `KEEPALIVE_OPTIONS`.
+    """
+    def __init__(self, pool_connections=4, pool_maxsize=POOL_MAXSIZE, socket_options=None):
+        if socket_options is None:
+            socket_options = HTTPConnection.default_socket_options + KEEPALIVE_OPTIONS
+        self.socket_options = socket_options
+        if isinstance(pool_maxsize, dict):
+            self.host_maxsize = dict((host.lower(), size) for host, size in pool_maxsize.items()
+                                     if host != '*')
+            pool_maxsize = pool_maxsize.get('*', POOL_MAXSIZE)
+        else:
+            self.host_maxsize = {}
+        super(PooledAdapter, self).__init__(pool_connections=pool_connections,
+                                            pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault('socket_options', self.socket_options)
+        # As HTTPAdapter does, with the pool manager sizing pools by host.
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _HostPoolManager(self.host_maxsize, num_pools=connections,
+                                            maxsize=maxsize, block=block, **pool_kwargs)
+
+    def maxsize(self, url):
+        """ Connections kept open to the host of `url`. """
+        host = (urlsplit(url).hostname or '').lower()
+        return self.host_maxsize.get(host, self._pool_maxsize)
+
+    def build_response(self, req, resp):
+        response = super(PooledAdapter, self).build_response(req, resp)
+        response.timing = getattr(resp, '_cbadv_timing', None)
+        return response
+
+    def _pool(self, url, verify, cert):
+        # The pool requests itself will pick; its key includes TLS settings.
+        if hasattr(self, 'get_connection_with_tls_context'):
+            return self.get_connection_with_tls_context(Request('GET', url).prepare(), verify,
+                                                        cert=cert)
+        return self.get_connection(url)
+
+    def warm(self, url, connections, timeout=None, verify=True, cert=None):
+        """ Open up to `connections` connections to the host of `url`.
+
+        Idle pooled connections that the server closed are opened again;
+        connections already open are left alone. No request is sent.
+
+        Args:
+            url (str): Any url of the host.
+            connections (int): Connections wanted, at most `pool_maxsize`.
+            timeout (Optional[float]): Connect timeout.
+            verify (bool or str): TLS verification, as given to requests.
+            cert (Optional[str or tuple]): Client certificate.
+
+        Returns:
+            int: Connections opened.
+        """
+        pool = self._pool(url, verify, cert)
+        taken = []
+        opened = 0
+        try:
+            for _ in range(connections):
+                # Drops connections closed by the peer while idle.
+                conn = pool._get_conn()
+                taken.append(conn)
+                if getattr(conn, 'sock', None) is None:
+                    conn.timeout = timeout
+                    conn.connect()
+                    # Its first request is not the one that paid for it.
+                    conn._fresh = False
+                    opened += 1
+        finally:
+            for conn in taken:
+                pool._put_conn(conn)
+        return opened
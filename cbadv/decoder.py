@@ -0,0 +1,204 @@
+# cbadv/decoder.py
+#
+#
+# Pluggable JSON decoding for websocket frames
+#
+# `get_decoder()` picks the fastest installed backend: orjson, then msgspec,
+# then the standard library (msgspec for typed decoding). Every decoder
+# raises ValueError on bad input, like `json.loads`.
+
+import json
+from decimal import Decimal
+from typing import List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None
+
+
+class JsonDecoder(object):
+    """ Standard library decoder. """
+    name = 'json'
+
+    def decode(self, frame):
+        return json.loads(frame)
+
+
+class RawDecoder(object):
+    """ Passes frames through undecoded, for clients that route raw frames. """
+    name = 'raw'
+
+    def decode(self, frame):
+        return frame
+
+
+class OrjsonDecoder(object):
+    """ orjson decoder. Returns the same dicts as `JsonDecoder`. """
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('OrjsonDecoder requires the `orjson` package')
+
+    def decode(self, frame):
+        return orjson.loads(frame)
+
+
+if msgspec is not None:
+    class MappingStruct(msgspec.Struct):
+        """ Struct readable like the dict `json.loads` would have built.
+
+        Typed messages can be handed to code written for plain dicts, such as
+        `OrderBooks` and `OrderBook`.
+        """
+        def __getitem__(self, key):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+
+        def __setitem__(self, key, value):
+            setattr(self, key, value)
+
+        def __contains__(self, key):
+            return key in self.__struct_fields__
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+        def keys(self):
+            return self.__struct_fields__
+
+    def _schemas(number):
+        """ Level2 and ticker message types whose numbers decode to `number`. """
+        Level2Update = msgspec.defstruct('Level2Update', [
+            ('side', str),
+            ('price_level', number),
+            ('new_quantity', number),
+            ('event_time', Optional[str], None),
+        ], bases=(MappingStruct,))
+        Level2Event = msgspec.defstruct('Level2Event', [
+            ('type', str),
+            ('product_id', str),
+            ('updates', List[Level2Update]),
+        ], bases=(MappingStruct,))
+        Ticker = msgspec.defstruct('Ticker', [
+            ('product_id', str),
+            ('price', number),
+            ('type', Optional[str], None),
+            ('volume_24_h', Optional[number], None),
+            ('low_24_h', Optional[number], None),
+            ('high_24_h', Optional[number], None),
+            ('low_52_w', Optional[number], None),
+            ('high_52_w', Optional[number], None),
+            ('price_percent_chg_24_h', Optional[number], None),
+            ('best_bid', Optional[number], None),
+            ('best_bid_quantity', Optional[number], None),
+            ('best_ask', Optional[number], None),
+            ('best_ask_quantity', Optional[number], None),
+        ], bases=(MappingStruct,))
+        TickerEvent = msgspec.defstruct('TickerEvent', [
+            ('type', str),
+            ('tickers', List[Ticker]),
+        ], bases=(MappingStruct,))
+
+        def message(name, event):
+            return msgspec.defstruct(name, [
+                ('channel', str),
+                ('events', List[event]),
+                ('client_id', Optional[str], None),
+                ('timestamp', Optional[str], None),
+                ('sequence_num', Optional[int], None),
+            ], bases=(MappingStruct,))
+
+        return message('Level2Message', Level2Event), message('TickerMessage', TickerEvent)
+
+    _SCHEMAS = {}
+
+    def schemas(number=Decimal):
+        """ (Level2Message, TickerMessage) struct types for `number`. """
+        if number not in _SCHEMAS:
+            _SCHEMAS[number] = _schemas(number)
+        return _SCHEMAS[number]
+
+
+class MsgspecDecoder(object):
+    """ msgspec decoder, optionally typed.
+
+    Untyped, it returns plain dicts. Typed, level2 (`l2_data`) and `ticker`
+    frames are decoded straight into structs whose prices and sizes are
+    already `number` (Decimal by default, or float), in a single pass; other
+    frames stay dicts. The structs support `msg['events']`, `in` and `.get`
+    so dict-based handlers keep working.
+
+    Args:
+        typed (bool): Decode level2 and ticker frames into structs.
+        number (type): Numeric type of prices and sizes, `Decimal` or
+            `float`. Decimal keeps `OrderBook` exact; float is the fastest
+            input for `TickOrderBook`.
+    """
+    name = 'msgspec'
+
+    # The feed puts `channel` first; a cheap look at the head of the frame
+    # tells which schema applies.
+    _MARKERS = (('"l2_data"', 0), ('"ticker"', 1))
+
+    def __init__(self, typed=False, number=Decimal):
+        if msgspec is None:
+            raise ImportError('MsgspecDecoder requires the `msgspec` package')
+        self.typed = typed
+        self._generic = msgspec.json.Decoder()
+        self._typed = []
+        if typed:
+            self.name = 'msgspec-typed'
+            # Lax mode lets strings such as "123.45" decode into floats.
+            self._typed = [msgspec.json.Decoder(schema, strict=number is Decimal)
+                           for schema in schemas(number)]
+
+    def decode(self, frame):
+        try:
+            if self._typed:
+                head = frame[:64]
+                if head.__class__ is bytes:
+                    head = head.decode('utf-8', 'replace')
+                for marker, index in self._MARKERS:
+                    if marker in head:
+                        return self._typed[index].decode(frame)
+            return self._generic.decode(frame)
+        except msgspec.MsgspecError as e:
+            raise ValueError(str(e))
+
+
+def get_decoder(backend=None, typed=False, number=Decimal):
+    """ Build a frame decoder.
+
+    Args:
+        backend (Optional[str]): 'msgspec', 'orjson' or 'json'. Defaults to
+            the fastest one installed.
+        typed (bool): Decode level2 and ticker frames into typed structs.
+            Requires msgspec; see `MsgspecDecoder`.
+        number (type): Numeric type of typed prices and sizes.
+
+    Returns:
+        An object with a `decode(frame)` method.
+    """
+    if backend is None:
+        if typed or orjson is None:
+            backend = 'msgspec' if msgspec is not None else 'json'
+        else:
+            backend = 'orjson'
+    if typed and backend != 'msgspec':
+        raise ValueError('Typed decoding requires the msgspec backend')
+    if backend == 'msgspec':
+        return MsgspecDecoder(typed, number)
+    if backend == 'orjson':
+        return OrjsonDecoder()
+    if backend == 'json':
+        return JsonDecoder()
+    raise ValueError('Unknown decoder backend: {}'.format(backend))
@@ -0,0 +1,292 @@
+# cbadv/metrics.py
+#
+#
+# Latency and throughput metrics
+#
+# `WebsocketClient`, `AsyncWebsocketClient`, `OrderBooks`, `Client` and
+# `AsyncClient` take a `metrics` sink. Without one (the default) they skip
+# every measurement after a single `is None` test. A sink receives:
+#
+#   ws.latency     exchange `timestamp` of a message to its receipt (channel)
+#   ws.decode      frame decoding (channel)
+#   ws.handler     `on_message` (channel)
+#   ws.queue_depth messages waiting in an `AsyncWebsocketClient` (gauge)
+#   book.apply     one event applied to an order book (product_id)
+#   ws.reconnect   failure to new connection of a `WebsocketClient` (failover)
+#   rest.latency   REST request, rate limiter wait included (method,
+#                  endpoint, status)
+#
+# Durations are in seconds. Any object with `observe(name, value, tags)`
+# and `gauge(name, value, tags)` is a sink; `HistogramSink` keeps histograms
+# in process, `PrometheusSink` renders them in the Prometheus text format
+# and `StatsdSink` sends them to a statsd agent.
+
+import math
+import random
+import socket
+import threading
+from array import array
+
+IDENTIFIED = ('accounts', 'products')
+
+
+def endpoint_template(endpoint):
+    """ `endpoint` with ids replaced, e.g. '/products/{id}/candles'.
+
+    Keeps the number of distinct `rest.latency` tags bounded.
+    """
+    segments = endpoint.split('/')
+    for i in range(2, len(segments)):
+        previous = segments[i - 1]
+        if previous in IDENTIFIED or (previous == 'historical' and
+                                      segments[i] not in ('batch', 'fills')):
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+class Histogram(object):
+    """ Log-bucketed histogram, in the manner of HdrHistogram.
+
+    Values between `lowest` and `highest` are counted in buckets whose
+    width is `precision` times their value, so a percentile is within that
+    relative error whatever the distribution. Recording is O(1) and memory
+    is fixed (about 2,000 buckets with the defaults).
+
+    Args:
+        lowest (float): Smallest value told apart from 0.
+        highest (float): Values above are counted as `highest`.
+        precision (float): Relative width of a bucket.
+    """
+    def __init__(self, lowest=1e-7, highest=1e3, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self._log_base = math.log1p(precision)
+        self._growth = 1 + precision
+        self._size = int(math.log(highest / lowest) / self._log_base) + 2
+        self.counts = array('q', bytes(8 * self._size))
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = -math.inf
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return min(int(math.log(value / self.lowest) / self._log_base) + 1, self._size - 1)
+
+    def record(self, value):
+        index = self._index(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, p):
+        """ Value under which `p` percent of the recorded values fall. """
+        if not self.count:
+            return 0.
+        rank = max(1, int(math.ceil(p / 100. * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == self._size - 1:
+                    # Values above `highest` share the last bucket.
+                    return self.max
+                upper = self.lowest * self._growth ** index if index else self.lowest
+                return max(self.min, min(upper, self.max))
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def merge(self, other):
+        """ Add the values of a histogram with the same layout. """
+        with self._lock:
+            for index, count in enumerate(other.counts):
+                if count:
+                    self.counts[index] += count
+            self.count += other.count
+            self.total += other.total
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def reset(self):
+        with self._lock:
+            self.counts = array('q', bytes(8 * self._size))
+            self.count = 0
+            self.total = 0.
+            self.min = math.inf
+            self.max = -math.inf
+
+
+def _key(name, tags):
+    return name, tuple(sorted(tags.items())) if tags else ()
+
+
+class HistogramSink(object):
+    """ Keeps one `Histogram` per metric name and tags, and the last value
+    of every gauge.
+
+        sink = HistogramSink()
+        books = OrderBooks(key, secret, product_id=['BTC-USD'], metrics=sink)
+        ...
+        sink.summary()['book.apply', (('product_id', 'BTC-USD'),)]['p99']
+
+    Args:
+        **histogram_options: Arguments of `Histogram`.
+    """
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, **histogram_options):
+        self.histogram_options = histogram_options
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, tags=None):
+        key = _key(name, tags)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(**self.histogram_options)
+        histogram.record(value)
+
+    def gauge(self, name, value, tags=None):
+        self.gauges[_key(name, tags)] = value
+
+    def histogram(self, name, **tags):
+        """ Histogram of `name` and exactly `tags`, None if never observed. """
+        return self.histograms.get(_key(name, tags))
+
+    def summary(self, percentiles=PERCENTILES):
+        """ Count, mean, max and percentiles of every histogram.
+
+        Returns:
+            dict: By (name, tags), a dict with 'count', 'mean', 'max' and
+            'p<percentile>' entries.
+        """
+        result = {}
+        for key, histogram in list(self.histograms.items()):
+            entry = {'count': histogram.count, 'mean': histogram.mean,
+                     'max': histogram.max if histogram.count else 0.}
+            for p in percentiles:
+                entry['p{:g}'.format(p)] = histogram.percentile(p)
+            result[key] = entry
+        return result
+
+    def reset(self):
+        for histogram in list(self.histograms.values()):
+            histogram.reset()
+
+
+def _prometheus_labels(tags, extra=()):
+    labels = list(tags) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                               .replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+
+class PrometheusSink(HistogramSink):
+    """ `HistogramSink` rendered in the Prometheus text exposition format.
+
+    Histograms become summaries named `<prefix>_<name>_seconds`, gauges
+    `<prefix>_<name>`. Serve `render()` from any HTTP handler.
+    """
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, prefix='cbadv', **histogram_options):
+        super(PrometheusSink, self).__init__(**histogram_options)
+        self.prefix = prefix
+
+    def _name(self, name):
+        return '{}_{}'.format(self.prefix, name.replace('.', '_'))
+
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, tags), histogram in sorted(self.histograms.items()):
+            by_name.setdefault(name, []).append((tags, histogram))
+        for name, series in by_name.items():
+            metric = self._name(name) + '_seconds'
+            lines.append('# TYPE {} summary'.format(metric))
+            for tags, histogram in series:
+                for quantile in self.QUANTILES:
+                    lines.append('{}{} {!r}'.format(
+                        metric, _prometheus_labels(tags, [('quantile', quantile)]),
+                        histogram.percentile(quantile * 100)))
+                lines.append('{}_sum{} {!r}'.format(metric, _prometheus_labels(tags),
+                                                    histogram.total))
+                lines.append('{}_count{} {}'.format(metric, _prometheus_labels(tags),
+                                                    histogram.count))
+        gauges = {}
+        for (name, tags), value in sorted(self.gauges.items()):
+            gauges.setdefault(name, []).append((tags, value))
+        for name, series in gauges.items():
+            metric = self._name(name)
+            lines.append('# TYPE {} gauge'.format(metric))
+            for tags, value in series:
+                lines.append('{}{} {!r}'.format(metric, _prometheus_labels(tags), value))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdSink(object):
+    """ Sends metrics to a statsd agent over UDP.
+
+    Durations are sent as timers in milliseconds, gauges as gauges; tags
+    use the DogStatsD `|#name:value` extension. With `sample_rate` < 1 only
+    that share of the durations is sent, flagged with `|@rate` so the agent
+    scales the counts back.
+
+    Args:
+        host (str): Agent host.
+        port (int): Agent UDP port.
+        prefix (str): Prepended to every metric name.
+        sample_rate (float): Share of durations sent.
+    """
+    def __init__(self, host='127.0.0.1', port=8125, prefix='cbadv', sample_rate=1.):
+        self.address = (host, port)
+        self.prefix = prefix + '.' if prefix else ''
+        self.sample_rate = sample_rate
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    @staticmethod
+    def _tags(tags):
+        if not tags:
+            return ''
+        return '|#' + ','.join('{}:{}'.format(name, value) for name, value in tags.items())
+
+    def _send(self, line):
+        try:
+            self._socket.sendto(line.encode(), self.address)
+        except OSError:
+            # Metrics are best effort: a full buffer or absent agent is ignored.
+            pass
+
+    def observe(self, name, value, tags=None):
+        rate = self.sample_rate
+        if rate < 1:
+            if random.random() >= rate:
+                return
+            self._send('{}{}:{:.3f}|ms|@{}{}'.format(self.prefix, name, value * 1000, rate,
+                                                    self._tags(tags)))
+        else:
+            self._send('{}{}:{:.3f}|ms{}'.format(self.prefix, name, value * 1000,
+                                                self._tags(tags)))
+
+    def gauge(self, name, value, tags=None):
+        self._send('{}{}:{}|g{}'.format(self.prefix, name, value, self._tags(tags)))
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,637 @@
+# cbadv/mock_server.py
+#
+#
+# Local stand-in for the Advanced Trade REST API and websocket feed
+#
+# `MockExchange` serves the REST endpoints used by `Client` and the level2 and
+# ticker channels used by `WebsocketClient` on 127.0.0.1, so tests and
+# benchmarks run without network access or credentials. Feeds are generated
+# at a set message rate; a request rate limit and faults (errors, latency,
+# dropped messages, disconnects) can be switched on at any time.
+#
+#     with MockExchange(rate=1000) as exchange:
+#         client = Client('key', 'secret', api_url=exchange.rest_url)
+#         books = OrderBooks('key', 'secret', product_id=['BTC-USD'])
+#         books.url = exchange.ws_url
+#
+# Run `python -m cbadv.mock_server --port 8080` to serve it on its own.
+#
+# Requires the `aiohttp` package (pip install cbadv[async]).
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+try:
+    from aiohttp import WSMsgType, web
+except ImportError:  # pragma: no cover - optional dependency
+    web = None
+
+from cbadv.candles import GRANULARITIES
+from cbadv.rate_limit import TokenBucket
+
+API_PATH = '/api/v3/brokerage'
+
+CHANNELS = ('level2', 'ticker')
+
+PRODUCTS = {
+    'BTC-USD': 26000.,
+    'ETH-USD': 1800.,
+    'SOL-USD': 20.,
+    'LTC-USD': 90.,
+}
+
+def _timestamp(now=None):
+    now = datetime.now(timezone.utc) if now is None else now
+    return now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class Faults(object):
+    """ Faults injected by a `MockExchange`. Change them at any time.
+
+    Attributes:
+        error_rate (float): Share of REST requests answered with a 500.
+        latency (float): Seconds added before every REST response.
+        drop_rate (float): Share of feed updates not sent, leaving a gap in
+            `sequence_num`.
+        disconnect_after (Optional[int]): Close every websocket after it has
+            sent this many messages.
+    """
+    def __init__(self, error_rate=0., latency=0., drop_rate=0., disconnect_after=None):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.disconnect_after = disconnect_after
+
+
+class MockBook(object):
+    """ Level2 book of one product, random walking around its mid.
+
+    Prices are whole ticks of 0.01; most updates land near the top.
+    """
+    def __init__(self, product_id, price, rng, depth=50):
+        self.product_id = product_id
+        self.rng = rng
+        self.depth = depth
+        self.mid = int(round(price * 100))
+        self.volume = 0.
+
+    @staticmethod
+    def _level(side, tick, size):
+        return {'side': side, 'event_time': _timestamp(),
+                'price_level': '{}.{:02d}'.format(tick // 100, tick % 100),
+                'new_quantity': size}
+
+    def snapshot(self):
+        rng = self.rng
+        updates = [self._level('bid', self.mid - i, '{:.8f}'.format(rng.random()))
+                   for i in range(1, self.depth + 1)]
+        updates += [self._level('offer', self.mid + i, '{:.8f}'.format(rng.random()))
+                    for i in range(self.depth)]
+        return updates
+
+    def update(self):
+        rng = self.rng
+        self.mid += rng.choice((-1, 0, 0, 1))
+        updates = []
+        for _ in range(rng.randint(1, 4)):
+            side = rng.choice(('bid', 'offer'))
+            distance = min(int(rng.expovariate(0.1)), self.depth - 1)
+            tick = self.mid - 1 - distance if side == 'bid' else self.mid + distance
+            size = '0' if rng.random() < 0.3 else '{:.8f}'.format(rng.random())
+            updates.append(self._level(side, tick, size))
+        self.volume += rng.random()
+        return updates
+
+    @property
+    def price(self):
+        return '{}.{:02d}'.format(self.mid // 100, self.mid % 100)
+
+    def ticker(self):
+        return {'type': 'ticker', 'product_id': self.product_id, 'price': self.price,
+                'volume_24_h': '{:.8f}'.format(self.volume),
+                'best_bid': '{:.2f}'.format((self.mid - 1) / 100.),
+                'best_ask': self.price}
+
+
+class _Connection(object):
+    """ State of one websocket connection. """
+    def __init__(self, ws, exchange):
+        self.ws = ws
+        self.subscriptions = {channel: [] for channel in CHANNELS}
+        self.books = {}
+        self.outbox = deque()
+        self.sequence = itertools.count()
+        self.sent = 0
+        self.exchange = exchange
+
+    def book(self, product_id):
+        book = self.books.get(product_id)
+        if book is None:
+            exchange = self.exchange
+            seed = '{}:{}:{}'.format(exchange.seed, product_id, exchange.connections)
+            book = self.books[product_id] = MockBook(
+                product_id, exchange.products.get(product_id, 100.), random.Random(seed),
+                exchange.depth)
+        return book
+
+    def streams(self):
+        return [(channel, product_id) for channel in CHANNELS
+                for product_id in self.subscriptions[channel]]
+
+
+class MockExchange(object):
+    """ Coinbase Advanced Trade API served from a background thread.
+
+    Every websocket connection has its own books, so the books rebuilt by a
+    client always match the stream it received. Orders placed over REST
+    are kept in memory: limit orders stay open, market orders fill at once.
+
+    Args:
+        products (Optional[dict]): Starting price by product id.
+        rate (Optional[float]): Feed messages per second and connection,
+            spread over its subscriptions. None sends as fast as possible.
+        depth (int): Levels per side of the level2 snapshots.
+        rate_limit (Optional[float]): REST requests per second; requests
+            over it get a 429 with a Retry-After header.
+        faults (Optional[Faults]): Faults to inject.
+        api_secret (Optional[str]): When set, request signatures are checked.
+        host (str): Interface to listen on.
+        port (int): Port to listen on; 0 picks a free one.
+        seed (int): Seed of the generated feeds.
+
+    Attributes:
+        requests (int): REST requests received.
+        throttled (int): Requests answered with a 429.
+        connections (int): Websocket connections accepted.
+        messages (int): Feed messages sent.
+    """
+    def __init__(self, products=None, rate=100., depth=50, rate_limit=None, faults=None,
+                 api_secret=None, host='127.0.0.1', port=0, seed=42):
+        if web is None:
+            raise ImportError('MockExchange requires the `aiohttp` package')
+        self.products = dict(products or PRODUCTS)
+        self.rate = rate
+        self.depth = depth
+        self.rate_limit = TokenBucket(rate_limit) if rate_limit else None
+        self.faults = faults or Faults()
+        self.api_secret = api_secret
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.requests = 0
+        self.throttled = 0
+        self.connections = 0
+        self.messages = 0
+        self.orders = {}
+        self.fills = []
+        self._rng = random.Random(seed)
+        self._books = {product_id: MockBook(product_id, price, random.Random(seed))
+                       for product_id, price in self.products.items()}
+        self._sockets = set()
+        self._loop = None
+        self._thread = None
+        self._runner = None
+
+    @property
+    def rest_url(self):
+        return 'http://{}:{}{}'.format(self.host, self.port, API_PATH)
+
+    @property
+    def ws_url(self):
+        return 'ws://{}:{}'.format(self.host, self.port)
+
+    # Server lifecycle
+
+    def _app(self):
+        @web.middleware
+        async def middleware(request, handler):
+            if request.path == '/':
+                return await handler(request)
+            return await self._rest(request, handler)
+
+        app = web.Application(middlewares=[middleware])
+        app.router.add_get('/', self._feed)
+        routes = [
+            ('GET', '/accounts', self._list_accounts),
+            ('GET', '/accounts/{account_id}', self._get_account),
+            ('POST', '/orders', self._create_order),
+            ('POST', '/orders/batch_cancel', self._cancel_orders),
+            ('GET', '/orders/historical/batch', self._list_orders),
+            ('GET', '/orders/historical/fills', self._list_fills),
+            ('GET', '/orders/historical/{order_id}', self._get_order),
+            ('GET', '/products', self._list_products),
+            ('GET', '/products/{product_id}', self._get_product),
+            ('GET', '/products/{product_id}/candles', self._get_candles),
+            ('GET', '/products/{product_id}/trades', self._get_trades),
+            ('GET', '/transactions_summary', self._transactions_summary),
+            ('GET', '/time', self._time),
+        ]
+        for method, path, handler in routes:
+            app.router.add_route(method, API_PATH + path, handler)
+        return app
+
+    async def _serve(self, ready):
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        ready.set()
+
+    def start(self):
+        """ Serve from a daemon thread; returns once the port is bound. """
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.create_task(self._serve(ready))
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='cbadv-mock-exchange', daemon=True)
+        self._thread.start()
+        if not ready.wait(10):
+            raise RuntimeError('MockExchange did not start')
+        return self
+
+    def stop(self):
+        """ Close every connection and stop the server thread. """
+        if self._thread is None:
+            return
+
+        async def shutdown():
+            for ws in list(self._sockets):
+                await ws.close()
+            await self._runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+
+    def disconnect_all(self):
+        """ Close every websocket now, as a network failure would. """
+        async def close():
+            for ws in list(self._sockets):
+                await ws.close()
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result(10)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # REST
+
+    async def _rest(self, request, handler):
+        self.requests += 1
+        faults = self.faults
+        if faults.latency:
+            await asyncio.sleep(faults.latency)
+        if self.rate_limit is not None and not self.rate_limit.try_acquire():
+            self.throttled += 1
+            retry_after = 1. / self.rate_limit.rate
+            return web.json_response({'error': 'rate_limit_exceeded'}, status=429,
+                                     headers={'Retry-After': '{:.3f}'.format(retry_after)})
+        if faults.error_rate and self._rng.random() < faults.error_rate:
+            return web.json_response({'error': 'INTERNAL', 'message': 'injected fault'},
+                                     status=500)
+        if not await self._authenticated(request):
+            return web.json_response({'error': 'unauthorized'}, status=401)
+        return await handler(request)
+
+    async def _authenticated(self, request):
+        if self.api_secret is None:
+            return True
+        headers = request.headers
+        body = await request.text()
+        message = headers.get('CB-ACCESS-TIMESTAMP', '') + request.method + \
+            request.raw_path + body
+        expected = hmac.new(self.api_secret.encode(), message.encode(),
+                            hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, headers.get('CB-ACCESS-SIGN', ''))
+
+    @staticmethod
+    def _page(request, items, key, limit=100):
+        limit = int(request.query.get('limit') or limit)
+        start = int(request.query.get('cursor') or 0)
+        end = start + limit
+        more = end < len(items)
+        return {key: items[start:end], 'has_next': more, 'cursor': str(end) if more else ''}
+
+    def _product(self, product_id):
+        book = self._books[product_id]
+        base, quote = product_id.split('-')
+        return {'product_id': product_id, 'price': book.price,
+                'volume_24h': '{:.8f}'.format(book.volume),
+                'base_increment': '0.00000001', 'quote_increment': '0.01',
+                'base_min_size': '0.000001', 'base_max_size': '10000',
+                'quote_min_size': '1', 'quote_max_size': '10000000',
+                'base_name': base, 'quote_name': quote, 'status': 'online',
+                'trading_disabled': False, 'is_disabled': False, 'cancel_only': False,
+                'limit_only': False, 'post_only': False, 'auction_mode': False,
+                'product_type': 'SPOT', 'base_currency_id': base, 'quote_currency_id': quote,
+                'mid_market_price': book.price}
+
+    def _accounts(self):
+        currencies = sorted({currency for product_id in self.products
+                             for currency in product_id.split('-')})
+        return [{'uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, currency)),
+                 'name': currency + ' Wallet', 'currency': currency,
+                 'available_balance': {'value': '1000000', 'currency': currency},
+                 'hold': {'value': '0', 'currency': currency},
+                 'default': True, 'active': True, 'type': 'ACCOUNT_TYPE_CRYPTO', 'ready': True}
+                for currency in currencies]
+
+    async def _list_accounts(self, request):
+        return web.json_response(self._page(request, self._accounts(), 'accounts', 49))
+
+    async def _get_account(self, request):
+        for account in self._accounts():
+            if account['uuid'] == request.match_info['account_id']:
+                return web.json_response({'account': account})
+        return web.json_response({'error': 'NOT_FOUND'}, status=404)
+
+    async def _create_order(self, request):
+        body = await request.json()
+        product_id = body.get('product_id')
+        if product_id not in self._books:
+            return web.json_response({
+                'success': False, 'failure_reason': 'UNKNOWN_FAILURE_REASON',
+                'error_response': {'error': 'INVALID_PRODUCT_ID',
+                                   'message': 'Unknown product: {}'.format(product_id)}})
+        order_id = str(uuid.uuid4())
+        book = self._books[product_id]
+        market = body.get('type') == 'market'
+        price = book.price if market else str(body.get('price') or book.price)
+        size = body.get('size') or '{:.8f}'.format(float(body.get('funds', 0)) / float(price))
+        order = {'order_id': order_id, 'product_id': product_id, 'side': body.get('side', '').upper(),
+                 'client_order_id': body.get('client_oid', ''),
+                 'status': 'FILLED' if market else 'OPEN', 'time_in_force': 'GOOD_UNTIL_CANCELLED',
+                 'created_time': _timestamp(), 'completion_percentage': '100' if market else '0',
+                 'filled_size': str(size) if market else '0',
+                 'average_filled_price': price if market else '0',
+                 'number_of_fills': '1' if market else '0', 'pending_cancel': False,
+                 'size_in_quote': False, 'order_type': 'MARKET' if market else 'LIMIT',
+                 'product_type': 'SPOT', 'limit_price': price, 'size': str(size)}
+        self.orders[order_id] = order
+        if market:
+            self.fills.append({'entry_id': str(uuid.uuid4()), 'trade_id': str(uuid.uuid4()),
+                               'order_id': order_id, 'trade_time': order['created_time'],
+                               'trade_type': 'FILL', 'price': price, 'size': str(size),
+                               'commission': '0', 'product_id': product_id,
+                               'sequence_timestamp': order['created_time'],
+                               'liquidity_indicator': 'TAKER', 'size_in_quote': False,
+                               'side': order['side']})
+        return web.json_response({
+            'success': True, 'failure_reason': 'UNKNOWN_FAILURE_REASON', 'order_id': order_id,
+            'success_response': {'order_id': order_id, 'product_id': product_id,
+                                 'side': order['side'],
+                                 'client_order_id': order['client_order_id']}})
+
+    async def _cancel_orders(self, request):
+        body = await request.json()
+        order_ids = body.get('order_ids', []) if isinstance(body, dict) else body
+        results = []
+        for order_id in order_ids:
+            order = self.orders.get(order_id)
+            if order is not None and order['status'] == 'OPEN':
+                order['status'] = 'CANCELLED'
+                results.append({'success': True, 'failure_reason': 'UNKNOWN_CANCEL_FAILURE_REASON',
+                                'order_id': order_id})
+            else:
+                results.append({'success': False, 'failure_reason': 'UNKNOWN_CANCEL_ORDER',
+                                'order_id': order_id})
+        return web.json_response({'results': results})
+
+    async def _list_orders(self, request):
+        orders = list(self.orders.values())
+        product_id = request.query.get('product_id')
+        if product_id:
+            orders = [order for order in orders if order['product_id'] == product_id]
+        statuses = request.query.getall('order_status', [])
+        if statuses:
+            orders = [order for order in orders if order['status'] in statuses]
+        return web.json_response(dict(self._page(request, orders, 'orders'), sequence='0'))
+
+    async def _list_fills(self, request):
+        fills = self.fills
+        for field in ('order_id', 'product_id'):
+            value = request.query.get(field)
+            if value:
+                fills = [fill for fill in fills if fill[field] == value]
+        page = self._page(request, fills, 'fills')
+        del page['has_next']
+        return web.json_response(page)
+
+    async def _get_order(self, request):
+        order = self.orders.get(request.match_info['order_id'])
+        if order is None:
+            return web.json_response({'error': 'NOT_FOUND'}, status=404)
+        return web.json_response({'order': order})
+
+    async def _list_products(self, request):
+        products = [self._product(product_id) for product_id in self._books]
+        return web.json_response({'products': products, 'num_products': len(products)})
+
+    async def _get_product(self, request):
+        product_id = request.match_info['product_id']
+        if product_id not in self._books:
+            return web.json_response({'error': 'NOT_FOUND'}, status=404)
+        return web.json_response(self._product(product_id))
+
+    async def _get_candles(self, request):
+        product_id = request.match_info['product_id']
+        step = GRANULARITIES.get(request.query.get('granularity'))
+        if product_id not in self._books or step is None:
+            return web.json_response({'error': 'INVALID_ARGUMENT'}, status=400)
+        start = int(request.query['start'])
+        end = int(request.query['end'])
+        times = range(start - start % step, end + 1, step)
+        if len(times) > 300:
+            return web.json_response({'error': 'INVALID_ARGUMENT',
+                                      'message': 'at most 300 candles per request'}, status=400)
+        base = self.products[product_id]
+        candles = []
+        for t in reversed(times):
+            # Deterministic in time, so overlapping windows agree.
+            rng = random.Random('{}:{}:{}'.format(product_id, step, t))
+            open_, close = (base * (1 + rng.uniform(-0.01, 0.01)) for _ in range(2))
+            candles.append({'start': str(t), 'open': '{:.2f}'.format(open_),
+                            'close': '{:.2f}'.format(close),
+                            'low': '{:.2f}'.format(min(open_, close) * 0.999),
+                            'high': '{:.2f}'.format(max(open_, close) * 1.001),
+                            'volume': '{:.8f}'.format(rng.random() * 100)})
+        return web.json_response({'candles': candles})
+
+    async def _get_trades(self, request):
+        product_id = request.match_info['product_id']
+        if product_id not in self._books:
+            return web.json_response({'error': 'NOT_FOUND'}, status=404)
+        book = self._books[product_id]
+        limit = int(request.query.get('limit') or 100)
+        trades = [{'trade_id': str(i), 'product_id': product_id, 'price': book.price,
+                   'size': '{:.8f}'.format(self._rng.random()), 'time': _timestamp(),
+                   'side': self._rng.choice(('BUY', 'SELL'))} for i in range(limit)]
+        return web.json_response({'trades': trades, 'best_bid': book.price,
+                                  'best_ask': book.price})
+
+    async def _transactions_summary(self, request):
+        return web.json_response({
+            'total_volume': 0, 'total_fees': 0,
+            'fee_tier': {'pricing_tier': '<$10k', 'usd_from': '0', 'usd_to': '10,000',
+                         'taker_fee_rate': '0.0060', 'maker_fee_rate': '0.0040'},
+            'advanced_trade_only_volume': 0, 'advanced_trade_only_fees': 0,
+            'coinbase_pro_volume': 0, 'coinbase_pro_fees': 0})
+
+    async def _time(self, request):
+        now = datetime.now(timezone.utc)
+        return web.json_response({'iso': _timestamp(now), 'epochSeconds': str(int(now.timestamp())),
+                                  'epochMillis': str(int(now.timestamp() * 1000))})
+
+    # Websocket feed
+
+    async def _feed(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        self._sockets.add(ws)
+        connection = _Connection(ws, self)
+        sender = asyncio.ensure_future(self._stream(connection))
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    self._control(connection, msg.data)
+                elif msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            # The cancellation propagates out of `_stream`, which holds nothing.
+            sender.cancel()
+            self._sockets.discard(ws)
+        return ws
+
+    def _control(self, connection, data):
+        try:
+            msg = json.loads(data)
+            message_type = msg['type']
+            channel = msg['channel']
+            product_ids = list(msg['product_ids'])
+        except (ValueError, KeyError, TypeError):
+            connection.outbox.append({'type': 'error', 'message': 'malformed message'})
+            return
+        if channel not in CHANNELS or message_type not in ('subscribe', 'unsubscribe'):
+            connection.outbox.append({'type': 'error',
+                                      'message': 'unsupported: {} {}'.format(message_type,
+                                                                            channel)})
+            return
+        subscribed = connection.subscriptions[channel]
+        for product_id in product_ids:
+            if message_type == 'subscribe' and product_id not in subscribed:
+                subscribed.append(product_id)
+            elif message_type == 'unsubscribe' and product_id in subscribed:
+                subscribed.remove(product_id)
+        connection.outbox.append({'channel': 'subscriptions', 'events': [{'subscriptions': {
+            name: list(products) for name, products in connection.subscriptions.items()
+            if products}}]})
+        if message_type == 'subscribe' and channel == 'level2':
+            for product_id in product_ids:
+                connection.outbox.append({'channel': 'l2_data', 'events': [{
+                    'type': 'snapshot', 'product_id': product_id,
+                    'updates': connection.book(product_id).snapshot()}]})
+
+    def _message(self, connection, channel, product_id):
+        book = connection.book(product_id)
+        if channel == 'level2':
+            return {'channel': 'l2_data', 'events': [{
+                'type': 'update', 'product_id': product_id, 'updates': book.update()}]}
+        book.update()
+        return {'channel': 'ticker', 'events': [{'type': 'update', 'tickers': [book.ticker()]}]}
+
+    async def _send(self, connection, msg, droppable=False):
+        sequence_num = next(connection.sequence)
+        if droppable and self.faults.drop_rate and self._rng.random() < self.faults.drop_rate:
+            return
+        msg['client_id'] = ''
+        msg['timestamp'] = _timestamp()
+        msg['sequence_num'] = sequence_num
+        await connection.ws.send_str(json.dumps(msg))
+        connection.sent += 1
+        self.messages += 1
+        limit = self.faults.disconnect_after
+        if limit is not None and connection.sent >= limit:
+            await connection.ws.close()
+
+    async def _stream(self, connection):
+        loop = asyncio.get_event_loop()
+        ws = connection.ws
+        generated = 0
+        start = loop.time()
+        cycle = 0
+        try:
+            while not ws.closed:
+                while connection.outbox and not ws.closed:
+                    await self._send(connection, connection.outbox.popleft())
+                streams = connection.streams()
+                if not streams:
+                    generated, start = 0, loop.time()
+                    await asyncio.sleep(0.001)
+                    continue
+                rate = self.rate
+                if rate:
+                    due = min(int((loop.time() - start) * rate) - generated, 1000)
+                    if due <= 0:
+                        await asyncio.sleep(min(1. / rate, 0.01))
+                        continue
+                else:
+                    due = 100
+                for _ in range(due):
+                    if ws.closed or connection.outbox:
+                        break
+                    channel, product_id = streams[cycle % len(streams)]
+                    cycle += 1
+                    generated += 1
+                    await self._send(connection, self._message(connection, channel, product_id),
+                                     droppable=True)
+                if not rate:
+                    await asyncio.sleep(0)
+        except ConnectionResetError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local Advanced Trade mock API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate', type=float, default=100.,
+                        help='feed messages per second and connection, 0 for unlimited')
+    parser.add_argument('--rate-limit', type=float, help='REST requests per second')
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--drop-rate', type=float, default=0.)
+    args = parser.parse_args()
+    faults = Faults(args.error_rate, args.latency, args.drop_rate)
+    exchange = MockExchange(rate=args.rate or None, rate_limit=args.rate_limit, faults=faults,
+                            host=args.host, port=args.port)
+    with exchange:
+        print('REST {}\nwebsocket {}'.format(exchange.rest_url, exchange.ws_url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# cbadv/models.py
+#
+#
+# Typed response models
+#
+# A `Client(typed=True)` returns orders, fills, products, accounts and
+# candles as slotted objects rather than the dicts `r.json()` builds. A model
+# keeps only its own fields, so the response dict and the keys the API adds
+# are freed, and numeric fields stay strings until first read. `columns`
+# turns a list of models into arrays for vectorized work.
+
+import re
+from array import array
+from decimal import Decimal
+
+
+class _Parsed(object):
+    """ Field parsed from its JSON string on first access, then cached. """
+    __slots__ = ('slot', 'parse')
+
+    def __init__(self, slot, parse):
+        self.slot = slot
+        self.parse = parse
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj, owner)
+        if value.__class__ is str:
+            value = self.parse(value) if value else None
+            self.slot.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+
+class Model(object):
+    """ Base of the response models.
+
+    Fields are attributes; missing fields are None. Models can also be read
+    like the dict they came from (`order['filled_size']`), with the parsed
+    values, so code written for dict responses keeps working.
+    """
+    __slots__ = ()
+    # Field name: (JSON path, parser or None).
+    FIELDS = {}
+    _loaders = ()
+
+    @classmethod
+    def from_json(cls, data):
+        model = cls.__new__(cls)
+        for set_slot, key, subkey, parse in cls._loaders:
+            value = data.get(key)
+            if subkey is not None and value is not None:
+                value = value.get(subkey)
+            if parse is not None and value is not None and value.__class__ is not str:
+                # Numbers sent as JSON numbers are parsed now.
+                value = parse(str(value))
+            set_slot(model, value)
+        return model
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.FIELDS:
+            return default
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def keys(self):
+        return self.FIELDS.keys()
+
+    def to_dict(self):
+        """ Fields as a dict of parsed values. """
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={!r}'.format(field, getattr(self, field)) for field in self.FIELDS))
+
+
+def _model(name, fields, doc):
+    """ Build a `Model` subclass with one slot per field. """
+    cls = type(name, (Model,), {'__slots__': tuple(fields), '__doc__': doc,
+                                '__module__': __name__, 'FIELDS': fields})
+    loaders = []
+    for field, (path, parse) in fields.items():
+        slot = cls.__dict__[field]
+        if parse is not None:
+            setattr(cls, field, _Parsed(slot, parse))
+        key, _, subkey = path.partition('.')
+        loaders.append((slot.__set__, key, subkey or None, parse))
+    cls._loaders = tuple(loaders)
+    return cls
+
+
+def _fields(plain=(), parsed=None, **paths):
+    fields = {field: (field, None) for field in plain}
+    for parse, names in (parsed or {}).items():
+        for field in names:
+            fields[field] = (paths.get(field, field), parse)
+    for field, path in paths.items():
+        if field not in fields:
+            fields[field] = (path, None)
+    return fields
+
+
+Order = _model('Order', _fields(
+    ('order_id', 'product_id', 'user_id', 'side', 'client_order_id', 'status', 'time_in_force',
+     'created_time', 'pending_cancel', 'size_in_quote', 'size_inclusive_of_fees',
+     'trigger_status', 'order_type', 'reject_reason', 'settled', 'product_type',
+     'order_configuration'),
+    {Decimal: ('completion_percentage', 'filled_size', 'average_filled_price', 'filled_value',
+               'total_fees', 'total_value_after_fees'),
+     int: ('number_of_fills',)}),
+    """ Order of `list_orders` / `get_order`. Amounts are `Decimal`. """)
+
+Fill = _model('Fill', _fields(
+    ('entry_id', 'trade_id', 'order_id', 'trade_time', 'trade_type', 'product_id',
+     'sequence_timestamp', 'liquidity_indicator', 'size_in_quote', 'user_id', 'side'),
+    {Decimal: ('price', 'size', 'commission')}),
+    """ Fill of `list_fills`. Amounts are `Decimal`. """)
+
+Product = _model('Product', _fields(
+    ('product_id', 'status', 'base_currency_id', 'quote_currency_id', 'product_type',
+     'trading_disabled', 'is_disabled', 'cancel_only', 'limit_only', 'post_only'),
+    {Decimal: ('price', 'volume_24h', 'base_increment', 'quote_increment', 'base_min_size',
+               'base_max_size', 'quote_min_size', 'quote_max_size', 'mid_market_price')}),
+    """ Product of `list_products` / `get_product`. Amounts are `Decimal`. """)
+
+Account = _model('Account', _fields(
+    ('uuid', 'name', 'currency', 'default', 'active', 'created_at', 'updated_at', 'type',
+     'ready'),
+    {Decimal: ('available_balance', 'hold')},
+    available_balance='available_balance.value', hold='hold.value'),
+    """ Account of `list_accounts` / `get_account`. Balances are `Decimal`. """)
+
+Candle = _model('Candle', _fields(
+    (), {int: ('start',), float: ('low', 'high', 'open', 'close', 'volume')}),
+    """ Candle of `get_product_candles`. Prices are floats, like `Candles`. """)
+
+# (method, endpoint pattern, response key or None for the whole response, model)
+ENDPOINTS = (
+    ('GET', re.compile(r'/accounts'), 'accounts', Account),
+    ('GET', re.compile(r'/accounts/[^/]+'), 'account', Account),
+    ('GET', re.compile(r'/orders/historical/batch'), 'orders', Order),
+    ('GET', re.compile(r'/orders/historical/fills'), 'fills', Fill),
+    ('GET', re.compile(r'/orders/historical/[^/]+'), 'order', Order),
+    ('GET', re.compile(r'/products'), 'products', Product),
+    ('GET', re.compile(r'/products/[^/]+'), None, Product),
+    ('GET', re.compile(r'/products/[^/]+/candles'), 'candles', Candle),
+)
+
+
+def decode_response(method, endpoint, response):
+    """ Replace the items of a JSON response by models.
+
+    The page structure (`cursor`, `has_next`, ...) is kept in a new dict;
+    responses of other endpoints and error responses are returned as they
+    are.
+    """
+    if not isinstance(response, dict):
+        return response
+    method = method.upper()
+    for model_method, pattern, key, model in ENDPOINTS:
+        if model_method != method or not pattern.fullmatch(endpoint):
+            continue
+        if key is None:
+            return model.from_json(response) if 'product_id' in response else response
+        items = response.get(key)
+        # A copy: `response` may be shared, e.g. by a `ResponseCache`.
+        if isinstance(items, list):
+            from_json = model.from_json
+            return dict(response, **{key: [from_json(item) for item in items]})
+        if isinstance(items, dict):
+            return dict(response, **{key: model.from_json(items)})
+        return response
+    return response
+
+
+def columns(models, fields=None):
+    """ Numeric fields of `models` as columns.
+
+    Values are read from the JSON strings without building `Decimal`s.
+
+        fills = client.list_fills(product_id='BTC-USD')['fills']
+        numpy.frombuffer(columns(fills)['price'])
+
+    Args:
+        models (list of Model): Models of one class.
+        fields (Optional[list of str]): Fields wanted. Defaults to every
+            parsed field.
+
+    Returns:
+        dict: `array('d')` by field, `array('q')` for integer fields.
+            Missing values are NaN, 0 in integer columns.
+    """
+    if not models:
+        return {}
+    cls = models[0].__class__
+    if fields is None:
+        fields = [field for field, (_, parse) in cls.FIELDS.items() if parse is not None]
+    result = {}
+    for field in fields:
+        parse = cls.FIELDS[field][1]
+        slot = cls.__dict__[field]
+        get = slot.slot.__get__ if isinstance(slot, _Parsed) else slot.__get__
+        if parse is int:
+            column, convert, missing = array('q'), int, 0
+        else:
+            column, convert, missing = array('d'), float, float('nan')
+        append = column.append
+        for model in models:
+            value = get(model)
+            append(convert(value) if value is not None and value != '' else missing)
+        result[field] = column
+    return result
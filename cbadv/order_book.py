@@ -6,17 +6,23 @@
 
 from sortedcontainers import SortedDict
 from decimal import Decimal
+from itertools import islice
 
+from cbadv.book_features import ASK, BID
 from cbadv.cbadv_client import Client
 
 class OrderBook:
-    def __init__(self, product_id='BTC-USD'):
+    def __init__(self, product_id='BTC-USD', features=None):
         self._asks = SortedDict()
         self._bids = SortedDict()
         self.product = product_id
         self._client = Client()
         self._sequence = 0
         self._current_ticker = None
+        # Optional `cbadv.book_features.BookFeatures` kept up to date.
+        self.features = features
+        if features is not None:
+            features.attach(self)
 
     def _message(self, events):
         if self._sequence == 0:
@@ -24,6 +30,14 @@ class OrderBook:
         else:
             self.update(events)
 
+    def reset(self):
+        """ Drop every level; the book waits for a new snapshot. """
+        self._asks = SortedDict()
+        self._bids = SortedDict()
+        self._sequence = 0
+        if self.features is not None:
+            self.features.reset()
+
     def create_book(self, events):
         self._asks = SortedDict()
         self._bids = SortedDict()
@@ -34,8 +48,16 @@ class OrderBook:
             else:
                 self._asks[event['price_level']] = event
         self._sequence += 1
+        if self.features is not None:
+            self.features.rebuild()
 
     def update(self, events):
+        if self.features is not None:
+            for event in events:
+                event = self.type_event(event)
+                self._set(event['side'], event['price_level'], event['new_quantity'], event)
+            self._sequence += 1
+            return
         for event in events:
             event = self.type_event(event)
             if event['new_quantity'] == 0:
@@ -48,6 +70,9 @@ class OrderBook:
         self._sequence += 1
 
     def remove(self, event):
+        if self.features is not None:
+            self._set(event['side'], event['price_level'], 0, None)
+            return
         if event['side'] == 'bid':
             if event['price_level'] in self._bids:
                 del self._bids[event['price_level']]
@@ -55,9 +80,56 @@ class OrderBook:
             if event['price_level'] in self._asks:
                 del self._asks[event['price_level']]
 
+    def _set(self, side, price, size, event):
+        # Update path while features are tracked: they need the previous
+        # size and the rank of the level.
+        if side == 'bid':
+            book, side = self._bids, BID
+        else:
+            book, side = self._asks, ASK
+        level = book.get(price)
+        old = 0 if level is None else level['new_quantity']
+        if not size and not old:
+            return
+        if size:
+            book[price] = event
+        index = book.bisect_left(price)
+        rank = len(book) - 1 - index if side == BID else index
+        if not size:
+            del book[price]
+        self.features.change(side, price if side == BID else -price, old, size, rank)
+
+    def _feature_count(self, side):
+        return len(self._bids if side == BID else self._asks)
+
+    def _feature_best(self, side):
+        if side == BID:
+            return self._bids.peekitem(-1)[0] if self._bids else None
+        return -self._asks.peekitem(0)[0] if self._asks else None
+
+    def _feature_size_at(self, side, rank):
+        book = self._bids if side == BID else self._asks
+        if rank >= len(book):
+            return 0
+        return book.peekitem(-1 - rank if side == BID else rank)[1]['new_quantity']
+
+    def _feature_sum(self, side, low, high):
+        # Size of the levels whose key is in [low, high); None is unbounded.
+        if side == BID:
+            book = self._bids
+            prices = book.irange(low, high, inclusive=(True, False))
+        else:
+            book = self._asks
+            prices = book.irange(None if high is None else -high, None if low is None else -low,
+                                 inclusive=(False, True))
+        return sum((book[price]['new_quantity'] for price in prices), 0)
+
     def type_event(self, event):
-        event['price_level'] = Decimal(event['price_level'])
-        event['new_quantity'] = Decimal(event['new_quantity'])
+        # Typed decoders (see cbadv.decoder) already deliver Decimals.
+        if event['price_level'].__class__ is not Decimal:
+            event['price_level'] = Decimal(event['price_level'])
+        if event['new_quantity'].__class__ is not Decimal:
+            event['new_quantity'] = Decimal(event['new_quantity'])
         return event
 
 
@@ -66,3 +138,40 @@ class OrderBook:
 
     def get_bid(self):
         return self._bids.peekitem(-1)[1]
+
+    def top_levels(self, n):
+        """ Best `n` levels of each side as lists of (price, size) floats. """
+        bids = [(float(level['price_level']), float(level['new_quantity']))
+                for level in islice(reversed(self._bids.values()), n)]
+        asks = [(float(level['price_level']), float(level['new_quantity']))
+                for level in islice(iter(self._asks.values()), n)]
+        return bids, asks
+
+    def snapshot(self):
+        """ Every level as update dicts that `create_book` restores exactly. """
+        return [{'side': level['side'], 'price_level': str(level['price_level']),
+                 'new_quantity': str(level['new_quantity'])}
+                for book in (self._bids, self._asks) for level in book.values()]
+
+    def get_depth(self, n=None):
+        """ Export the top `n` levels of both sides as numpy arrays.
+
+        Requires numpy. See `cbadv.book_analytics` for analytics on the result.
+
+        Args:
+            n (Optional[int]): Number of levels per side. Defaults to all.
+
+        Returns:
+            DepthSnapshot: `bids` and `asks` `Depth`, best level first.
+        """
+        from cbadv import book_analytics
+        np = book_analytics.np
+        sides = []
+        for book, levels in ((self._bids, reversed(self._bids.values())),
+                             (self._asks, iter(self._asks.values()))):
+            count = len(book) if n is None else min(n, len(book))
+            levels = list(islice(levels, count))
+            price = np.fromiter((level['price_level'] for level in levels), np.float64, count)
+            size = np.fromiter((level['new_quantity'] for level in levels), np.float64, count)
+            sides.append(book_analytics.make_depth(price, size))
+        return book_analytics.DepthSnapshot(*sides)
@@ -4,97 +4,568 @@
 #
 # Live order books updated from the Coinbase Advanced Trade Websocket Feed
 
-import pickle
+import time
+from collections import defaultdict
+from threading import Event, Lock, RLock, Thread
 
-from cbadv.websocket_client import WebsocketClient
+from cbadv.book_features import BookFeatures
+from cbadv.capture import CaptureWriter
+from cbadv.websocket_client import WebsocketClient, parse_timestamp
 from cbadv.order_book import OrderBook
 
+# Seconds of standby frames replayed before the last frame delivered, on
+# failover. Updates carry absolute level sizes: replaying some twice is
+# harmless, missing one is not.
+FAILOVER_OVERLAP = 1.
+
+class SequenceTracker(object):
+    """ Follows the `sequence_num` of the messages received on one connection.
+
+    The Advanced Trade feed numbers every message of a connection, starting
+    over on each new connection. A jump forward means messages were dropped;
+    a number already seen means a late or duplicated message.
+
+    Attributes:
+        expected (int): Next sequence number, None before the first message.
+        gaps (int): Number of gaps detected.
+        missed (int): Number of messages lost in those gaps.
+        out_of_order (int): Number of late or duplicated messages.
+    """
+    IN_ORDER, GAP, OUT_OF_ORDER = range(3)
+
+    def __init__(self):
+        self.expected = None
+        self.gaps = 0
+        self.missed = 0
+        self.out_of_order = 0
+
+    def reset(self):
+        self.expected = None
+
+    def check(self, sequence_num):
+        if sequence_num is None:
+            return self.IN_ORDER
+        expected = self.expected
+        if expected is None or sequence_num == expected:
+            self.expected = sequence_num + 1
+            return self.IN_ORDER
+        if sequence_num < expected:
+            self.out_of_order += 1
+            return self.OUT_OF_ORDER
+        self.gaps += 1
+        self.missed += sequence_num - expected
+        self.expected = sequence_num + 1
+        return self.GAP
+
+
+class ConnectionStats(object):
+    """ Throughput and lag of one websocket connection.
+
+    Attributes:
+        messages (int): Messages received.
+        events (int): Book events applied.
+        lag (float): Exponential moving average, in seconds, of the delay
+            between the exchange `timestamp` of a message and the moment it
+            has been applied. It grows when the consumer falls behind.
+        max_lag (float): Largest lag since the last `sample`.
+    """
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+        self.messages = 0
+        self.events = 0
+        self.lag = 0.
+        self.max_lag = 0.
+        self._last_sample = (time.time(), 0)
+
+    def record(self, msg, n_events):
+        self.messages += 1
+        self.events += n_events
+        timestamp = msg.get('timestamp')
+        if timestamp:
+            lag = time.time() - parse_timestamp(timestamp)
+            self.lag += self.alpha * (lag - self.lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def sample(self):
+        """ Message rate since the previous sample, and reset `max_lag`. """
+        now = time.time()
+        then, messages = self._last_sample
+        self._last_sample = (now, self.messages)
+        rate = (self.messages - messages) / (now - then) if now > then else 0.
+        max_lag, self.max_lag = self.max_lag, 0.
+        return {'messages': self.messages, 'events': self.events,
+                'messages_per_sec': rate, 'lag': self.lag, 'max_lag': max_lag}
+
+
+class OrderBooksShard(WebsocketClient):
+    """ One level2 connection of a sharded `OrderBooks`.
+
+    Messages are handed to the owning `OrderBooks`, which keeps every book in
+    its `order_books` mapping. `lock` guards `products` and the books of
+    the shard.
+    """
+    FAILOVER_OVERLAP = FAILOVER_OVERLAP
+
+    def __init__(self, owner, index, products):
+        super(OrderBooksShard, self).__init__(
+            owner.api_key, owner.api_secret, url=owner.url, products=products,
+            channel='level2', should_print=False, decoder=owner.decoder,
+            recorder=owner.recorder, metrics=owner.metrics, standby=owner.standby,
+            stale_after=owner.stale_after)
+        self.owner = owner
+        self.index = index
+        self.lock = RLock()
+        self.sequence_tracker = SequenceTracker()
+        self.stats = ConnectionStats()
+
+    def _connect(self):
+        with self.lock:
+            self.sequence_tracker.reset()
+            for product_id in self.products:
+                self.owner.order_books[product_id].reset()
+            super(OrderBooksShard, self)._connect()
+
+    def on_open(self):
+        pass
+
+    def on_close(self):
+        pass
+
+    def on_message(self, msg):
+        with self.lock:
+            self.owner._process(self, msg)
+
+    def on_failover(self, gap=False):
+        self.sequence_tracker.reset()
+        if gap:
+            self.owner.gap_count += 1
+            self.owner.resync(self.products, self)
+
+    def on_error(self, e, data=None):
+        super(OrderBooksShard, self).on_error(e, data)
+        self.owner.error = e
+
+
 class OrderBooks(WebsocketClient):
+    """ Live level2 order books for several products.
+
+    With `shards` > 1 the products are spread over that many websocket
+    connections, each read by its own thread. Products can be moved between
+    connections at runtime by `rebalance`, which balances the observed
+    message rates; books stay readable in `order_books` throughout.
+
+    The products and books of a connection are only changed under its
+    `lock`, which the thread reading it holds while applying a message.
+
+    Args:
+        api_key (str): Your coinbase advanced trade API key.
+        api_secret (str): Your coinbase advanced trade API secret.
+        product_id (list): Products to follow.
+        log_to (Optional[str, file or CaptureWriter]): Capture every frame
+            received, see `cbadv.capture`. Replay it with `cbadv.capture.replay`.
+        book_class (type): Book engine, `OrderBook` or `TickOrderBook`.
+        decoder (Optional[object]): Frame decoder, see `cbadv.decoder`.
+        shards (int): Number of websocket connections.
+        rebalance_interval (Optional[float]): Seconds between automatic
+            `rebalance` calls while sharded. Disabled when None.
+        checkpoint_interval (Optional[float]): Seconds between book
+            checkpoints written to the `log_to` capture, which bound the
+            replay needed by `CaptureReader.book_at`. Disabled when None,
+            the default: each one copies every book on the receive thread.
+        metrics (Optional[object]): Sink of latency and apply time
+            measurements, see `cbadv.metrics`.
+        standby (bool): Keep a hot standby connection per websocket
+            connection; on failure it takes over with the books intact.
+        stale_after (Optional[float]): Reconnect when a connection receives
+            nothing for that many seconds.
+        top_of_book (Optional[TopOfBookFeed]): Told of every book change,
+            emits the changes of the best levels, see `cbadv.top_of_book`.
+        features (Optional[dict]): `BookFeatures` arguments; each book then
+            maintains those aggregates, see `cbadv.book_features`.
+    """
+    FAILOVER_OVERLAP = FAILOVER_OVERLAP
 
-    def __init__(self, api_key, api_secret, product_id=["BTC-USD", "ETH-USD"], log_to=None):
+    def __init__(self, api_key, api_secret, product_id=["BTC-USD", "ETH-USD"], log_to=None,
+                 book_class=OrderBook, decoder=None, shards=1, rebalance_interval=None,
+                 checkpoint_interval=None, metrics=None, standby=False,
+                 stale_after=None, top_of_book=None, features=None):
+        if log_to is not None and not isinstance(log_to, CaptureWriter):
+            log_to = CaptureWriter(log_to)
+        # Own copy: products are added and removed at runtime.
+        product_id = list(product_id)
         super(OrderBooks, self).__init__(api_key, api_secret, 
-            products=product_id, channel='level2')
+            products=product_id, channel='level2', decoder=decoder, recorder=log_to,
+            metrics=metrics, standby=standby, stale_after=stale_after)
         self.product_id = product_id
         self.order_books = {}
-        self._log_to = log_to
-        if self._log_to:
-            assert hasattr(self._log_to, 'write')
+        self._book_class = book_class
+        self.features = features
+        self.lock = RLock()
+        # Serializes add_products, remove_products and rebalance.
+        self._changing = Lock()
+        self.sequence_tracker = SequenceTracker()
+        self.stats = ConnectionStats()
+        self.gap_count = 0
+        self.out_of_order_count = 0
+        self.resync_count = 0
+        self.rebalance_count = 0
+        self.checkpoint_interval = checkpoint_interval
+        self.top_of_book = top_of_book
+        self._next_checkpoint = defaultdict(float)
         self.init_order_books()
 
+        self.shards = []
+        self.rebalance_interval = rebalance_interval
+        self._rebalancer = None
+        self._stop_rebalancer = Event()
+        self._product_counts = defaultdict(int)
+        self._last_counts = {}
+        self._connection_of = {}
+        if shards > 1:
+            self.shards = [OrderBooksShard(self, index, self.product_id[index::shards])
+                           for index in range(shards)]
+            for shard in self.shards:
+                for product_id in shard.products:
+                    self._connection_of[product_id] = shard
+        else:
+            for product_id in self.product_id:
+                self._connection_of[product_id] = self
+
     def init_order_books(self):
         for product_id in self.product_id:
-            self.order_books[product_id] = OrderBook(product_id=product_id)
-        
+            self.order_books[product_id] = self._new_book(product_id)
+
+    def _new_book(self, product_id):
+        if self.features is None:
+            return self._book_class(product_id=product_id)
+        return self._book_class(product_id=product_id, features=BookFeatures(**self.features))
+
+    def start(self):
+        if not self.shards:
+            return super(OrderBooks, self).start()
+        self.stop = False
+        self.on_open()
+        for shard in self.shards:
+            shard.start()
+        if self.rebalance_interval:
+            self._stop_rebalancer.clear()
+            self._rebalancer = Thread(target=self._rebalance_loop, daemon=True)
+            self._rebalancer.start()
+
+    def close(self):
+        if not self.shards:
+            super(OrderBooks, self).close()
+        else:
+            self.stop = True
+            self._stop_rebalancer.set()
+            for shard in self.shards:
+                shard.close()
+            self.on_close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.top_of_book is not None:
+            self.top_of_book.close()
+
+    def _rebalance_loop(self):
+        while not self._stop_rebalancer.wait(self.rebalance_interval):
+            self.rebalance()
+
+    def _connect(self):
+        # Sequence numbers start over on a new connection, and the books are
+        # rebuilt from the snapshot that follows the subscription.
+        with self.lock:
+            self.sequence_tracker.reset()
+            for order_book in list(self.order_books.values()):
+                order_book.reset()
+            super(OrderBooks, self)._connect()
+
     def on_open(self):
         for order_book in self.order_books.values():
-            order_book.sequence = 0
+            order_book.reset()
         print("-- Subscribed to OrderBooks! --\n")
 
     def on_close(self):
         print("\n-- OrderBook Socket Closed! --")
 
     def on_message(self, msg):
-        if self._log_to:
-            pickle.dump(msg, self._log_to)
-        for event in msg['events']:
+        with self.lock:
+            self._process(self, msg)
+
+    def on_failover(self, gap=False):
+        # The books are kept: the standby's frames carry on from them,
+        # unless some were lost in between.
+        self.sequence_tracker.reset()
+        if gap:
+            self.gap_count += 1
+            self.resync(self.products, self)
+
+    def _process(self, connection, msg):
+        status = connection.sequence_tracker.check(msg.get('sequence_num'))
+        if status == SequenceTracker.OUT_OF_ORDER:
+            self.out_of_order_count += 1
+            return
+        if status == SequenceTracker.GAP:
+            # Any product of the connection may have lost an update.
+            self.gap_count += 1
+            self.resync(connection.products, connection)
+        events = msg['events']
+        metrics = self.metrics
+        for event in events:
             if not 'subscriptions' in event:
-                    self.order_books[event['product_id']]._message(event['updates'])
+                if metrics is None:
+                    self._apply(connection, event)
+                else:
+                    start = time.perf_counter()
+                    self._apply(connection, event)
+                    metrics.observe('book.apply', time.perf_counter() - start,
+                                    {'product_id': event['product_id']})
+        connection.stats.record(msg, len(events))
+        if self.recorder is not None and self.checkpoint_interval:
+            now = time.time()
+            if now >= self._next_checkpoint[connection]:
+                self._next_checkpoint[connection] = now + self.checkpoint_interval
+                self.recorder.checkpoint({product_id: self.order_books[product_id]
+                                          for product_id in connection.products}, now)
+
+    def _apply(self, connection, event):
+        product_id = event['product_id']
+        # Drop events from a connection the product was just moved away from,
+        # or of a product just removed.
+        if self._connection_of.get(product_id) is not connection:
+            return
+        order_book = self.order_books.get(product_id)
+        if order_book is None:
+            return
+        self._product_counts[product_id] += 1
+        event_type = event.get('type')
+        if event_type == 'snapshot':
+            order_book.create_book(event['updates'])
+        elif event_type == 'update':
+            # A book waiting for its snapshot ignores updates.
+            if order_book._sequence == 0:
+                return
+            order_book.update(event['updates'])
+        else:
+            order_book._message(event['updates'])
+            return
+        if self.top_of_book is not None:
+            self.top_of_book.update(product_id, order_book)
+
+    def resync(self, product_ids, connection=None):
+        """ Rebuild books from a fresh snapshot without closing the socket.
+
+        The books are emptied, then their products are unsubscribed and
+        subscribed again, which makes the feed send a new snapshot. Books
+        already waiting for one are included: their snapshot may be the
+        message that was lost.
+
+        Args:
+            product_ids (list): Products to rebuild.
+            connection (Optional[WebsocketClient]): Connection the products
+                are subscribed on. Defaults to the connection of each product.
+        """
+        by_connection = defaultdict(list)
+        for product_id in product_ids:
+            by_connection[connection or self._connection_of[product_id]].append(product_id)
+        for connection, product_ids in by_connection.items():
+            with connection.lock:
+                for product_id in product_ids:
+                    self.order_books[product_id].reset()
+                self.resync_count += 1
+                # Without a socket, as when replaying a capture, the snapshot
+                # that followed the original resync is part of the stream.
+                connection._send_live('unsubscribe', product_ids)
+                connection._send_live('subscribe', product_ids)
+
+    def add_products(self, product_ids):
+        """ Follow more products without reconnecting.
+
+        Their books are created empty and subscribed on the live socket, on
+        the least loaded connection when sharded; they are built from the
+        snapshot that follows. The other books are not touched.
+
+        Args:
+            product_ids (list): Products to add; those already followed are
+                ignored.
+
+        Returns:
+            list: Products added.
+        """
+        with self._changing:
+            by_connection = defaultdict(list)
+            for product_id in product_ids:
+                if product_id in self._connection_of or \
+                        any(product_id in products for products in by_connection.values()):
+                    continue
+                if self.shards:
+                    connection = min(self.shards, key=lambda shard: len(shard.products) +
+                                     len(by_connection[shard]))
+                else:
+                    connection = self
+                by_connection[connection].append(product_id)
+            added = []
+            for connection, products in by_connection.items():
+                with connection.lock:
+                    for product_id in products:
+                        self.order_books[product_id] = self._new_book(product_id)
+                        self._connection_of[product_id] = connection
+                        if connection is not self:
+                            connection.products.append(product_id)
+                        self.product_id.append(product_id)
+                    connection._send_live('subscribe', products)
+                added.extend(products)
+        return added
+
+    def remove_products(self, product_ids):
+        """ Stop following products without reconnecting.
+
+        They are unsubscribed on the live socket and their books released;
+        messages still in flight for them are ignored.
+
+        Args:
+            product_ids (list): Products to remove; unknown ones are ignored.
+
+        Returns:
+            list: Products removed.
+        """
+        with self._changing:
+            by_connection = defaultdict(list)
+            for product_id in product_ids:
+                connection = self._connection_of.get(product_id)
+                if connection is not None and product_id not in by_connection[connection]:
+                    by_connection[connection].append(product_id)
+            removed = []
+            for connection, products in by_connection.items():
+                with connection.lock:
+                    for product_id in products:
+                        del self._connection_of[product_id]
+                        if connection is not self:
+                            connection.products.remove(product_id)
+                        self.product_id.remove(product_id)
+                        del self.order_books[product_id]
+                        if self.top_of_book is not None:
+                            self.top_of_book.remove(product_id)
+                        self._product_counts.pop(product_id, None)
+                        self._last_counts.pop(product_id, None)
+                    connection._send_live('unsubscribe', products)
+                removed.extend(products)
+        return removed
+
+    def product_rates(self):
+        """ Events per product since the previous call. """
+        counts = dict(self._product_counts)
+        rates = {product_id: counts.get(product_id, 0) - self._last_counts.get(product_id, 0)
+                 for product_id in self.product_id}
+        self._last_counts = counts
+        return rates
+
+    def rebalance(self, rates=None, tolerance=0.2):
+        """ Move products between shards to balance their message rates.
+
+        Products are assigned heaviest first to the least loaded shard. The
+        new assignment is only applied when the busiest shard carries more
+        than (1 + `tolerance`) times the average load; moved products are
+        unsubscribed from their old connection, subscribed on the new one and
+        rebuilt from its snapshot.
+
+        Args:
+            rates (Optional[dict]): Load per product. Defaults to the events
+                observed since the previous rebalance.
+            tolerance (float): Imbalance accepted before moving anything.
+
+        Returns:
+            dict: Moved products and their new shard index.
+        """
+        if not self.shards:
+            return {}
+        with self._changing:
+            return self._rebalance(rates, tolerance)
+
+    def _rebalance(self, rates, tolerance):
+        if rates is None:
+            rates = self.product_rates()
+        loads = [sum(rates.get(product_id, 0) for product_id in shard.products)
+                 for shard in self.shards]
+        mean = sum(loads) / float(len(loads))
+        if not mean or max(loads) <= (1 + tolerance) * mean:
+            return {}
+
+        target = [0.] * len(self.shards)
+        assignment = {}
+        for product_id in sorted(self.product_id, key=lambda p: -rates.get(p, 0)):
+            # Ties go to the product's current shard to avoid needless moves.
+            current = self._connection_of[product_id].index
+            index = min(range(len(target)), key=lambda i: (target[i], i != current))
+            assignment[product_id] = index
+            target[index] += rates.get(product_id, 0)
+
+        moves = {product_id: index for product_id, index in assignment.items()
+                 if self._connection_of[product_id].index != index}
+        for product_id, index in moves.items():
+            self._move(product_id, self.shards[index])
+        if moves:
+            self.rebalance_count += 1
+        return moves
+
+    def _move(self, product_id, shard):
+        # One lock at a time: in between, the product belongs to no
+        # connection and its messages are dropped.
+        old = self._connection_of[product_id]
+        with old.lock:
+            self._connection_of[product_id] = None
+            old.products.remove(product_id)
+            old._send_live('unsubscribe', [product_id])
+        with shard.lock:
+            self.order_books[product_id].reset()
+            shard.products.append(product_id)
+            self._connection_of[product_id] = shard
+            shard._send_live('subscribe', [product_id])
+
+    def shard_stats(self):
+        """ Throughput and lag of each connection, to size `shards`.
+
+        Returns:
+            list of dict: One entry per connection with its index, products,
+            message count and rate since the previous call, and lag.
+        """
+        connections = self.shards or [self]
+        stats = []
+        for index, connection in enumerate(connections):
+            entry = connection.stats.sample()
+            entry['index'] = index
+            entry['products'] = list(connection.products)
+            stats.append(entry)
+        return stats
 
 
 if __name__ == '__main__':
     import sys, json
-    import time
     import datetime as dt
+    from queue import Empty
 
-    class OrderBooksConsole(OrderBooks):
-        ''' Logs real-time changes to the bid-ask spread to the console '''
-
-        def __init__(self, api_key, api_secret, product_id=None):
-            super(OrderBooksConsole, self).__init__(api_key, api_secret, product_id=product_id)
-            self._bid = {}
-            self._ask = {}
-            self._bid_depth = {}
-            self._ask_depth = {}
-
-            for product_id in self.product_id:
-                # Initialize the bid-ask spread for each product
-                self._bid[product_id] = 0
-                self._ask[product_id] = 0
-                self._bid_depth[product_id] = 0
-                self._ask_depth[product_id] = 0
-
-        def on_message(self, message):
-            super(OrderBooksConsole, self).on_message(message)
-
-            for event in message['events']:
-                if not 'subscriptions' in event:
-                    # Calculate newest bid-ask spread
-                    bid = self.order_books[event['product_id']].get_bid()['price_level']
-                    bid_depth = self.order_books[event['product_id']].get_bid()['new_quantity']
-                    ask = self.order_books[event['product_id']].get_ask()['price_level']
-                    ask_depth = self.order_books[event['product_id']].get_ask()['new_quantity']
-
-                    # Log changes to the bid-ask spread to the console
-                    if bid != self._bid[event['product_id']] or ask != self._ask[event['product_id']] or \
-                        bid_depth != self._bid_depth[event['product_id']] or ask_depth != self._ask_depth[event['product_id']]:
-                        self._bid[event['product_id']] = bid
-                        self._ask[event['product_id']] = ask
-                        self._bid_depth[event['product_id']] = bid_depth
-                        self._ask_depth[event['product_id']] = ask_depth
-                        print('{} {} bid: {} @ {:.2f}\task: {} @ {:.2f}'.format(
-                            dt.datetime.now(), event['product_id'], bid_depth, bid, ask_depth, ask))
+    from cbadv.top_of_book import TopOfBookFeed
 
+    # Logs real-time changes to the bid-ask spread to the console
     conf_path = 'conf.json'
 
-    order_books = OrderBooksConsole(product_id=['BTC-USD', 'ETH-USD'], **json.load(open(conf_path)))
+    feed = TopOfBookFeed()
+    order_books = OrderBooks(product_id=['BTC-USD', 'ETH-USD'], top_of_book=feed,
+                             **json.load(open(conf_path)))
     order_books.start()
     try:
         while True:
-            time.sleep(10)
+            try:
+                top = feed.get(timeout=10)
+            except Empty:
+                continue
+            if top.bids and top.asks:
+                print('{} {} bid: {} @ {:.2f}\task: {} @ {:.2f}'.format(
+                    dt.datetime.now(), top.product_id, top.bid_size, top.bid, top.ask_size, top.ask))
     except KeyboardInterrupt:
         order_books.close()
 
     if order_books.error:
         sys.exit(1)
     else:
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
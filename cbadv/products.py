@@ -0,0 +1,207 @@
+# cbadv/products.py
+#
+#
+# Product metadata index
+#
+# A `ProductCatalog` is built once from `list_products` and keeps, for every
+# product, the increments, size limits and trading status as parsed
+# `Decimal`s. Prices and sizes can then be rounded to the product grid and
+# orders checked before they are sent, without a `get_product` call per
+# order; the exchange would reject the same orders after a round trip and
+# a rate limit token.
+
+from collections import namedtuple
+from decimal import ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN, Decimal
+
+PRODUCT_FIELDS = ('product_id', 'base_increment', 'quote_increment', 'base_min_size',
+                  'base_max_size', 'quote_min_size', 'quote_max_size', 'status',
+                  'trading_disabled', 'is_disabled', 'cancel_only', 'limit_only', 'post_only')
+
+# Rounding of prices by order side: never pay more, never sell for less.
+PRICE_ROUNDING = {'buy': ROUND_FLOOR, 'sell': ROUND_CEILING, None: ROUND_HALF_EVEN}
+
+
+def _decimal(value):
+    if value is None or value == '':
+        return None
+    return Decimal(str(value))
+
+
+def _quantize(value, increment, rounding):
+    units = (value / increment).to_integral_value(rounding)
+    return (units * increment).quantize(increment)
+
+
+class Product(namedtuple('Product', PRODUCT_FIELDS)):
+    """ Trading rules of one product.
+
+    Increments and limits are `Decimal`, None when the API left them out.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, product):
+        return cls(product['product_id'],
+                   _decimal(product.get('base_increment')),
+                   _decimal(product.get('quote_increment')),
+                   _decimal(product.get('base_min_size')),
+                   _decimal(product.get('base_max_size')),
+                   _decimal(product.get('quote_min_size')),
+                   _decimal(product.get('quote_max_size')),
+                   product.get('status'),
+                   bool(product.get('trading_disabled')),
+                   bool(product.get('is_disabled')),
+                   bool(product.get('cancel_only')),
+                   bool(product.get('limit_only')),
+                   bool(product.get('post_only')))
+
+    @property
+    def tradable(self):
+        return not (self.trading_disabled or self.is_disabled or self.cancel_only)
+
+    def round_price(self, price, side=None):
+        """ Round `price` to the tick: down for buys, up for sells,
+        to the nearest tick otherwise. """
+        price = Decimal(str(price))
+        if self.quote_increment is None:
+            return price
+        return _quantize(price, self.quote_increment, PRICE_ROUNDING[side])
+
+    def round_size(self, size):
+        """ Round `size` down to the lot. """
+        size = Decimal(str(size))
+        if self.base_increment is None:
+            return size
+        return _quantize(size, self.base_increment, ROUND_FLOOR)
+
+    def validate(self, side, order_type=None, **kwargs):
+        """ Check an order against the rules of the product.
+
+        Takes the arguments of `Client.create_order`.
+
+        Raises:
+            ValueError: The exchange would reject the order.
+        """
+        product_id = self.product_id
+        if not self.tradable:
+            raise ValueError('{} is not open for new orders (status {})'.format(
+                product_id, self.status))
+        if self.limit_only and order_type != 'limit':
+            raise ValueError('{} only accepts limit orders'.format(product_id))
+        if self.post_only and not (order_type == 'limit' and kwargs.get('post_only')):
+            raise ValueError('{} only accepts post only limit orders'.format(product_id))
+
+        for field in ('price', 'stop_price'):
+            value = kwargs.get(field)
+            if value is not None and self.quote_increment is not None and \
+                    Decimal(str(value)) % self.quote_increment:
+                raise ValueError('{} {} is not a multiple of the quote increment {} of {}'.format(
+                    field, value, self.quote_increment, product_id))
+
+        size = kwargs.get('size')
+        if size is not None:
+            size = Decimal(str(size))
+            if self.base_increment is not None and size % self.base_increment:
+                raise ValueError('size {} is not a multiple of the base increment {} of {}'.format(
+                    size, self.base_increment, product_id))
+            _check_range('size', size, self.base_min_size, self.base_max_size, product_id)
+
+        funds = kwargs.get('funds')
+        if funds is not None:
+            _check_range('funds', Decimal(str(funds)), self.quote_min_size,
+                         self.quote_max_size, product_id)
+
+
+def _check_range(name, value, low, high, product_id):
+    if low is not None and value < low:
+        raise ValueError('{} {} is below the minimum {} of {}'.format(name, value, low, product_id))
+    if high is not None and value > high:
+        raise ValueError('{} {} is above the maximum {} of {}'.format(name, value, high, product_id))
+
+
+class ProductCatalog(object):
+    """ Index of `Product`s by product id.
+
+        catalog = client.load_catalog()
+        catalog['BTC-USD'].quote_increment
+        price = catalog.round_price('BTC-USD', 26001.237, side='buy')
+
+    Once a client has a catalog, `create_order` and `place_orders` check
+    every order against it before sending.
+
+    Args:
+        products: A `list_products` response, or product dicts.
+    """
+    def __init__(self, products=()):
+        self._products = {}
+        self._raw = {}
+        self.update(products)
+
+    def update(self, products, prune=False):
+        """ Add or update products; only changed ones are parsed again.
+
+        Args:
+            products: A `list_products` response, or product dicts such as
+                `get_product` responses.
+            prune (bool): `products` is the full listing: drop the products
+                it does not have.
+
+        Returns:
+            list of str: Ids of the products added, changed or dropped.
+        """
+        if isinstance(products, dict):
+            products = products.get('products') or ()
+        changed = []
+        seen = set()
+        for product in products:
+            product_id = product['product_id']
+            seen.add(product_id)
+            raw = tuple(product.get(field) for field in PRODUCT_FIELDS)
+            if self._raw.get(product_id) != raw:
+                self._raw[product_id] = raw
+                self._products[product_id] = Product.from_json(product)
+                changed.append(product_id)
+        if prune:
+            for product_id in [p for p in self._products if p not in seen]:
+                del self._products[product_id]
+                del self._raw[product_id]
+                changed.append(product_id)
+        return changed
+
+    def __getitem__(self, product_id):
+        try:
+            return self._products[product_id]
+        except KeyError:
+            raise KeyError('Unknown product: {}'.format(product_id))
+
+    def get(self, product_id, default=None):
+        return self._products.get(product_id, default)
+
+    def __contains__(self, product_id):
+        return product_id in self._products
+
+    def __iter__(self):
+        return iter(self._products)
+
+    def __len__(self):
+        return len(self._products)
+
+    def round_price(self, product_id, price, side=None):
+        """ See `Product.round_price`. """
+        return self[product_id].round_price(price, side)
+
+    def round_size(self, product_id, size):
+        """ See `Product.round_size`. """
+        return self[product_id].round_size(size)
+
+    def validate(self, product_id, side, order_type=None, **kwargs):
+        """ Check an order before it is sent. See `Product.validate`.
+
+        Raises:
+            ValueError: Unknown product, or the exchange would reject the
+                order.
+        """
+        product = self._products.get(product_id)
+        if product is None:
+            raise ValueError('Unknown product: {}'.format(product_id))
+        product.validate(side, order_type, **kwargs)
@@ -0,0 +1,285 @@
+# cbadv/rate_limit.py
+#
+#
+# Client-side request rate limiting
+#
+# Every `Client` in the process shares one `RateLimiter` by default, with a
+# bucket for public and one for private endpoints. Requests wait for a token
+# in priority order: order placement and cancels first, bulk reads
+# (pagination, candle downloads) last. Rate limit response headers and 429s
+# correct the local estimate of the remaining budget.
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+HIGH, NORMAL, BULK = 0, 1, 2
+
+_priority = ContextVar('cbadv_request_priority', default=None)
+
+
+@contextmanager
+def priority(level):
+    """ Send the requests made in this context (thread or task) at `level`.
+
+        with priority(BULK):
+            client.list_fills()
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket(object):
+    """ Thread-safe token bucket.
+
+    Tokens accrue at `rate` per second up to `capacity`; each request takes
+    one. Bursts up to `capacity` go through immediately, the sustained rate
+    never exceeds `rate`.
+
+    Args:
+        rate (float): Tokens per second.
+        capacity (Optional[float]): Largest burst. Defaults to `rate`.
+    """
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """ Take `tokens` if available now. Returns whether they were taken. """
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def delay(self, tokens=1):
+        """ Reserve `tokens` and return how long to wait before using them. """
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """ Block until `tokens` are available, and take them. """
+        wait = self.delay(tokens)
+        if wait > 0:
+            self._sleep(wait)
+
+
+class PriorityBucket(TokenBucket):
+    """ Token bucket serving waiters by priority, then arrival.
+
+    A waiter only takes a token once every waiter ahead of it is served, so
+    a queue of bulk reads never delays an order. `BULK` requests also leave
+    `reserve` tokens in the bucket, keeping a burst available for orders.
+    Threads block on `acquire`; asyncio tasks await `acquire_async`; both
+    share the same queue.
+
+    Args:
+        rate (float): Tokens per second.
+        capacity (Optional[float]): Largest burst. Defaults to `rate`.
+        reserve (float): Tokens `BULK` requests leave untouched.
+    """
+    def __init__(self, rate, capacity=None, reserve=0, clock=time.monotonic):
+        super(PriorityBucket, self).__init__(rate, capacity, clock)
+        self.reserve = reserve
+        self._changed = threading.Condition(self._lock)
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._blocked_until = 0.
+
+    def _enqueue(self, level):
+        ticket = (level, next(self._tickets))
+        heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _dequeue(self, ticket):
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._changed.notify_all()
+
+    def _poll(self, ticket):
+        """ Take a token for `ticket` or return the time to wait. Lock held. """
+        now = self._clock()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        ahead = sum(1 for other in self._waiting if other < ticket)
+        needed = ahead + 1 + (self.reserve if ticket[0] >= BULK else 0)
+        if self._tokens >= needed:
+            self._tokens -= 1
+            self._dequeue(ticket)
+            return 0.
+        return (needed - self._tokens) / self.rate
+
+    def acquire(self, level=NORMAL):
+        """ Block until a token is granted to a request of priority `level`. """
+        with self._changed:
+            ticket = self._enqueue(level)
+            try:
+                while True:
+                    wait = self._poll(ticket)
+                    if wait <= 0:
+                        return
+                    self._changed.wait(wait)
+            finally:
+                self._dequeue(ticket)
+
+    async def acquire_async(self, level=NORMAL):
+        """ Wait, without blocking the event loop, for a token at `level`. """
+        with self._lock:
+            ticket = self._enqueue(level)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._poll(ticket)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self._dequeue(ticket)
+
+    def observe(self, remaining=None, reset=None):
+        """ Align the bucket with the budget reported by the server.
+
+        Args:
+            remaining (Optional[float]): Requests left in the current window.
+            reset (Optional[float]): Seconds until the window resets. Used
+                when nothing is left.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            if remaining is not None and remaining < self._tokens:
+                self._tokens = max(float(remaining), 0.)
+            if remaining is not None and remaining <= 0 and reset:
+                self._block(reset)
+
+    def penalize(self, seconds):
+        """ Stop granting tokens for `seconds`, after a 429. """
+        with self._lock:
+            self._tokens = 0.
+            self._block(seconds)
+
+    def _block(self, seconds):
+        self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+        self._changed.notify_all()
+
+
+class RateLimiter(object):
+    """ Request scheduler shared by the clients of a process.
+
+    Private (authenticated) and public endpoints have separate buckets sized
+    after the documented Advanced Trade limits. Orders and cancels are sent
+    at `HIGH` priority, other requests at `NORMAL` unless the `priority`
+    context says otherwise.
+
+    Args:
+        private_rate (float): Private requests per second.
+        public_rate (float): Public requests per second.
+        reserve (float): Private tokens kept for `HIGH` and `NORMAL`
+            requests when `BULK` ones are waiting.
+
+    Attributes:
+        throttled (int): 429 responses received.
+    """
+    # Header names vary between API generations; the first one found is used.
+    REMAINING_HEADERS = ('x-ratelimit-remaining', 'ratelimit-remaining')
+    RESET_HEADERS = ('x-ratelimit-reset', 'ratelimit-reset')
+
+    PUBLIC_PREFIXES = ('/market/', '/time')
+    HIGH_PRIORITY = (('POST', '/orders'), ('POST', '/orders/batch_cancel'),
+                     ('POST', '/orders/edit'))
+
+    def __init__(self, private_rate=30, public_rate=10, reserve=3, clock=time.monotonic):
+        self._clock = clock
+        self.buckets = {'private': PriorityBucket(private_rate, reserve=reserve, clock=clock),
+                        'public': PriorityBucket(public_rate, clock=clock)}
+        self.throttled = 0
+
+    def bucket(self, endpoint):
+        public = endpoint.startswith(self.PUBLIC_PREFIXES)
+        return self.buckets['public' if public else 'private']
+
+    def level(self, method, endpoint):
+        level = _priority.get()
+        if level is not None:
+            return level
+        if (method.upper(), endpoint) in self.HIGH_PRIORITY:
+            return HIGH
+        return NORMAL
+
+    def acquire(self, method, endpoint):
+        self.bucket(endpoint).acquire(self.level(method, endpoint))
+
+    async def acquire_async(self, method, endpoint):
+        await self.bucket(endpoint).acquire_async(self.level(method, endpoint))
+
+    def observe(self, endpoint, status_code, headers):
+        """ Update the budget of `endpoint` from a response.
+
+        Returns:
+            float: Seconds to wait before retrying, 0 unless throttled.
+        """
+        bucket = self.bucket(endpoint)
+        remaining = _header(headers, self.REMAINING_HEADERS)
+        reset = _header(headers, self.RESET_HEADERS)
+        if reset is not None and reset > 1e9:
+            # An epoch timestamp rather than a delay.
+            reset = max(reset - time.time(), 0.)
+        if status_code == 429:
+            self.throttled += 1
+            retry_after = _header(headers, ('retry-after',))
+            wait = retry_after or reset or 1. / bucket.rate
+            bucket.penalize(wait)
+            return wait
+        if remaining is not None:
+            bucket.observe(remaining, reset)
+        return 0.
+
+
+def _header(headers, names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_limiter():
+    """ The `RateLimiter` shared by every `Client` created without one. """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = RateLimiter()
+        return _default
@@ -0,0 +1,427 @@
+# cbadv/shared_books.py
+#
+#
+# Order books maintained by worker processes and published to shared memory
+#
+# `ProcessOrderBooks` is the process mode of `OrderBooks`: the main process
+# only reads the websocket and routes raw frames to the worker owning each
+# product. Workers decode, maintain the books and publish top-of-book and
+# top-N depth into a `multiprocessing.shared_memory` table that any process
+# can read without locks.
+
+import json
+import os
+import re
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import Pipe, Process, shared_memory
+from threading import Lock
+
+from cbadv.decoder import RawDecoder, get_decoder
+from cbadv.order_book import OrderBook
+from cbadv.order_books import OrderBooks, SequenceTracker
+
+TopOfBook = namedtuple('TopOfBook', ['bid_price', 'bid_size', 'ask_price', 'ask_size',
+                                     'time', 'version'])
+
+NAN = float('nan')
+
+
+class SharedBookTable(object):
+    """ Fixed layout table of books in shared memory, guarded by seqlocks.
+
+    Layout (little endian):
+        header      magic, n_products, depth               3 x uint64
+        names       product ids, NUL padded                n_products x 32 bytes
+        slots       one per product:
+                    version                                uint64
+                    writer pid                             uint64
+                    bid_price bid_size ask_price ask_size  4 x float64
+                    time                                   float64
+                    bids (price, size) * depth             2 x depth x float64
+                    asks (price, size) * depth             2 x depth x float64
+
+    A single writer per slot makes the version odd while it writes and even
+    once done. Readers retry until they see the same even version before and
+    after copying the slot, so they never block the writer nor read a torn
+    book. Missing levels read as NaN.
+
+    A write takes microseconds. A slot left odd by a writer that died halfway
+    makes readers raise rather than spin forever: as soon as the writer
+    process is gone, or after `WRITE_TIMEOUT` seconds.
+    """
+    MAGIC = 0x43424144564f4232  # 'CBADVOB2'
+    NAME_SIZE = 32
+    WRITE_TIMEOUT = 1.
+    # Odd versions seen between two checks of the writer.
+    _SPINS = 1024
+    _HEADER = struct.Struct('<3Q')
+
+    def __init__(self, shm, products, depth, owner):
+        self.shm = shm
+        self.name = shm.name
+        self.products = list(products)
+        self.depth = depth
+        self._owner = owner
+        self._index = {product_id: i for i, product_id in enumerate(self.products)}
+        self._slot = struct.Struct('<2Q{}d'.format(5 + 4 * depth))
+        self._values = struct.Struct('<{}d'.format(5 + 4 * depth))
+        self._top = struct.Struct('<2Q5d')
+        self._start = self._HEADER.size + self.NAME_SIZE * len(self.products)
+        self._start += -self._start % 8
+        self._words = shm.buf[:self.size(len(self.products), depth)].cast('Q')
+
+    @classmethod
+    def size(cls, n_products, depth):
+        start = cls._HEADER.size + cls.NAME_SIZE * n_products
+        start += -start % 8
+        return start + n_products * 8 * (7 + 4 * depth)
+
+    @classmethod
+    def create(cls, products, depth=10, name=None):
+        """ Allocate a table for `products` with `depth` levels per side. """
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=cls.size(len(products), depth))
+        cls._HEADER.pack_into(shm.buf, 0, cls.MAGIC, len(products), depth)
+        for i, product_id in enumerate(products):
+            encoded = product_id.encode('utf-8')
+            if len(encoded) > cls.NAME_SIZE:
+                raise ValueError('Product id too long: {}'.format(product_id))
+            offset = cls._HEADER.size + i * cls.NAME_SIZE
+            shm.buf[offset:offset + len(encoded)] = encoded
+        table = cls(shm, products, depth, owner=True)
+        for i in range(len(products)):
+            table._write(i, 0, (NAN,) * (5 + 4 * depth))
+        return table
+
+    @classmethod
+    def attach(cls, name, untrack=True):
+        """ Open a table created by another process.
+
+        Args:
+            name (str): Name of the shared memory segment.
+            untrack (bool): Stop the resource tracker of this process from
+                unlinking the segment when it exits. Leave it on in
+                independent processes; children started by the creator share
+                its tracker and must pass False.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        magic, n_products, depth = cls._HEADER.unpack_from(shm.buf, 0)
+        if magic != cls.MAGIC:
+            shm.close()
+            raise ValueError('{} is not an order book table'.format(name))
+        products = []
+        for i in range(n_products):
+            offset = cls._HEADER.size + i * cls.NAME_SIZE
+            products.append(bytes(shm.buf[offset:offset + cls.NAME_SIZE]).rstrip(b'\0').decode('utf-8'))
+        return cls(shm, products, depth, owner=False)
+
+    def _offset(self, index):
+        return self._start + index * self._slot.size
+
+    def _write(self, index, version, values):
+        offset = self._offset(index)
+        word = offset // 8
+        self._words[word + 1] = os.getpid()
+        self._words[word] = version + 1
+        self._values.pack_into(self.shm.buf, offset + 16, *values)
+        self._words[word] = version + 2
+
+    def publish(self, product_id, bids, asks):
+        """ Write the top levels of a book. Only one process may publish a product.
+
+        Args:
+            product_id (str): Product of the book.
+            bids (list): Best bids as (price, size), best first.
+            asks (list): Best asks as (price, size), best first.
+        """
+        index = self._index[product_id]
+        depth = self.depth
+        values = [NAN] * (5 + 4 * depth)
+        if bids:
+            values[0], values[1] = bids[0]
+        if asks:
+            values[2], values[3] = asks[0]
+        values[4] = time.time()
+        for i, (price, size) in enumerate(bids[:depth]):
+            values[5 + 2 * i] = price
+            values[6 + 2 * i] = size
+        base = 5 + 2 * depth
+        for i, (price, size) in enumerate(asks[:depth]):
+            values[base + 2 * i] = price
+            values[base + 1 + 2 * i] = size
+        word = self._offset(index) // 8
+        self._write(index, self._words[word], values)
+
+    def _read(self, product_id, layout):
+        offset = self._offset(self._index[product_id])
+        word = offset // 8
+        buf = self.shm.buf
+        spins = 0
+        deadline = None
+        while True:
+            version = self._words[word]
+            if version & 1:
+                spins += 1
+                if spins % self._SPINS == 0:
+                    now = time.monotonic()
+                    if deadline is None:
+                        deadline = now + self.WRITE_TIMEOUT
+                    if now >= deadline or not self._writer_alive(word):
+                        raise RuntimeError('The book of {} has been written for too long; '
+                                           'its writer (pid {}) died halfway or hangs'.format(
+                                               product_id, self._words[word + 1]))
+                continue
+            values = layout.unpack_from(buf, offset)
+            if self._words[word] == version:
+                return values
+
+    def _writer_alive(self, word):
+        pid = self._words[word + 1]
+        if not pid or os.name != 'posix':
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def top(self, product_id):
+        """ Latest published top of book of `product_id`. """
+        values = self._read(product_id, self._top)
+        return TopOfBook(values[2], values[3], values[4], values[5], values[6], values[0])
+
+    def depth_levels(self, product_id):
+        """ Latest published (bids, asks), each a list of (price, size). """
+        values = self._read(product_id, self._slot)
+        depth = self.depth
+        bids = [(values[7 + 2 * i], values[8 + 2 * i]) for i in range(depth)
+                if values[7 + 2 * i] == values[7 + 2 * i]]
+        base = 7 + 2 * depth
+        asks = [(values[base + 2 * i], values[base + 1 + 2 * i]) for i in range(depth)
+                if values[base + 2 * i] == values[base + 2 * i]]
+        return bids, asks
+
+    def close(self):
+        self._words.release()
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+_FRAME, _RESET, _QUIT = b'F', b'R', b'Q'
+
+
+def _worker_main(conn, table_name, products, depth, book_class, decoder_options):
+    """ Maintain `products` from frames received on `conn`, publish to the table. """
+    table = SharedBookTable.attach(table_name, untrack=False)
+    decode = get_decoder(**(decoder_options or {})).decode
+    books = {product_id: book_class(product_id=product_id) for product_id in products}
+    try:
+        while True:
+            data = conn.recv_bytes()
+            kind, payload = data[:1], data[1:]
+            if kind == _QUIT:
+                break
+            if kind == _RESET:
+                for product_id in json.loads(payload):
+                    books[product_id].reset()
+                    table.publish(product_id, [], [])
+                continue
+            for event in decode(payload)['events']:
+                book = books.get(event.get('product_id'))
+                if book is None:
+                    continue
+                event_type = event.get('type')
+                if event_type == 'snapshot':
+                    book.create_book(event['updates'])
+                elif event_type == 'update':
+                    if book._sequence == 0:
+                        continue
+                    book.update(event['updates'])
+                else:
+                    book._message(event['updates'])
+                bids, asks = book.top_levels(depth)
+                table.publish(event['product_id'], bids, asks)
+    finally:
+        table.close()
+
+
+class _Worker(object):
+    """ Pipe to a worker process. Every connection of a sharded
+    `ProcessOrderBooks` routes frames to it, so sends are serialized. """
+    def __init__(self, process, pipe):
+        self.process = process
+        self.pipe = pipe
+        self._lock = Lock()
+
+    def send(self, data):
+        with self._lock:
+            self.pipe.send_bytes(data)
+
+
+class _WorkerBook(object):
+    """ Stands in `ProcessOrderBooks.order_books` for a book kept by a
+    worker; read the book from the `SharedBookTable`. """
+    def __init__(self, product_id, worker):
+        self.product_id = product_id
+        self.worker = worker
+
+    def reset(self):
+        self.worker.send(_RESET + json.dumps([self.product_id]).encode('utf-8'))
+
+
+class ProcessOrderBooks(OrderBooks):
+    """ `OrderBooks` whose books are maintained in worker processes.
+
+    Decoding and book maintenance run in `workers` processes, each owning a
+    partition of the products. The connections only check sequence numbers
+    and route raw frames; resyncs, sharding, rebalancing and adding or
+    removing products work as with `OrderBooks`. Workers publish the top
+    `depth` levels of every book into a `SharedBookTable`; strategy
+    processes read it with `SharedBookTable.attach(books.table_name)`
+    without any locking.
+
+    Args:
+        api_key (str): Your coinbase advanced trade API key.
+        api_secret (str): Your coinbase advanced trade API secret.
+        product_id (list): Products to follow. The table has a slot for each
+            of them only: products removed can be added back, others not.
+        workers (int): Number of worker processes.
+        depth (int): Levels per side published to shared memory.
+        book_class (type): Book engine used by the workers. Must be picklable.
+        decoder_options (Optional[dict]): `get_decoder` arguments used by the
+            workers.
+        table_name (Optional[str]): Name of the shared memory segment.
+        log_to, shards, rebalance_interval, metrics, standby, stale_after:
+            See `OrderBooks`.
+    """
+    # Frames are matched as bytes: what the workers receive, and what a
+    # replayed capture holds.
+    _PRODUCT = re.compile(rb'"product_id"\s*:\s*"([^"]+)"')
+    _SEQUENCE = re.compile(rb'"sequence_num"\s*:\s*(\d+)')
+    _TIMESTAMP = re.compile(rb'"timestamp"\s*:\s*"([^"]+)"')
+
+    def __init__(self, api_key, api_secret, product_id=["BTC-USD", "ETH-USD"], workers=2,
+                 depth=10, book_class=OrderBook, decoder_options=None, table_name=None,
+                 log_to=None, shards=1, rebalance_interval=None, metrics=None, standby=False,
+                 stale_after=None):
+        product_id = list(product_id)
+        self.depth = depth
+        self.table = SharedBookTable.create(product_id, depth, name=table_name)
+        self.table_name = self.table.name
+        # The books are created by OrderBooks.__init__, on these workers.
+        self._workers = []
+        self._route = {}
+        for index in range(min(workers, len(product_id))):
+            products = product_id[index::workers]
+            receiver, sender = Pipe(duplex=False)
+            process = Process(target=_worker_main, daemon=True,
+                              args=(receiver, self.table_name, products, depth, book_class,
+                                    decoder_options))
+            worker = _Worker(process, sender)
+            self._workers.append(worker)
+            for product in products:
+                self._route[product] = worker
+        super(ProcessOrderBooks, self).__init__(
+            api_key, api_secret, product_id=product_id, log_to=log_to,
+            decoder=RawDecoder(), shards=shards, rebalance_interval=rebalance_interval,
+            checkpoint_interval=None, metrics=metrics, standby=standby,
+            stale_after=stale_after)
+
+    def _new_book(self, product_id):
+        return _WorkerBook(product_id, self._route[product_id])
+
+    def start_workers(self):
+        for worker in self._workers:
+            if worker.process.pid is None:
+                worker.process.start()
+
+    def start(self):
+        self.start_workers()
+        super(ProcessOrderBooks, self).start()
+
+    def on_open(self):
+        print("-- Subscribed to ProcessOrderBooks! --\n")
+
+    def on_close(self):
+        print("\n-- ProcessOrderBooks Socket Closed! --")
+
+    def _process(self, connection, frame):
+        if frame.__class__ is not bytes:
+            frame = frame.encode('utf-8')
+        match = self._SEQUENCE.search(frame, 0, 512)
+        if match is not None:
+            status = connection.sequence_tracker.check(int(match.group(1)))
+            if status == SequenceTracker.OUT_OF_ORDER:
+                self.out_of_order_count += 1
+                return
+            if status == SequenceTracker.GAP:
+                self.gap_count += 1
+                self.resync(connection.products, connection)
+        workers = set()
+        products = set(self._PRODUCT.findall(frame))
+        for product_id in products:
+            product_id = product_id.decode('utf-8')
+            # As in OrderBooks._apply: moved and removed products are dropped.
+            if self._connection_of.get(product_id) is connection:
+                self._product_counts[product_id] += 1
+                workers.add(self._route[product_id])
+        if workers:
+            data = _FRAME + frame
+            for worker in workers:
+                worker.send(data)
+        match = self._TIMESTAMP.search(frame, 0, 512)
+        connection.stats.record({'timestamp': match.group(1).decode('utf-8')} if match else {},
+                                len(products))
+
+    def add_products(self, product_ids):
+        """ Follow more products, among those the table was created for.
+
+        See `OrderBooks.add_products`.
+
+        Raises:
+            ValueError: A product has no slot in the table.
+        """
+        unknown = [product_id for product_id in product_ids if product_id not in self._route]
+        if unknown:
+            raise ValueError('No slot in the shared table for {}'.format(', '.join(unknown)))
+        return super(ProcessOrderBooks, self).add_products(product_ids)
+
+    def remove_products(self, product_ids):
+        """ Stop following products; their published books are emptied.
+
+        See `OrderBooks.remove_products`.
+        """
+        for product_id in product_ids:
+            book = self.order_books.get(product_id)
+            if book is not None:
+                book.reset()
+        return super(ProcessOrderBooks, self).remove_products(product_ids)
+
+    def top(self, product_id):
+        return self.table.top(product_id)
+
+    def close(self):
+        super(ProcessOrderBooks, self).close()
+        self.shutdown()
+
+    def shutdown(self, timeout=5):
+        """ Stop the workers and release the shared memory table. """
+        for worker in self._workers:
+            process = worker.process
+            if process.pid is not None:
+                try:
+                    worker.send(_QUIT)
+                except (BrokenPipeError, OSError):
+                    pass
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+        self.table.close()
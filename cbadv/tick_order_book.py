@@ -0,0 +1,311 @@
+# cbadv/tick_order_book.py
+#
+#
+# Live order book backed by fixed-point price ladders
+
+from array import array
+from bisect import bisect_left
+from decimal import Decimal
+
+from cbadv.book_features import ASK, BID
+from cbadv.cbadv_client import Client
+
+
+class FixedPoint(object):
+    """ Converts decimal strings to integer multiples of an increment.
+
+    Prices are scaled by the product's `quote_increment` (ticks) and sizes by
+    its `base_increment` (lots), so the book never builds a `Decimal` on the
+    update path.
+
+    Attributes:
+        increment (Decimal): Value of one unit.
+        decimals (int): Number of decimal places of `increment`.
+        step (int): `increment` expressed in units of 10 ** -decimals.
+    """
+    __slots__ = ('increment', 'decimals', 'step', '_scale', '_float')
+
+    # Above 2 ** 52 units a double can no longer round-trip every integer.
+    _EXACT_LIMIT = float(2 ** 52)
+
+    def __init__(self, increment):
+        increment = Decimal(str(increment))
+        if increment <= 0:
+            raise ValueError('Increment must be positive: {}'.format(increment))
+        exponent = increment.normalize().as_tuple().exponent
+        self.increment = increment
+        self.decimals = max(0, -exponent)
+        self.step = int(increment.scaleb(self.decimals))
+        self._scale = float(10 ** self.decimals)
+        self._float = float(increment)
+
+    def to_int(self, value):
+        """ Convert a decimal string (or number) to a count of increments.
+
+        Values are rounded to the nearest unit of 10 ** -decimals, then
+        floored to the increment grid.
+        """
+        units = float(value) * self._scale
+        if units < self._EXACT_LIMIT:
+            units = int(units + 0.5)
+        else:
+            units = int(Decimal(str(value)).scaleb(self.decimals).to_integral_value())
+        if self.step != 1:
+            return units // self.step
+        return units
+
+    def to_decimal(self, units):
+        return Decimal(units * self.step).scaleb(-self.decimals)
+
+    def to_float(self, units):
+        return units * self._float
+
+
+class TickOrderBook(object):
+    """ Order book storing price levels as integer ticks in parallel arrays.
+
+    Drop-in replacement for `OrderBook` (pass it as `book_class` to
+    `OrderBooks`). Each side keeps a sorted `array('q')` of price keys and a
+    parallel `array('q')` of sizes in lots. Bids are keyed by tick and asks by
+    negated tick so that the best level of both sides sits at the end of its
+    arrays: reading it is O(1) and updates near the top of the book only shift
+    a few elements.
+
+    Args:
+        product_id (str): Product of the book (eg. 'BTC-USD').
+        quote_increment (Optional[str]): Price tick. Fetched with
+            `Client.get_product` when omitted.
+        base_increment (Optional[str]): Size lot. Fetched with
+            `Client.get_product` when omitted.
+        features (Optional[BookFeatures]): Aggregates kept up to date by
+            the book, see `cbadv.book_features`.
+    """
+    def __init__(self, product_id='BTC-USD', quote_increment=None, base_increment=None,
+                 features=None):
+        self.product = product_id
+        self._client = Client()
+        if quote_increment is None or base_increment is None:
+            product = self._client.get_product(product_id)
+            quote_increment = quote_increment or product['quote_increment']
+            base_increment = base_increment or product['base_increment']
+        self._price = FixedPoint(quote_increment)
+        self._size = FixedPoint(base_increment)
+        self._bid_keys = array('q')
+        self._bid_sizes = array('q')
+        self._ask_keys = array('q')
+        self._ask_sizes = array('q')
+        self._sequence = 0
+        self._current_ticker = None
+        self._bid_top = self._ask_top = (None, None, None)
+        self.features = features
+        if features is not None:
+            features.attach(self, self._size.to_float)
+
+    def _message(self, events):
+        if self._sequence == 0:
+            self.create_book(events)
+        else:
+            self.update(events)
+
+    def reset(self):
+        """ Drop every level; the book waits for a new snapshot. """
+        self._bid_keys, self._bid_sizes = array('q'), array('q')
+        self._ask_keys, self._ask_sizes = array('q'), array('q')
+        self._bid_top = self._ask_top = (None, None, None)
+        self._sequence = 0
+        if self.features is not None:
+            self.features.reset()
+
+    def create_book(self, events):
+        price = self._price.to_int
+        size = self._size.to_int
+        bids = {}
+        asks = {}
+        for event in events:
+            quantity = size(event['new_quantity'])
+            if event['side'] == 'bid':
+                bids[price(event['price_level'])] = quantity
+            else:
+                asks[-price(event['price_level'])] = quantity
+        self._bid_keys, self._bid_sizes = self._build_side(bids)
+        self._ask_keys, self._ask_sizes = self._build_side(asks)
+        self._sequence += 1
+        if self.features is not None:
+            self.features.rebuild()
+
+    @staticmethod
+    def _build_side(levels):
+        keys = array('q')
+        sizes = array('q')
+        for key in sorted(levels):
+            if levels[key]:
+                keys.append(key)
+                sizes.append(levels[key])
+        return keys, sizes
+
+    def update(self, events):
+        price = self._price.to_int
+        size = self._size.to_int
+        if self.features is not None:
+            for event in events:
+                if event['side'] == 'bid':
+                    self._set_tracked(BID, price(event['price_level']), size(event['new_quantity']))
+                else:
+                    self._set_tracked(ASK, -price(event['price_level']), size(event['new_quantity']))
+            self._sequence += 1
+            return
+        for event in events:
+            if event['side'] == 'bid':
+                self._set(self._bid_keys, self._bid_sizes,
+                          price(event['price_level']), size(event['new_quantity']))
+            else:
+                self._set(self._ask_keys, self._ask_sizes,
+                          -price(event['price_level']), size(event['new_quantity']))
+        self._sequence += 1
+
+    def remove(self, event):
+        if self.features is not None:
+            if event['side'] == 'bid':
+                self._set_tracked(BID, self._price.to_int(event['price_level']), 0)
+            else:
+                self._set_tracked(ASK, -self._price.to_int(event['price_level']), 0)
+            return
+        if event['side'] == 'bid':
+            self._set(self._bid_keys, self._bid_sizes,
+                      self._price.to_int(event['price_level']), 0)
+        else:
+            self._set(self._ask_keys, self._ask_sizes,
+                      -self._price.to_int(event['price_level']), 0)
+
+    @staticmethod
+    def _set(keys, sizes, key, size):
+        n = len(keys)
+        # Most updates land on the top levels, at the end of the arrays.
+        if n and keys[-1] == key:
+            i = n - 1
+        else:
+            i = bisect_left(keys, key)
+        if i < n and keys[i] == key:
+            if size:
+                sizes[i] = size
+            else:
+                del keys[i]
+                del sizes[i]
+        elif size:
+            keys.insert(i, key)
+            sizes.insert(i, size)
+
+    def _set_tracked(self, side, key, size):
+        # `_set` for books with features, which need the previous size and
+        # the rank of the level.
+        if side == BID:
+            keys, sizes = self._bid_keys, self._bid_sizes
+        else:
+            keys, sizes = self._ask_keys, self._ask_sizes
+        n = len(keys)
+        if n and keys[-1] == key:
+            i = n - 1
+        else:
+            i = bisect_left(keys, key)
+        if i < n and keys[i] == key:
+            old = sizes[i]
+            if size:
+                sizes[i] = size
+            else:
+                del keys[i]
+                del sizes[i]
+            rank = n - 1 - i
+        elif size:
+            old = 0
+            keys.insert(i, key)
+            sizes.insert(i, size)
+            rank = n - i
+        else:
+            return
+        if old != size:
+            self.features.change(side, key, old, size, rank)
+
+    def _feature_count(self, side):
+        return len(self._bid_keys if side == BID else self._ask_keys)
+
+    def _feature_best(self, side):
+        keys = self._bid_keys if side == BID else self._ask_keys
+        return keys[-1] if keys else None
+
+    def _feature_size_at(self, side, rank):
+        sizes = self._bid_sizes if side == BID else self._ask_sizes
+        return sizes[-1 - rank] if rank < len(sizes) else 0
+
+    def _feature_sum(self, side, low, high):
+        # Lots of the levels whose key is in [low, high); None is unbounded.
+        if side == BID:
+            keys, sizes = self._bid_keys, self._bid_sizes
+        else:
+            keys, sizes = self._ask_keys, self._ask_sizes
+        start = 0 if low is None else bisect_left(keys, low)
+        stop = len(keys) if high is None else bisect_left(keys, high)
+        return sum(sizes[start:stop])
+
+    def _level(self, side, tick, lots):
+        return {'side': side,
+                'price_level': self._price.to_decimal(tick),
+                'new_quantity': self._size.to_decimal(lots)}
+
+    def get_ask(self):
+        key, lots = self._ask_keys[-1], self._ask_sizes[-1]
+        top = self._ask_top
+        # The top of book changes far less often than the book itself.
+        if top[0] != key or top[1] != lots:
+            top = self._ask_top = (key, lots, self._level('offer', -key, lots))
+        return top[2]
+
+    def get_bid(self):
+        key, lots = self._bid_keys[-1], self._bid_sizes[-1]
+        top = self._bid_top
+        if top[0] != key or top[1] != lots:
+            top = self._bid_top = (key, lots, self._level('bid', key, lots))
+        return top[2]
+
+    def top_levels(self, n):
+        """ Best `n` levels of each side as lists of (price, size) floats. """
+        price, size = self._price._float, self._size._float
+        bids = [(key * price, lots * size) for key, lots in
+                zip(self._bid_keys[:-n - 1:-1], self._bid_sizes[:-n - 1:-1])]
+        asks = [(-key * price, lots * size) for key, lots in
+                zip(self._ask_keys[:-n - 1:-1], self._ask_sizes[:-n - 1:-1])]
+        return bids, asks
+
+    def snapshot(self):
+        """ Every level as update dicts that `create_book` restores exactly. """
+        price, size = self._price.to_decimal, self._size.to_decimal
+        levels = [{'side': 'bid', 'price_level': str(price(key)), 'new_quantity': str(size(lots))}
+                  for key, lots in zip(self._bid_keys, self._bid_sizes)]
+        levels += [{'side': 'offer', 'price_level': str(price(-key)), 'new_quantity': str(size(lots))}
+                   for key, lots in zip(self._ask_keys, self._ask_sizes)]
+        return levels
+
+    def get_depth(self, n=None):
+        """ Export the top `n` levels of both sides as numpy arrays.
+
+        Reads the ladders through the buffer protocol, without building a
+        Python object per level. Requires numpy.
+
+        Args:
+            n (Optional[int]): Number of levels per side. Defaults to all.
+
+        Returns:
+            DepthSnapshot: `bids` and `asks` `Depth`, best level first.
+        """
+        from cbadv import book_analytics
+        np = book_analytics.np
+        sides = []
+        for keys, sizes, sign in ((self._bid_keys, self._bid_sizes, 1.),
+                                  (self._ask_keys, self._ask_sizes, -1.)):
+            count = len(keys) if n is None else min(n, len(keys))
+            start = len(keys) - count
+            # Copies are made immediately: a live view would pin the arrays'
+            # buffers and make any later resize raise BufferError.
+            price = np.frombuffer(keys, np.int64)[start:][::-1] * (sign * self._price._float)
+            size = np.frombuffer(sizes, np.int64)[start:][::-1] * self._size._float
+            sides.append(book_analytics.make_depth(price, size))
+        return book_analytics.DepthSnapshot(*sides)
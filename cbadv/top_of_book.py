@@ -0,0 +1,205 @@
+# cbadv/top_of_book.py
+#
+#
+# Top of book change stream
+#
+# `OrderBooks(top_of_book=TopOfBookFeed(...))` compares the best levels of a
+# book after every event it applies and emits a `TopOfBook` only when they
+# changed, so consumers wake on real changes instead of reading `get_bid`
+# and `get_ask` after every message. Changes can be conflated per product,
+# and delivered to a callback or read from a queue.
+
+import heapq
+import threading
+import time
+from collections import deque, namedtuple
+from queue import Empty
+
+
+class TopOfBook(namedtuple('TopOfBook', ['product_id', 'bids', 'asks', 'time'])):
+    """ Best levels of a book after a change.
+
+    Attributes:
+        product_id (str): Product of the book.
+        bids (tuple): (price, size) floats of the best bids, best first.
+        asks (tuple): (price, size) floats of the best asks, best first.
+        time (float): Epoch seconds the change was applied.
+    """
+    __slots__ = ()
+
+    @property
+    def bid(self):
+        return self.bids[0][0] if self.bids else None
+
+    @property
+    def bid_size(self):
+        return self.bids[0][1] if self.bids else None
+
+    @property
+    def ask(self):
+        return self.asks[0][0] if self.asks else None
+
+    @property
+    def ask_size(self):
+        return self.asks[0][1] if self.asks else None
+
+    @property
+    def mid(self):
+        if not (self.bids and self.asks):
+            return None
+        return (self.bids[0][0] + self.asks[0][0]) / 2
+
+
+class TopOfBookFeed(object):
+    """ Stream of the changes of the best `depth` levels of each book.
+
+    With a `callback`, changes are delivered to it, on the thread reading
+    the websocket (or, for conflated changes, on the feed's timer thread;
+    calls never overlap). Without one they are read with `get`; a product
+    has at most one pending change, the latest, however slow the reader.
+
+        feed = TopOfBookFeed(depth=5, interval={'BTC-USD': 0.05})
+        books = OrderBooks(key, secret, product_id=['BTC-USD', 'ETH-USD'], top_of_book=feed)
+        books.start()
+        while True:
+            top = feed.get()
+            ...
+
+    Args:
+        callback (Optional[callable]): Called with each `TopOfBook`.
+        depth (int): Levels per side compared; 1 for the best bid and ask.
+        interval (Optional[float or dict]): Conflation interval in seconds,
+            or intervals by product. A product emits at most one change per
+            interval: the first at once, the latest of the following ones
+            when the interval ends.
+
+    Attributes:
+        changes (int): Changes detected.
+        conflated (int): Changes replaced by a later one before delivery.
+    """
+    def __init__(self, callback=None, depth=1, interval=None):
+        self.callback = callback
+        self.depth = depth
+        self.interval = interval
+        self.changes = 0
+        self.conflated = 0
+        self._tops = {}
+        self._last_emit = {}
+        # Conflated changes waiting for the end of their interval.
+        self._held = {}
+        self._due = []
+        # Changes waiting for `get`, in the order of their products' first change.
+        self._pending = {}
+        self._order = deque()
+        self._lock = threading.RLock()
+        self._ready = threading.Condition(self._lock)
+        self._timer = None
+        self._closed = False
+
+    def _interval(self, product_id):
+        if isinstance(self.interval, dict):
+            return self.interval.get(product_id)
+        return self.interval
+
+    def update(self, product_id, book):
+        """ Compare the best levels of `book` to the last ones; called by
+        `OrderBooks` after each event applied. """
+        bids, asks = book.top_levels(self.depth)
+        bids, asks = tuple(bids), tuple(asks)
+        last = self._tops.get(product_id)
+        if last is not None and last.bids == bids and last.asks == asks:
+            return
+        top = self._tops[product_id] = TopOfBook(product_id, bids, asks, time.time())
+        self.changes += 1
+        interval = self._interval(product_id)
+        if not interval:
+            self._emit(top)
+            return
+        with self._lock:
+            now = time.monotonic()
+            due = self._last_emit.get(product_id, -interval) + interval
+            if now >= due and product_id not in self._held:
+                self._last_emit[product_id] = now
+                self._emit(top)
+                return
+            if product_id in self._held:
+                self.conflated += 1
+            else:
+                heapq.heappush(self._due, (due, product_id))
+                self._start_timer()
+            self._held[product_id] = top
+            self._ready.notify_all()
+
+    def _emit(self, top):
+        with self._lock:
+            if self.callback is not None:
+                self.callback(top)
+                return
+            if top.product_id in self._pending:
+                self.conflated += 1
+            else:
+                self._order.append(top.product_id)
+            self._pending[top.product_id] = top
+            self._ready.notify_all()
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Thread(target=self._release_held, name='cbadv-top-of-book',
+                                           daemon=True)
+            self._timer.start()
+
+    def _release_held(self):
+        with self._lock:
+            while not self._closed:
+                if not self._due:
+                    self._ready.wait()
+                    continue
+                due, product_id = self._due[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._ready.wait(delay)
+                    continue
+                heapq.heappop(self._due)
+                top = self._held.pop(product_id, None)
+                if top is not None:
+                    self._last_emit[product_id] = time.monotonic()
+                    self._emit(top)
+
+    def get(self, timeout=None):
+        """ Next change, waiting up to `timeout` seconds (forever when None).
+
+        Raises:
+            queue.Empty: No change within `timeout`, or the feed is closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not self._order:
+                if self._closed:
+                    raise Empty
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self._ready.wait(remaining)
+            return self._pending.pop(self._order.popleft())
+
+    def top(self, product_id):
+        """ Latest `TopOfBook` of a product, delivered or not. """
+        return self._tops.get(product_id)
+
+    def remove(self, product_id):
+        """ Forget a product no longer followed. """
+        with self._lock:
+            self._tops.pop(product_id, None)
+            self._last_emit.pop(product_id, None)
+            self._held.pop(product_id, None)
+            if self._pending.pop(product_id, None) is not None:
+                self._order.remove(product_id)
+
+    def close(self):
+        """ Stop the timer thread and wake up readers. """
+        with self._lock:
+            self._closed = True
+            self._ready.notify_all()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
@@ -5,13 +5,300 @@
 # Template object to receive messages from the Coinbase Websocket Feed
 
 from __future__ import print_function
-import json, time, hmac, hashlib
-from threading import Thread
-from websocket import create_connection, WebSocketConnectionClosedException
+import json, time, hmac, hashlib, calendar, random, re
+from collections import deque
+from threading import Event, Thread, current_thread
+from websocket import (create_connection, WebSocketConnectionClosedException,
+                       WebSocketException, WebSocketTimeoutException)
 from cbadv.cbadv_auth import get_auth_headers
+from cbadv.decoder import get_decoder
+
+
+_second_cache = (None, 0)
+
+
+def parse_timestamp(timestamp):
+    """ Epoch seconds of a feed timestamp such as '2023-02-09T20:32:50.714964855Z'.
+
+    Messages arrive in bursts sharing the same second, so the date part is
+    parsed once per second and only the fraction is parsed per call.
+    """
+    global _second_cache
+    whole, _, fraction = timestamp.partition('.')
+    cached, seconds = _second_cache
+    if cached != whole:
+        seconds = calendar.timegm(time.strptime(whole.rstrip('Z'), '%Y-%m-%dT%H:%M:%S'))
+        _second_cache = (whole, seconds)
+    if fraction:
+        return seconds + float('0.' + fraction.rstrip('Z'))
+    return seconds
+
+
+def record_message_metrics(metrics, msg, received, decode, handler):
+    """ Report the `ws.*` timings of one message to a `cbadv.metrics` sink. """
+    tags = {'channel': msg.get('channel')}
+    metrics.observe('ws.decode', decode, tags)
+    metrics.observe('ws.handler', handler, tags)
+    timestamp = msg.get('timestamp')
+    if timestamp:
+        metrics.observe('ws.latency', received - parse_timestamp(timestamp), tags)
+
+
+def subscription_message(message_type, channel, products, api_key, api_secret):
+    """ Build a signed `subscribe` or `unsubscribe` message. """
+    timestamp = str(int(time.time()))
+    message = timestamp + ''.join(channel) + ','.join(products)
+    auth_headers = get_auth_headers(timestamp, message, api_key, api_secret)
+    return {'type': message_type,
+            'channel': channel,
+            'product_ids': products,
+            'signature': auth_headers['CB-ACCESS-SIGN'],
+            'api_key': auth_headers['CB-ACCESS-KEY'],
+            'timestamp': auth_headers['CB-ACCESS-TIMESTAMP']}
+
+
+# Channel of the messages of a subscription, when it differs from its name.
+MESSAGE_CHANNELS = {'level2': 'l2_data'}
+
+# Event key of the per-product items of a message channel. The events of
+# other channels, like l2_data, carry their `product_id` themselves.
+PRODUCT_ITEMS = {'ticker': 'tickers', 'ticker_batch': 'tickers', 'market_trades': 'trades',
+                 'candles': 'candles', 'user': 'orders'}
+
+
+def _product_list(products):
+    if products is None or isinstance(products, list):
+        return products
+    if isinstance(products, str):
+        return [products]
+    return list(products)
+
+
+def _route(handler, product_handlers, items):
+    """ Callable dispatching a message to the handlers of its channel. """
+    if not product_handlers:
+        return handler
+    get = product_handlers.get
+
+    def route(msg):
+        if handler is not None:
+            handler(msg)
+        for event in msg['events']:
+            for item in (event.get(items) or ()) if items is not None else (event,):
+                product_handler = get(item.get('product_id'))
+                if product_handler is not None:
+                    product_handler(msg, item)
+    return route
+
+
+class ReconnectStats(object):
+    """ Reconnections of a `WebsocketClient`.
+
+    Attributes:
+        reconnects (int): Connections replaced after a failure.
+        failovers (int): Those taken over by the standby connection.
+        failed_attempts (int): Connection attempts that failed.
+        recovered (int): Frames of the standby delivered on failover,
+            which the failed connection had not delivered.
+        duplicates (int): Frames of the standby skipped on failover as
+            already delivered.
+        gaps (int): Failovers whose standby frames did not reach back to
+            the last frame delivered: frames in between may be lost.
+        last_latency (float): Seconds from the failure to the new
+            connection, subscribed, of the last reconnection.
+        max_latency (float): Largest of those latencies.
+        downtime (float): Sum of those latencies.
+    """
+    def __init__(self):
+        self.reconnects = 0
+        self.failovers = 0
+        self.failed_attempts = 0
+        self.recovered = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.last_latency = 0.
+        self.max_latency = 0.
+        self.downtime = 0.
+
+    def record(self, latency, failover):
+        self.reconnects += 1
+        if failover:
+            self.failovers += 1
+        self.last_latency = latency
+        self.downtime += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+
+_TIMESTAMP = re.compile(r'"timestamp"\s*:\s*"([^"]+)"')
+
+
+def frame_time(frame):
+    """ Exchange timestamp of a raw frame in epoch seconds, None if absent. """
+    if frame.__class__ is bytes:
+        frame = frame[:512].decode('utf-8', 'replace')
+    match = _TIMESTAMP.search(frame, 0, 512)
+    return parse_timestamp(match.group(1)) if match is not None else None
+
+
+class StandbyConnection(object):
+    """ Second socket subscribed like the one of `client`, ready to take over.
+
+    Its own thread reads it into a buffer of the frames received in the last
+    `window` seconds, reconnecting with backoff if it fails. `take` stops
+    the reading and hands the socket and the buffer over.
+    """
+    POLL = 0.05
+
+    def __init__(self, client, window):
+        self.client = client
+        self.window = window
+        self.frames = deque()
+        self.ws = None
+        self.ready = Event()
+        self._released = False
+        self._closed = Event()
+        self.thread = Thread(target=self._run, name='cbadv-ws-standby', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        client = self.client
+        delay = client.reconnect_delay
+        while not (self._closed.is_set() or self._released):
+            try:
+                ws = client._open()
+            except Exception:
+                self._closed.wait(random.uniform(0, delay))
+                delay = min(delay * 2, client.max_reconnect_delay)
+                continue
+            delay = client.reconnect_delay
+            # Wake up regularly to notice `take` when the feed is quiet.
+            ws.settimeout(self.POLL)
+            self.frames.clear()
+            self.ws = ws
+            self.ready.set()
+            if self._read(ws):
+                return
+            self.ready.clear()
+            self.ws = None
+            _shutdown(ws)
+
+    def _read(self, ws):
+        frames = self.frames
+        window = self.window
+        while not self._closed.is_set():
+            if self._released:
+                return True
+            try:
+                data = ws.recv()
+            except WebSocketTimeoutException:
+                continue
+            except Exception:
+                return False
+            if not data:
+                return False
+            now = time.time()
+            frames.append((now, data))
+            horizon = now - window
+            while frames[0][0] < horizon:
+                frames.popleft()
+        return False
+
+    def send(self, message):
+        ws = self.ws
+        if ws is not None:
+            try:
+                ws.send(message)
+            except Exception:
+                # The reader thread sees the failure and reconnects.
+                pass
+
+    def take(self):
+        """ Stop reading; return the socket and its buffered frames, or None
+        if the standby is not connected. """
+        if not self.ready.is_set():
+            # Still connecting: its thread closes whatever it opens.
+            self._closed.set()
+            return None
+        self._released = True
+        self.thread.join()
+        if not self.ready.is_set():
+            return None
+        ws = self.ws
+        ws.settimeout(self.client.stale_after)
+        return ws, self.frames
+
+    def close(self):
+        self._closed.set()
+        ws = self.ws
+        if ws is not None:
+            _abort(ws)
+        self.thread.join()
+        ws = self.ws
+        if ws is not None:
+            _shutdown(ws)
+            self.ws = None
+
+
+def _abort(ws):
+    """ Wake up a thread blocked reading `ws`. """
+    try:
+        ws.abort()
+    except Exception:
+        pass
+
+
+def _shutdown(ws):
+    """ Close `ws` at once, without waiting for the close handshake. """
+    try:
+        ws.shutdown()
+    except Exception:
+        pass
 
 
 class WebsocketClient(object):
+    """ Template client of the websocket feed; override the `on_*` hooks.
+
+    A supervisor thread keeps the client connected: when the socket fails
+    it reconnects at once, then backs off exponentially with full jitter
+    while attempts keep failing. With `standby`, a second subscribed socket
+    is kept open; on failure it takes over without a connection round trip,
+    and the frames it received that the failed socket had not delivered
+    are passed to `on_message` first. `reconnect_stats` counts both.
+
+    One connection can carry several channels: pass a list as `channel`,
+    or `subscribe` and `unsubscribe` at runtime. `on` routes the messages
+    of each channel, or of each product of a channel, to its own handler
+    through a dict lookup.
+
+        ws = WebsocketClient(key, secret, products=['BTC-USD'],
+                             channel=['level2', 'ticker', 'market_trades'])
+        ws.on('ticker', on_ticker)
+        ws.on('market_trades', on_eth_trade, product_id='ETH-USD')
+        ws.subscribe('market_trades', ['ETH-USD'])
+
+    Keyword Args:
+        channel (str or list of str): Channels to subscribe to, each for
+            `products`.
+        reconnect_delay (float): Backoff after the first failed attempt.
+        max_reconnect_delay (float): Largest backoff.
+        max_retries (Optional[int]): Consecutive failed attempts before the
+            client stops; retries forever when None.
+        standby (bool): Keep a hot standby connection.
+        standby_window (float): Seconds of frames the standby keeps to
+            replay on failover; at least the time a failure takes to notice.
+        stale_after (Optional[float]): Consider the connection failed when
+            no frame arrives for that many seconds.
+    """
+    # Seconds before the last delivered frame from which the frames of the
+    # standby are replayed on failover. 0 skips every frame not newer than
+    # it; clients whose messages are idempotent, like level2 updates, can
+    # replay an overlap to absorb clock differences between the servers.
+    FAILOVER_OVERLAP = 0.
+
     def __init__(
             self,
             api_key,
@@ -20,10 +307,19 @@ class WebsocketClient(object):
             products=None,
             message_type="subscribe",
             should_print=True,
+            decoder=None,
+            recorder=None,
+            metrics=None,
             # Make channels a required keyword-only argument; see pep3102
             *,
             # Channel options: status, ticker, ticker_batch, level2, user, market_trades
-            channel):
+            channel,
+            reconnect_delay=0.1,
+            max_reconnect_delay=30,
+            max_retries=None,
+            standby=False,
+            standby_window=5.,
+            stale_after=None):
         self.url = url
         self.products = products
         self.channel = channel
@@ -32,21 +328,37 @@ class WebsocketClient(object):
         self.error = None
         self.ws = None
         self.thread = None
+        self.keepalive = None
         self.api_key = api_key
         self.api_secret = api_secret
         self.should_print = should_print
+        self.decoder = decoder or get_decoder()
+        self.recorder = recorder
+        self.metrics = metrics
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_retries = max_retries
+        self.standby = standby
+        self.standby_window = standby_window
+        self.stale_after = stale_after
+        self.reconnect_stats = ReconnectStats()
+        # Products by channel; None follows `products`.
+        self.subscriptions = {name: None for name in
+                              ([channel] if isinstance(channel, str) else channel or ())}
+        self._handlers = {}
+        self._routes = {}
+        self._standby = None
+        self._last_frame = None
+        self._closing = Event()
 
     def start(self):
-        def _go():
-            self._connect()
-            self._listen()
-            self._disconnect()
-
         self.stop = False
+        self._closing.clear()
         self.on_open()
-        self.thread = Thread(target=_go)
-        self.keepalive = Thread(target=self._keepalive)
+        self.thread = Thread(target=self._run)
+        self.keepalive = Thread(target=self._keepalive, daemon=True)
         self.thread.start()
+        self.keepalive.start()
 
     def _connect(self):
         if self.products is None:
@@ -59,60 +371,277 @@ class WebsocketClient(object):
 
         if self.channel is None:
             self.channel = "ticker"
-            sub_params = {'type': 'subscribe', 'channel': self.channel, 'product_ids': self.products}
+            self.subscriptions.setdefault("ticker", None)
+
+        self.ws = self._open()
+
+    def _open(self):
+        """ Open a socket subscribed to every channel of `subscriptions`. """
+        ws = create_connection(self.url)
+        for channel, products in list(self.subscriptions.items()):
+            ws.send(json.dumps(subscription_message(
+                'subscribe', channel, self.products if products is None else products,
+                self.api_key, self.api_secret)))
+        if self.stale_after:
+            ws.settimeout(self.stale_after)
+        return ws
+
+    def _send_subscription(self, message_type, products, channel=None):
+        """ Send a signed `subscribe` or `unsubscribe` on the live socket,
+        and on the standby one.
+
+        Without `channel`, for every channel following `products`.
+        """
+        if channel is None:
+            channels = [name for name, own in self.subscriptions.items() if own is None]
+        else:
+            channels = [channel]
+        standby = self._standby
+        for channel in channels:
+            message = json.dumps(subscription_message(
+                message_type, channel, products, self.api_key, self.api_secret))
+            self.ws.send(message)
+            if standby is not None:
+                standby.send(message)
+
+    def subscribe(self, channel, products=None):
+        """ Subscribe to `channel` now if connected, and on every connection.
+
+        Args:
+            channel (str): Channel name, e.g. 'level2' or 'market_trades'.
+            products (Optional[list]): Products to add to the channel.
+                Without them the channel follows `products`.
+        """
+        products = _product_list(products)
+        new = channel not in self.subscriptions
+        current = self.subscriptions.get(channel, ())
+        if products is None:
+            self.subscriptions[channel] = None
+            added = self.products if current is not None else []
         else:
-            sub_params = {'type': 'subscribe', 'channel': self.channel, 'product_ids': self.products}
+            if current is None:
+                current = list(self.products or ())
+            added = [product_id for product_id in products if product_id not in current]
+            self.subscriptions[channel] = list(current) + added
+        # Channels without products, like heartbeats, are subscribed too.
+        if added or new:
+            self._send_live('subscribe', added or [], channel)
+
+    def unsubscribe(self, channel, products=None):
+        """ Unsubscribe from `channel`, or from some of its products.
+
+        Args:
+            channel (str): Channel name.
+            products (Optional[list]): Products to drop. The whole channel
+                when None, or when none is left.
+        """
+        if channel not in self.subscriptions:
+            return
+        current = self.subscriptions[channel]
+        if current is None:
+            current = list(self.products or ())
+        products = _product_list(products)
+        removed = current if products is None else [p for p in current if p in products]
+        remaining = [] if products is None else [p for p in current if p not in products]
+        if remaining:
+            self.subscriptions[channel] = remaining
+        else:
+            del self.subscriptions[channel]
+        if removed:
+            self._send_live('unsubscribe', removed, channel)
+
+    def _send_live(self, message_type, products, channel=None):
+        """ `_send_subscription` on the live socket, if any, without raising.
+
+        Safe on the thread reading the socket: a failed send aborts the
+        connection, and the supervisor replaces it with one subscribed
+        from `subscriptions`.
+        """
+        ws = self.ws
+        if ws is None:
+            return
+        try:
+            self._send_subscription(message_type, products, channel)
+        except (WebSocketException, OSError):
+            _abort(ws)
+
+    def on(self, channel, handler, product_id=None):
+        """ Route the messages of `channel` to `handler(msg)`.
 
-        timestamp = str(int(time.time()))
-        message = timestamp + ''.join(self.channel) + ','.join(self.products)
-        auth_headers = get_auth_headers(timestamp, message, self.api_key, self.api_secret)
-        sub_params['signature'] = auth_headers['CB-ACCESS-SIGN']
-        sub_params['api_key'] = auth_headers['CB-ACCESS-KEY']
-        sub_params['timestamp'] = auth_headers['CB-ACCESS-TIMESTAMP']
+        With `product_id`, the items of that product are routed instead, as
+        `handler(msg, item)`: the level2 event of the product, or its
+        ticker, trade, candle or order. A None `handler` removes the route.
+        Routing happens in the default `on_message`.
 
-        self.ws = create_connection(self.url)
-        self.ws.send(json.dumps(sub_params))
+        Args:
+            channel (str): Channel name, as subscribed ('level2') or as
+                found in messages ('l2_data', 'subscriptions').
+        """
+        channel = MESSAGE_CHANNELS.get(channel, channel)
+        handlers = self._handlers.setdefault(channel, [None, {}])
+        if product_id is None:
+            handlers[0] = handler
+        elif handler is None:
+            handlers[1].pop(product_id, None)
+        else:
+            handlers[1][product_id] = handler
+        route = _route(handlers[0], handlers[1], PRODUCT_ITEMS.get(channel))
+        # Replaced rather than updated: the reading thread may be routing.
+        routes = dict(self._routes)
+        if route is None:
+            routes.pop(channel, None)
+        else:
+            routes[channel] = route
+        self._routes = routes
 
     def _keepalive(self, interval=30):
-        while self.ws.connected:
-            self.ws.ping("keepalive")
-            time.sleep(interval)
+        while not self._closing.wait(interval):
+            standby = self._standby
+            for ws in (self.ws, standby.ws if standby is not None else None):
+                if ws is not None:
+                    try:
+                        ws.ping("keepalive")
+                    except Exception:
+                        # The reading thread sees the failure.
+                        pass
+
+    def _run(self):
+        """ Supervisor: connect, read until the connection fails, repeat. """
+        stats = self.reconnect_stats
+        delay = self.reconnect_delay
+        attempts = 0
+        failed_at = None
+        try:
+            while not self.stop:
+                frames = None
+                standby, self._standby = self._standby, None
+                taken = standby.take() if standby is not None else None
+                if taken is not None:
+                    self.ws, frames = taken
+                else:
+                    try:
+                        self._connect()
+                    except Exception as e:
+                        if self.stop:
+                            break
+                        stats.failed_attempts += 1
+                        attempts += 1
+                        self.on_error(e)
+                        if self.max_retries is not None and attempts > self.max_retries:
+                            self.stop = True
+                            break
+                        self._closing.wait(random.uniform(0, delay))
+                        delay = min(delay * 2, self.max_reconnect_delay)
+                        continue
+                if failed_at is not None:
+                    latency = time.perf_counter() - failed_at
+                    stats.record(latency, frames is not None)
+                    if self.metrics is not None:
+                        self.metrics.observe('ws.reconnect', latency,
+                                             {'failover': frames is not None})
+                if self.standby:
+                    self._standby = StandbyConnection(self, self.standby_window).start()
+                if frames is not None:
+                    self._failover(frames)
+
+                last_frame = self._last_frame
+                self._listen()
+                failed_at = time.perf_counter()
+                _shutdown(self.ws)
+                if self._last_frame is last_frame and not self.stop:
+                    # Nothing received: back off as after a failed attempt,
+                    # rather than reconnecting in a tight loop.
+                    attempts += 1
+                    self._closing.wait(random.uniform(0, delay))
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                else:
+                    attempts = 0
+                    delay = self.reconnect_delay
+        finally:
+            if self._standby is not None:
+                self._standby.close()
+                self._standby = None
+            if self.ws is not None:
+                _shutdown(self.ws)
+            self._closing.set()
+            self.on_close()
 
     def _listen(self):
-        self.keepalive.start()
+        ws = self.ws
         while not self.stop:
+            metrics = self.metrics
             try:
-                data = self.ws.recv()
-                msg = json.loads(data)
+                data = ws.recv()
+                if not data:
+                    raise WebSocketConnectionClosedException('Connection closed by the server')
+                if metrics is not None:
+                    received = time.time()
+                    start = time.perf_counter()
+                if self.recorder is not None:
+                    self.recorder.write(data)
+                msg = self.decoder.decode(data)
             except ValueError as e:
                 self.on_error(e)
             except Exception as e:
-                self.on_error(e)
-                self._reconnect()
+                # The connection failed; the supervisor replaces it.
+                if not self.stop:
+                    self.on_error(e)
+                return
             else:
-                self.on_message(msg)
+                self._last_frame = data
+                if metrics is None:
+                    self.on_message(msg)
+                else:
+                    decoded = time.perf_counter()
+                    self.on_message(msg)
+                    record_message_metrics(metrics, msg, received, decoded - start,
+                                           time.perf_counter() - decoded)
 
-    def _disconnect(self):
-        try:
-            if self.ws:
-                self.ws.close()
-        except WebSocketConnectionClosedException as e:
-            pass
-        finally:
-            self.keepalive.join()
-
-        self.on_close()
-
-    def _reconnect(self):
-        self._disconnect()
-        time.sleep(0.01)  # Wait for 0.01 seconds before reconnecting
-        self._connect()
-        self._listen()
+    def _failover(self, frames):
+        """ Deliver the frames of the promoted standby that are newer than
+        the last frame delivered, less `FAILOVER_OVERLAP`. """
+        stats = self.reconnect_stats
+        threshold = None
+        if self._last_frame is not None:
+            threshold = frame_time(self._last_frame)
+            if threshold is not None:
+                threshold -= self.FAILOVER_OVERLAP
+        gap = False
+        if threshold is not None:
+            # The standby has read its socket without interruption since its
+            # oldest buffered frame: frames are only missing when that one is
+            # already past the threshold, or when nothing was buffered.
+            oldest = next((timestamp for timestamp in (frame_time(data) for _, data in frames)
+                           if timestamp is not None), None)
+            gap = (oldest is None and not frames) or (oldest is not None and oldest > threshold)
+        if gap:
+            stats.gaps += 1
+        self.on_failover(gap)
+        for received, data in frames:
+            if threshold is not None:
+                timestamp = frame_time(data)
+                if timestamp is not None and timestamp <= threshold:
+                    stats.duplicates += 1
+                    continue
+            if self.recorder is not None:
+                self.recorder.write(data)
+            try:
+                msg = self.decoder.decode(data)
+            except ValueError as e:
+                self.on_error(e)
+                continue
+            self._last_frame = data
+            self.on_message(msg)
+            stats.recovered += 1
 
     def close(self):
-        self.stop = True   # will only disconnect after next msg recv
-        self._disconnect() # force disconnect so threads can join
-        self.thread.join()
+        self.stop = True
+        self._closing.set()
+        if self.ws is not None:
+            # Wakes up the supervisor blocked reading the socket.
+            _abort(self.ws)
+        if self.thread is not None and self.thread is not current_thread():
+            self.thread.join()
 
     def on_open(self):
         if self.should_print:
@@ -121,15 +650,26 @@ class WebsocketClient(object):
     def on_close(self):
         if self.should_print:
             print("\n-- Socket Closed --")
-        self._reconnect()
 
     def on_message(self, msg):
-        if self.should_print:
+        route = self._routes.get(msg.get('channel'))
+        if route is not None:
+            route(msg)
+        elif self.should_print:
             print(msg)
 
+    def on_failover(self, gap=False):
+        """ Called when the standby takes over, before its frames are
+        delivered. Sequence numbers start over on the new connection.
+
+        Args:
+            gap (bool): The standby's buffer does not reach back to the last
+                frame delivered (see `standby_window`): frames in between
+                were lost.
+        """
+
     def on_error(self, e, data=None):
         self.error = e
-        self.stop = True
         print('{} - data: {}'.format(e, data))
 
 
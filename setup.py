@@ -30,6 +30,10 @@ setup(
     tests_require=tests_require,
     extras_require={
         'test': tests_require,
+        'numpy': ['numpy>=1.17'],
+        'async': ['websockets>=10.0', 'aiohttp>=3.8'],
+        'fast': ['orjson>=3.0', 'msgspec>=0.18'],
+        'bench': ['pytest-benchmark>=4.0', 'aiohttp>=3.8'],
     },
     description='The unofficial Python client for the Coinbase Advanced Trade API',
     long_description=long_description,
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import hmac
+import unittest
+from unittest.mock import patch
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+
+from cbadv.async_client import AsyncClient, gather
+from cbadv.cache import ResponseCache
+from cbadv.rate_limit import RateLimiter
+
+
+class TestAsyncClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.throttle = 1
+
+        async def product(request):
+            self.requests.append(request)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            return web.json_response({'product_id': request.match_info['product_id']})
+
+        async def fills(request):
+            self.requests.append(request)
+            start = int(request.query.get('cursor', 0))
+            items = list(range(start, min(start + 4, 10)))
+            more = start + 4 < 10
+            return web.json_response({'fills': items, 'cursor': str(start + 4) if more else ''})
+
+        async def orders(request):
+            self.requests.append(request)
+            body = await request.json()
+            return web.json_response({'success': True, 'product_id': body['product_id']})
+
+        async def accounts(request):
+            self.requests.append(request)
+            if self.throttle:
+                self.throttle -= 1
+                return web.json_response({'error': 'rate limited'}, status=429,
+                                         headers={'Retry-After': '0.01'})
+            return web.json_response({'accounts': [], 'has_next': False})
+
+        self.peers = set()
+
+        @web.middleware
+        async def peers(request, handler):
+            self.peers.add(request.transport.get_extra_info('peername'))
+            return await handler(request)
+
+        app = web.Application(middlewares=[peers])
+        app.router.add_get('/api/v3/brokerage/products/{product_id}', product)
+        app.router.add_get('/api/v3/brokerage/orders/historical/fills', fills)
+        app.router.add_post('/api/v3/brokerage/orders', orders)
+        app.router.add_get('/api/v3/brokerage/accounts', accounts)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.limiter = RateLimiter(private_rate=10000)
+        self.url = 'http://127.0.0.1:{}/api/v3/brokerage'.format(port)
+        self.client = AsyncClient('key', 'secret', rate_limiter=self.limiter, api_url=self.url)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.runner.cleanup()
+
+    async def test_signed_request(self):
+        self.assertEqual(await self.client.get_product('BTC-USD'), {'product_id': 'BTC-USD'})
+        request = self.requests[0]
+        message = (request.headers['CB-ACCESS-TIMESTAMP'] + 'GET' +
+                   '/api/v3/brokerage/products/BTC-USD')
+        expected = hmac.new(b'secret', message.encode(), hashlib.sha256).hexdigest()
+        self.assertEqual(request.headers['CB-ACCESS-SIGN'], expected)
+        self.assertEqual(request.headers['CB-ACCESS-KEY'], 'key')
+
+    async def test_same_surface_as_client(self):
+        response = await self.client.place_limit_order('ETH-USD', 'buy', '100.00', '0.01')
+        self.assertEqual(response, {'success': True, 'product_id': 'ETH-USD'})
+        with self.assertRaises(ValueError):
+            await self.client.place_market_order('ETH-USD', 'buy', size=1, funds=1)
+
+    async def test_place_orders(self):
+        orders = [{'product_id': 'P{}-USD'.format(i), 'side': 'buy', 'order_type': 'limit',
+                   'price': '100.00', 'size': '0.01'} for i in range(5)]
+        results = await self.client.place_orders(orders, workers=2)
+        self.assertEqual([r.response['product_id'] for r in results],
+                         [order['product_id'] for order in orders])
+        self.assertTrue(all(r.ok for r in results))
+        with self.assertRaisesRegex(ValueError, '^order 0: '):
+            await self.client.place_orders([dict(orders[0], order_type='market', funds='1')])
+        self.assertEqual(len(self.requests), 5)
+
+    async def test_cancelled_order_is_an_error(self):
+        send = self.client._send_message
+
+        async def cancel_eth(method, endpoint, params=None, data=None):
+            if 'ETH-USD' in data:
+                raise asyncio.CancelledError()
+            return await send(method, endpoint, params, data)
+
+        orders = [{'product_id': p, 'side': 'buy', 'order_type': 'limit', 'price': '1.00',
+                   'size': '1'} for p in ('BTC-USD', 'ETH-USD')]
+        with patch.object(self.client, '_send_message', cancel_eth):
+            results = await self.client.place_orders(orders)
+        self.assertEqual([r.ok for r in results], [True, False])
+        self.assertIsNone(results[1].response)
+        self.assertIsInstance(results[1].error, asyncio.CancelledError)
+
+    async def test_prewarm(self):
+        self.assertFalse(hasattr(self.client, 'adapter'))
+        self.assertEqual(await self.client.prewarm(3), 3)
+        self.assertEqual(len(self.peers), 3)
+        # Requests reuse the warm connections.
+        await gather(*(self.client.get_product(p) for p in ('BTC-USD', 'ETH-USD')))
+        self.assertEqual(len(self.peers), 3)
+        self.assertEqual(len(self.requests), 2)
+
+    async def test_pool_maxsize(self):
+        client = AsyncClient('key', 'secret', rate_limiter=self.limiter, api_url=self.url,
+                             pool_maxsize={'127.0.0.1': 2, '*': 8})
+        self.addAsyncCleanup(client.close)
+        self.assertEqual(client.pool_maxsize, 2)
+        self.assertEqual(await client.prewarm(5), 2)
+        await gather(*(client.get_product(str(i)) for i in range(6)))
+        self.assertEqual(self.max_active, 2)
+        self.assertEqual(len(self.peers), 2)
+
+    async def test_cache(self):
+        client = AsyncClient('key', 'secret', rate_limiter=self.limiter, api_url=self.url,
+                             cache=ResponseCache())
+        self.addAsyncCleanup(client.close)
+        for _ in range(3):
+            self.assertEqual(await client.get_product('BTC-USD'), {'product_id': 'BTC-USD'})
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(client.cache.stats().hits, 2)
+
+    async def test_gather_bounds_concurrency(self):
+        ids = ['P{}-USD'.format(i) for i in range(20)]
+        products = await self.client.gather(*(self.client.get_product(p) for p in ids),
+                                            concurrency=5)
+        self.assertEqual([p['product_id'] for p in products], ids)
+        self.assertLessEqual(self.max_active, 5)
+        self.assertGreater(self.max_active, 1)
+        # One pooled connection per concurrent request at most.
+        self.assertLessEqual(len({r.transport for r in self.requests}), 5)
+
+    async def test_iter_fills(self):
+        for prefetch in (False, True):
+            fills = [fill async for fill in self.client.iter_fills(product_id='BTC-USD',
+                                                                   prefetch=prefetch)]
+            self.assertEqual(fills, list(range(10)))
+        self.assertEqual([r.query.get('cursor') for r in self.requests[:3]], [None, '4', '8'])
+        self.assertEqual(self.requests[0].query['product_id'], 'BTC-USD')
+
+    async def test_retries_after_429(self):
+        self.assertEqual(await self.client.list_accounts(),
+                         {'accounts': [], 'has_next': False})
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.limiter.throttled, 1)
+
+
+class TestGather(unittest.IsolatedAsyncioTestCase):
+
+    async def test_order_and_exceptions(self):
+        async def value(i):
+            await asyncio.sleep(0.001 * (5 - i))
+            if i == 3:
+                raise KeyError(i)
+            return i
+
+        results = await gather(*(value(i) for i in range(5)), concurrency=2,
+                               return_exceptions=True)
+        self.assertEqual(results[:3], [0, 1, 2])
+        self.assertIsInstance(results[3], KeyError)
+        self.assertEqual(results[4], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import unittest
+
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from cbadv.async_websocket_client import AsyncWebsocketClient, MessageQueue, QueueClosed
+from cbadv.decoder import RawDecoder
+
+
+def ticker(product_id, price):
+    return {'channel': 'ticker', 'events': [
+        {'type': 'update', 'tickers': [{'product_id': product_id, 'price': price}]}]}
+
+
+class TestMessageQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def drain(self, queue):
+        queue.close()
+        items = []
+        while True:
+            try:
+                items.append(await queue.get())
+            except QueueClosed:
+                return items
+
+    async def test_drop_oldest(self):
+        queue = MessageQueue(2, 'drop_oldest')
+        for i in range(4):
+            await queue.put(i)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(await self.drain(queue), [2, 3])
+
+    async def test_coalesce_per_product(self):
+        queue = MessageQueue(2, 'coalesce')
+        await queue.put(ticker('BTC-USD', '1'))
+        await queue.put(ticker('ETH-USD', '2'))
+        await queue.put(ticker('BTC-USD', '3'))
+        await queue.put(ticker('ETH-USD', '4'))
+        self.assertEqual(queue.coalesced, 2)
+        prices = [msg['events'][0]['tickers'][0]['price'] for msg in await self.drain(queue)]
+        self.assertEqual(prices, ['3', '4'])
+        # Without a pending message for its product, the oldest one goes.
+        queue = MessageQueue(1, 'coalesce')
+        await queue.put(ticker('BTC-USD', '1'))
+        await queue.put(ticker('ETH-USD', '2'))
+        self.assertEqual(queue.dropped, 1)
+
+    async def test_block(self):
+        queue = MessageQueue(1, 'block')
+        await queue.put(1)
+        producer = asyncio.ensure_future(queue.put(2))
+        await asyncio.sleep(0.01)
+        self.assertFalse(producer.done())
+        self.assertEqual(await queue.get(), 1)
+        await producer
+        self.assertEqual(await queue.get(), 2)
+
+    async def test_close_wakes_consumer(self):
+        queue = MessageQueue(1)
+        consumer = asyncio.ensure_future(queue.get())
+        await asyncio.sleep(0.01)
+        queue.close()
+        with self.assertRaises(QueueClosed):
+            await consumer
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            MessageQueue(1, 'spill')
+
+
+class TestAsyncWebsocketClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.received = []
+
+        async def handler(ws):
+            self.received.append(json.loads(await ws.recv()))
+            for i in range(5):
+                await ws.send(json.dumps(ticker('BTC-USD', str(i))))
+            await ws.wait_closed()
+
+        self.server = await websockets.serve(handler, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = 'ws://127.0.0.1:{}'.format(port)
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_subscribe_and_iterate(self):
+        async with AsyncWebsocketClient('key', 'secret', url=self.url,
+                                        products=['BTC-USD'], channel='ticker') as ws:
+            prices = []
+            async for msg in ws:
+                prices.append(msg['events'][0]['tickers'][0]['price'])
+                if len(prices) == 5:
+                    break
+        self.assertEqual(prices, ['0', '1', '2', '3', '4'])
+        self.assertEqual(self.received[0]['type'], 'subscribe')
+        self.assertEqual(self.received[0]['product_ids'], ['BTC-USD'])
+        self.assertIn('signature', self.received[0])
+
+    async def test_custom_decoder(self):
+        decoder = RawDecoder()
+        async with AsyncWebsocketClient('key', 'secret', url=self.url, products=['BTC-USD'],
+                                        channel='ticker', decoder=decoder) as ws:
+            self.assertIs(ws.decoder, decoder)
+            frame = await ws.__anext__()
+        self.assertEqual(json.loads(frame), ticker('BTC-USD', '0'))
+
+    async def test_close_cancels_reader(self):
+        ws = AsyncWebsocketClient('key', 'secret', url=self.url, channel='ticker')
+        await ws.start()
+        task = ws._task
+        await ws.close()
+        self.assertTrue(task.done())
+        # Iteration ends once the pending messages are consumed.
+        self.assertLessEqual(len([msg async for msg in ws]), 5)
+
+    async def test_subscriptions_survive_reconnection(self):
+        connections = []
+
+        async def handler(ws):
+            connections.append([json.loads(await ws.recv())])
+            if len(connections) == 1:
+                # Closes once the client changed its subscriptions.
+                for _ in range(2):
+                    connections[-1].append(json.loads(await ws.recv()))
+                return
+            await ws.send(json.dumps(ticker('ETH-USD', '1')))
+            await ws.wait_closed()
+
+        server = await websockets.serve(handler, '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        url = 'ws://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1])
+        async with AsyncWebsocketClient('key', 'secret', url=url, products=['BTC-USD'],
+                                        channel='ticker', reconnect_delay=0.01) as ws:
+            await ws.subscribe(['ETH-USD'])
+            await ws.unsubscribe(['BTC-USD'])
+            msg = await asyncio.wait_for(ws.recv(), 5)
+        self.assertEqual(msg['events'][0]['tickers'][0]['product_id'], 'ETH-USD')
+        self.assertEqual(ws.reconnects, 1)
+        self.assertEqual([(m['type'], m['product_ids']) for m in connections[0]],
+                         [('subscribe', ['BTC-USD']), ('subscribe', ['ETH-USD']),
+                          ('unsubscribe', ['BTC-USD'])])
+        self.assertEqual((connections[1][0]['type'], connections[1][0]['product_ids']),
+                         ('subscribe', ['ETH-USD']))
+
+    async def test_reader_failure_ends_iteration(self):
+        class FailingSink(object):
+            def observe(self, name, value, tags=None):
+                raise RuntimeError('sink down')
+
+        ws = AsyncWebsocketClient('key', 'secret', url=self.url, channel='ticker',
+                                  metrics=FailingSink())
+        await ws.start()
+        self.addAsyncCleanup(ws.close)
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(ws.__anext__(), 5)
+        self.assertIsInstance(ws.error, RuntimeError)
+        with self.assertRaises(RuntimeError):
+            await ws.recv()
+
+    async def test_connection_failure_raises(self):
+        ws = AsyncWebsocketClient('key', 'secret', url='ws://127.0.0.1:1', channel='ticker')
+        with self.assertRaises(OSError):
+            await ws.start()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,208 +1,183 @@
 import pytest
-import json
-import time
 from itertools import islice
-from advtrade.authenticated_client import AuthenticatedClient
+
+from cbadv.cbadv_client import Client
+from cbadv.mock_server import MockExchange
+from cbadv.rate_limit import RateLimiter
 
 
 @pytest.fixture(scope='module')
 def dc():
     """Dummy client for testing."""
-    return AuthenticatedClient('test', 'test', 'test')
+    return Client('test', 'test')
 
 
 @pytest.mark.usefixtures('dc')
 class TestAuthenticatedClientSyntax(object):
     def test_place_order_input_1(self, dc):
         with pytest.raises(ValueError):
-            r = dc.place_order('BTC-USD', 'buy', 'market',
-                               overdraft_enabled='true', funding_amount=10)
+            r = dc.create_order('BTC-USD', 'buy', 'market',
+                                overdraft_enabled='true', funding_amount=10)
 
     def test_place_order_input_2(self, dc):
         with pytest.raises(ValueError):
-            r = dc.place_order('BTC-USD', 'buy', 'limit',
-                               cancel_after='123', time_in_force='ABC')
+            r = dc.create_order('BTC-USD', 'buy', 'limit',
+                                cancel_after='123', time_in_force='ABC')
 
     def test_place_order_input_3(self, dc):
         with pytest.raises(ValueError):
-            r = dc.place_order('BTC-USD', 'buy', 'limit',
-                               post_only='true', time_in_force='FOK')
+            r = dc.create_order('BTC-USD', 'buy', 'limit',
+                                post_only='true', time_in_force='FOK')
 
     def test_place_order_input_4(self, dc):
         with pytest.raises(ValueError):
-            r = dc.place_order('BTC-USD', 'buy', 'market',
-                               size=None, funds=None)
+            r = dc.create_order('BTC-USD', 'buy', 'market',
+                                size=None, funds=None)
 
     def test_place_order_input_5(self, dc):
         with pytest.raises(ValueError):
-            r = dc.place_order('BTC-USD', 'buy', 'market',
-                               size=1, funds=1)
+            r = dc.create_order('BTC-USD', 'buy', 'market',
+                                size=1, funds=1)
 
 
 @pytest.fixture(scope='module')
-def client():
-    """Client that connects to sandbox API. Relies on authentication information
-    provided in api_config.json"""
-    with open('api_config.json.example') as file:
-        api_config = json.load(file)
-    c = AuthenticatedClient(
-        api_url='https://api-public.sandbox.pro.coinbase.com', **api_config)
-
-    # Set up account with deposits and orders. Do this by depositing from
-    # the Coinbase USD wallet, which has a fixed value of > $10,000.
-    #
-    # Only deposit if the balance is below some nominal amount. The
-    # exchange seems to freak out if you run up your account balance.
-    coinbase_accounts = c.get_coinbase_accounts()
-    account_info = [x for x in coinbase_accounts
-                    if x['name'] == 'USD Wallet'][0]
-    account_usd = account_info['id']
-    if float(account_info['balance']) < 70000:
-        c.coinbase_deposit(10000, 'USD', account_usd)
-    # Place some orders to generate history
+def exchange():
+    pytest.importorskip('aiohttp')
+    with MockExchange(api_secret='secret') as exchange:
+        yield exchange
+
+
+@pytest.fixture(scope='module')
+def client(exchange):
+    """Client that connects to the local mock exchange, with some orders placed
+    to generate history."""
+    c = Client('key', 'secret', api_url=exchange.rest_url,
+               rate_limiter=RateLimiter(private_rate=1000, public_rate=1000))
     c.place_limit_order('BTC-USD', 'buy', 1, 0.01)
     c.place_limit_order('BTC-USD', 'buy', 2, 0.01)
-    c.place_limit_order('BTC-USD', 'buy', 3, 0.01)
-
-    return c
+    c.place_market_order('BTC-USD', 'buy', size=0.01)
+    yield c
+    c.close()
 
 
-@pytest.mark.usefixtures('dc')
-@pytest.mark.skip(reason="these test require authentication")
+@pytest.mark.usefixtures('client')
 class TestAuthenticatedClient(object):
     """Test the authenticated client by validating basic behavior from the
-    sandbox exchange."""
+    mock exchange."""
     def test_get_accounts(self, client):
-        r = client.get_accounts()
-        assert type(r) is list
-        assert 'currency' in r[0]
+        r = client.list_accounts()
+        assert type(r['accounts']) is list
+        assert 'currency' in r['accounts'][0]
         # Now get a single account
-        r = client.get_account(account_id=r[0]['id'])
-        assert type(r) is dict
-        assert 'currency' in r
-
-    def test_account_history(self, client):
-        accounts = client.get_accounts()
-        account_usd = [x for x in accounts if x['currency'] == 'USD'][0]['id']
-        r = list(islice(client.get_account_history(account_usd), 5))
-        assert type(r) is list
-        assert 'amount' in r[0]
-        assert 'details' in r[0]
-
-        # Now exercise the pagination abstraction. Setting limit to 1 means
-        # each record comes in a separate HTTP response.
-        history_gen = client.get_account_history(account_usd, limit=1)
-        r = list(islice(history_gen, 2))
-        r2 = list(islice(history_gen, 2))
-        assert r != r2
-        # Now exercise the `before` parameter.
-        r3 = list(client.get_account_history(account_usd, before=r2[0]['id']))
-        assert r3 == r
-
-    def test_get_account_holds(self, client):
-        accounts = client.get_accounts()
-        account_usd = [x for x in accounts if x['currency'] == 'USD'][0]['id']
-        r = list(client.get_account_holds(account_usd))
-        assert type(r) is list
-        assert 'type' in r[0]
-        assert 'ref' in r[0]
-
-    def test_convert_stablecoin(self, client):
-        r = client.convert_stablecoin('10.0', 'USD', 'USDC')
+        r = client.get_account(account_id=r['accounts'][0]['uuid'])
         assert type(r) is dict
-        assert 'id' in r
-        assert r['amount'] == '10.00000000'
-        assert r['from'] == 'USD'
-        assert r['to'] == 'USDC'
+        assert 'currency' in r['account']
+
+    def test_account_pagination(self, client):
+        # Setting limit to 1 means each record comes in a separate HTTP
+        # response.
+        first = client.list_accounts(limit=1)
+        assert len(first['accounts']) == 1
+        assert first['has_next']
+        second = client.list_accounts(limit=1, cursor=first['cursor'])
+        assert second['accounts'] != first['accounts']
+        # Now exercise the iterator abstraction.
+        accounts = list(client.iter_accounts(limit=1))
+        assert accounts[:2] == first['accounts'] + second['accounts']
+        assert accounts == client.list_accounts()['accounts']
 
     def test_place_order(self, client):
-        r = client.place_order('BTC-USD', 'buy', 'limit',
-                               price=0.62, size=0.0144)
+        r = client.create_order('BTC-USD', 'buy', 'limit',
+                                price=0.62, size=0.0144)
         assert type(r) is dict
-        assert r['stp'] == 'dc'
+        assert r['success']
+        assert r['success_response']['side'] == 'BUY'
 
     def test_place_limit_order(self, client):
         r = client.place_limit_order('BTC-USD', 'buy', 4.43, 0.01232)
         assert type(r) is dict
-        assert 'executed_value' in r
-        assert not r['post_only']
-        client.cancel_order(r['id'])
+        order = client.get_order(r['order_id'])['order']
+        assert order['status'] == 'OPEN'
+        assert order['order_type'] == 'LIMIT'
+        client.cancel_orders([r['order_id']])
 
     def test_place_market_order(self, client):
         r = client.place_market_order('BTC-USD', 'buy', size=0.01)
-        assert 'status' in r
-        assert r['type'] == 'market'
-        client.cancel_order(r['id'])
+        assert r['success']
+        assert client.get_order(r['order_id'])['order']['order_type'] == 'MARKET'
 
-        # This one probably won't go through
         r = client.place_market_order('BTC-USD', 'buy', funds=100000)
         assert type(r) is dict
+        assert r['success']
 
-    @pytest.mark.parametrize('stop_type', ['entry', 'loss'])
-    def test_place_stop_order(self, client, stop_type):
-        client.cancel_all()
+    @pytest.mark.parametrize('stop_type,side', [('entry', 'BUY'), ('loss', 'SELL')])
+    def test_place_stop_order(self, client, stop_type, side):
         r = client.place_stop_order('BTC-USD', stop_type, 100, 0.01)
         assert type(r) is dict
-        assert r['stop'] == stop_type
-        assert r['stop_price'] == '100'
-        assert r['type'] == 'limit'
-        client.cancel_order(r['id'])
+        assert r['success_response']['side'] == side
+        assert client.get_order(r['order_id'])['order']['limit_price'] == '100'
+        client.cancel_orders([r['order_id']])
 
     def test_place_invalid_stop_order(self, client):
-        client.cancel_all()
         with pytest.raises(ValueError):
             client.place_stop_order('BTC-USD', 'fake_stop_type', 5.65, 0.01)
 
+    def test_place_order_unknown_product(self, client):
+        r = client.place_limit_order('NOPE-USD', 'buy', 4.43, 0.01232)
+        assert not r['success']
+        assert r['error_response']['error'] == 'INVALID_PRODUCT_ID'
+
     def test_cancel_order(self, client):
         r = client.place_limit_order('BTC-USD', 'buy', 4.43, 0.01232)
-        time.sleep(0.2)
-        r2 = client.cancel_order(r['id'])
-        assert r2[0] == r['id']
-
-    def test_cancel_all(self, client):
-        r = client.cancel_all()
-        assert type(r) is list
+        r2 = client.cancel_orders([r['order_id']])
+        assert r2['results'][0]['order_id'] == r['order_id']
+        assert r2['results'][0]['success']
+        # A cancelled order can't be cancelled again.
+        r3 = client.cancel_orders([r['order_id']])
+        assert not r3['results'][0]['success']
 
     def test_get_order(self, client):
         r = client.place_limit_order('BTC-USD', 'buy', 4.43, 0.01232)
-        time.sleep(0.2)
-        r2 = client.get_order(r['id'])
-        assert r2['id'] == r['id']
+        r2 = client.get_order(r['order_id'])
+        assert r2['order']['order_id'] == r['order_id']
+        client.cancel_orders([r['order_id']])
+
+    def test_get_unknown_order(self, client):
+        assert client.get_order('nope') == {'error': 'NOT_FOUND'}
 
     def test_get_orders(self, client):
-        r = list(islice(client.get_orders(), 10))
-        assert type(r) is list
-        assert 'created_at' in r[0]
+        r = client.list_orders(product_id='BTC-USD')
+        assert type(r['orders']) is list
+        assert 'created_time' in r['orders'][0]
+        r = list(islice(client.iter_orders(order_status='OPEN', limit=1), 10))
+        assert r
+        assert all(order['status'] == 'OPEN' for order in r)
 
     def test_get_fills(self, client):
-        r = list(islice(client.get_orders(), 10))
-        assert type(r) is list
-        assert 'fill_fees' in r[0]
-
-    def test_get_fundings(self, client):
-        r = list(islice(client.get_fundings(), 10))
-        assert type(r) is list
-
-    def test_repay_funding(self, client):
-        # This request gets denied
-        r = client.repay_funding(2.1, 'USD')
-
-    def test_get_position(self, client):
-        r = client.get_position()
-        assert 'accounts' in r
-
-    def test_get_payment_methods(self, client):
-        r = client.get_payment_methods()
-        assert type(r) is list
-
-    def test_get_coinbase_accounts(self, client):
-        r = client.get_coinbase_accounts()
-        assert type(r) is list
-
-    def test_get_trailing_volume(self, client):
-        r = client.get_trailing_volume()
-        assert type(r) is list
+        r = client.list_fills(product_id='BTC-USD')
+        assert type(r['fills']) is list
+        assert 'commission' in r['fills'][0]
+        fills = list(client.iter_fills(product_id='BTC-USD', limit=1))
+        assert fills == r['fills']
+
+    def test_get_fills_of_order(self, client):
+        r = client.place_market_order('ETH-USD', 'sell', size=0.5)
+        fills = client.list_fills(order_id=r['order_id'])['fills']
+        assert [fill['order_id'] for fill in fills] == [r['order_id']]
+        assert fills[0]['side'] == 'SELL'
+
+    def test_place_orders(self, client):
+        results = client.place_orders([
+            {'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+             'price': price, 'size': '0.01'} for price in ('1.00', '2.00', '3.00')])
+        assert all(result.ok for result in results)
+        client.cancel_orders([result.response['order_id'] for result in results])
 
     def test_get_fees(self, client):
-        r = client.get_fees()
+        r = client.get_transactions_summary()
         assert type(r) is dict
+        assert 'fee_tier' in r
+
+    def test_bad_signature(self, exchange):
+        client = Client('key', 'wrong', api_url=exchange.rest_url)
+        assert client.list_accounts() == {'error': 'unauthorized'}
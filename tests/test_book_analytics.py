@@ -0,0 +1,83 @@
+import unittest
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from cbadv import book_analytics as ba
+from cbadv.order_book import OrderBook
+from cbadv.tick_order_book import TickOrderBook
+
+SNAPSHOT = [
+    {'side': 'bid', 'price_level': '99.00', 'new_quantity': '1'},
+    {'side': 'bid', 'price_level': '98.00', 'new_quantity': '2'},
+    {'side': 'bid', 'price_level': '97.00', 'new_quantity': '3'},
+    {'side': 'offer', 'price_level': '101.00', 'new_quantity': '1.5'},
+    {'side': 'offer', 'price_level': '102.00', 'new_quantity': '0.5'},
+]
+
+
+class TestGetDepth(unittest.TestCase):
+
+    def check_snapshot(self, book):
+        book._message([dict(level) for level in SNAPSHOT])
+        depth = book.get_depth()
+        np.testing.assert_allclose(depth.bids.price, [99, 98, 97])
+        np.testing.assert_allclose(depth.bids.size, [1, 2, 3])
+        np.testing.assert_allclose(depth.bids.cum_size, [1, 3, 6])
+        np.testing.assert_allclose(depth.asks.price, [101, 102])
+        np.testing.assert_allclose(depth.asks.cum_size, [1.5, 2])
+        self.assertTrue(depth.bids.price.flags['C_CONTIGUOUS'])
+        top = book.get_depth(1)
+        self.assertEqual(len(top.bids.price), 1)
+        self.assertEqual(len(top.asks.price), 1)
+
+    def test_sorted_dict_book(self):
+        self.check_snapshot(OrderBook('BTC-USD'))
+
+    def test_tick_book(self):
+        book = TickOrderBook('BTC-USD', quote_increment='0.01', base_increment='0.00000001')
+        self.check_snapshot(book)
+        # Exported arrays must not pin the book's buffers.
+        book._message([{'side': 'bid', 'price_level': '99.50', 'new_quantity': '1'}])
+        self.assertEqual(book.get_depth(1).bids.price[0], 99.5)
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = ba.DepthSnapshot(ba.make_depth([99, 98, 97], [1, 2, 3]),
+                                         ba.make_depth([101, 102], [1.5, 0.5]))
+
+    def test_vwap_to_size(self):
+        vwap = ba.vwap_to_size(self.snapshot.bids, [0.5, 1, 2, 6, 7])
+        np.testing.assert_allclose(vwap, [99, 99, 98.5, 97 + 2 / 3., np.nan])
+
+    def test_slippage_bps(self):
+        slippage = ba.slippage_bps(self.snapshot.asks, [1, 2])
+        np.testing.assert_allclose(slippage, [0, (101.25 - 101) / 101 * 1e4])
+
+    def test_depth_within_bps(self):
+        mid = ba.mid_price(self.snapshot)
+        self.assertEqual(mid, 100)
+        np.testing.assert_allclose(ba.depth_within_bps(self.snapshot.bids, mid, [50, 100, 250]),
+                                   [0, 1, 3])
+
+    def test_imbalance_and_microprice(self):
+        self.assertAlmostEqual(ba.imbalance(self.snapshot), (6 - 2) / 8.)
+        self.assertAlmostEqual(ba.imbalance(self.snapshot, levels=1), (1 - 1.5) / 2.5)
+        self.assertAlmostEqual(ba.microprice(self.snapshot), (99 * 1.5 + 101 * 1) / 2.5)
+
+    def test_stacked_books(self):
+        other = ba.DepthSnapshot(ba.make_depth([10], [4]), ba.make_depth([11, 12], [1, 1]))
+        stacked = ba.stack_snapshots([self.snapshot, other])
+        self.assertEqual(stacked.bids.price.shape, (2, 3))
+        np.testing.assert_allclose(ba.imbalance(stacked), [0.5, (4 - 2) / 6.])
+        vwap = ba.vwap_to_size(stacked.bids, [1, 5])
+        np.testing.assert_allclose(vwap, [[99, (99 + 196 + 2 * 97) / 5.], [10, np.nan]])
+        np.testing.assert_allclose(ba.depth_within_bps(stacked.asks, ba.mid_price(stacked), [1000]),
+                                   [[2], [1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import functools
+import json
+import random
+import unittest
+from unittest.mock import patch
+
+from cbadv.book_features import BookFeatures
+from cbadv.order_book import OrderBook
+from cbadv.order_books import OrderBooks
+from cbadv.tick_order_book import TickOrderBook
+from tests.test_order_books import FakeFeed
+
+TickBook = functools.partial(TickOrderBook, quote_increment='0.01', base_increment='0.001')
+
+
+def expected(levels, k, bps):
+    """ Aggregates recomputed from scratch from {(side, price): size}. """
+    bids = sorted(((price, size) for (side, price), size in levels.items() if side == 'bid'),
+                  reverse=True)
+    asks = sorted((price, size) for (side, price), size in levels.items() if side == 'offer')
+    result = {'total': (sum(size for _, size in bids), sum(size for _, size in asks)),
+              'levels': (len(bids), len(asks)),
+              'top': (sum(size for _, size in bids[:k]), sum(size for _, size in asks[:k]))}
+    if bids and asks:
+        mid = (bids[0][0] + asks[0][0]) / 2
+        result['within'] = (sum(size for price, size in bids if price >= mid * (1 - bps / 1e4)),
+                            sum(size for price, size in asks if price <= mid * (1 + bps / 1e4)))
+    else:
+        result['within'] = (0, 0)
+    return result
+
+
+class TestBookFeatures(unittest.TestCase):
+
+    def check(self, book, levels):
+        features = book.features
+        for k in features.top_k:
+            for bps in features.bands:
+                want = expected(levels, k, bps)
+                self.assertEqual(features.levels(), want['levels'])
+                for got, value in zip(features.total(), want['total']):
+                    self.assertAlmostEqual(got, value / 1000, places=9)
+                for got, value in zip(features.top(k), want['top']):
+                    self.assertAlmostEqual(got, value / 1000, places=9)
+                for got, value in zip(features.within(bps), want['within']):
+                    self.assertAlmostEqual(got, value / 1000, places=9)
+
+    def random_stream(self, book_class):
+        # Prices in cents and sizes in thousandths, to compare exactly.
+        rand = random.Random(7)
+        book = book_class(product_id='BTC-USD',
+                          features=BookFeatures(top_k=[1, 3, 10], bands=[5, 20, 100]))
+        levels = {}
+        for cents in range(9900, 10000, 3):
+            levels[('bid', cents)] = rand.randint(1, 5000)
+            levels[('offer', cents + 110)] = rand.randint(1, 5000)
+        book.create_book([{'side': side, 'price_level': '{:.2f}'.format(cents / 100),
+                           'new_quantity': '{:.3f}'.format(size / 1000)}
+                          for (side, cents), size in levels.items()])
+        self.check(book, levels)
+        for _ in range(2000):
+            # Drift the mid so the bands keep moving.
+            center = 10050 + rand.randint(-60, 60)
+            side = rand.choice(['bid', 'offer'])
+            cents = center - rand.randint(1, 80) if side == 'bid' else center + rand.randint(1, 80)
+            size = 0 if rand.random() < 0.4 else rand.randint(1, 5000)
+            if ('offer' if side == 'bid' else 'bid', cents) in levels:
+                continue
+            crossed = [key for key in levels if key[0] == 'offer' and key[1] <= cents] \
+                if side == 'bid' else [key for key in levels if key[0] == 'bid' and key[1] >= cents]
+            if size and crossed:
+                continue
+            if size:
+                levels[(side, cents)] = size
+            else:
+                levels.pop((side, cents), None)
+            book.update([{'side': side, 'price_level': '{:.2f}'.format(cents / 100),
+                          'new_quantity': '{:.3f}'.format(size / 1000)}])
+            self.check(book, levels)
+        return book
+
+    def test_order_book(self):
+        self.random_stream(OrderBook)
+
+    def test_tick_order_book(self):
+        self.random_stream(TickBook)
+
+    def test_reset_and_imbalance(self):
+        book = TickBook('BTC-USD', features=BookFeatures(top_k=[2], bands=[10]))
+        self.assertIsNone(book.features.imbalance())
+        book.create_book([{'side': 'bid', 'price_level': '100.00', 'new_quantity': '3'},
+                          {'side': 'bid', 'price_level': '99.00', 'new_quantity': '1'},
+                          {'side': 'offer', 'price_level': '100.10', 'new_quantity': '1'}])
+        self.assertEqual(book.features.imbalance(), 0.6)
+        self.assertEqual(book.features.imbalance(bps=10), 0.5)
+        self.assertEqual(book.features.within(10), (3., 1.))
+        book.remove({'side': 'offer', 'price_level': '100.10'})
+        self.assertEqual(book.features.within(10), (0., 0.))
+        book.reset()
+        self.assertEqual((book.features.total(), book.features.levels()), ((0., 0.), (0, 0)))
+
+    def test_order_books(self):
+        feed = FakeFeed(['BTC-USD', 'ETH-USD'])
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD'],
+                           features={'top_k': [1], 'bands': [100]})
+        with patch('cbadv.websocket_client.create_connection', return_value=feed):
+            books._connect()
+        feed.update('BTC-USD', 'bid', '99.80', '2')
+        while feed.frames:
+            books.on_message(json.loads(feed.recv()))
+        features = books.order_books['BTC-USD'].features
+        self.assertEqual(features.top(1), (2., 1.))
+        self.assertEqual(features.within(100), (2., 1.))
+        self.assertEqual(features.total(), (3., 1.))
+        books.add_products(['ETH-USD'])
+        self.assertIsNot(books.order_books['ETH-USD'].features, features)
+
+
+if __name__ == '__main__':
+    unittest.main()
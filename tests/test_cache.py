@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cbadv.cache import ResponseCache
+from cbadv.cbadv_client import Client
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponses(object):
+    """ Stands for `Client._request`, numbering the responses it sends. """
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.calls = []
+        self.done = threading.Event()
+
+    def __call__(self, method, endpoint, params=None, data=None):
+        self.calls.append((method, endpoint, params))
+        response = MagicMock(status_code=self.status_code, ok=self.status_code < 400)
+        response.json.return_value = {'endpoint': endpoint, 'n': len(self.calls)}
+        self.done.set()
+        return response
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(maxsize=2, stale=5, clock=self.clock)
+        self.client = Client('key', 'secret', cache=self.cache)
+        self.responses = FakeResponses()
+        patcher = patch.object(self.client, '_request', self.responses)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_until_expired(self):
+        self.assertEqual(self.client.list_products()['n'], 1)
+        self.clock.now = 59
+        self.assertEqual(self.client.list_products()['n'], 1)
+        self.clock.now = 70
+        self.cache.stale = 0
+        self.assertEqual(self.client.list_products()['n'], 2)
+        stats = self.cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 2))
+        self.assertAlmostEqual(stats.hit_rate, 1 / 3)
+
+    def test_keyed_on_params(self):
+        self.client.get_transactions_summary(start_date='a')
+        self.client.get_transactions_summary(start_date='b')
+        self.client.get_transactions_summary(start_date='a')
+        self.assertEqual(len(self.responses.calls), 2)
+
+    def test_orders_and_accounts_never_cached(self):
+        cache = ResponseCache(ttls={r'.*': 60}, clock=self.clock)
+        self.assertIsNone(cache.ttl('GET', '/accounts'))
+        self.assertIsNone(cache.ttl('GET', '/orders/historical/batch'))
+        self.assertIsNone(cache.ttl('POST', '/products'))
+        self.assertEqual(cache.ttl('GET', '/time'), 60)
+        self.assertIsNone(self.cache.ttl('GET', '/products/BTC-USD/candles'))
+        self.client.list_accounts()
+        self.client.list_accounts()
+        self.assertEqual(len(self.responses.calls), 2)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_errors_not_stored(self):
+        self.responses.status_code = 500
+        self.client.get_product('BTC-USD')
+        self.client.get_product('BTC-USD')
+        self.assertEqual(len(self.responses.calls), 2)
+
+    def test_lru_bound(self):
+        for product_id in ('A', 'B', 'A', 'C'):
+            self.client.get_product(product_id)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats().evictions, 1)
+        self.client.get_product('A')
+        self.client.get_product('B')
+        self.assertEqual([call[1] for call in self.responses.calls],
+                         ['/products/A', '/products/B', '/products/C', '/products/B'])
+
+    def test_invalidate(self):
+        self.client.list_products()
+        self.client.get_product('BTC-USD')
+        self.assertEqual(self.cache.invalidate('/products/BTC-USD'), 1)
+        self.client.get_product('BTC-USD')
+        self.assertEqual(self.cache.invalidate('/products'), 2)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(len(self.responses.calls), 3)
+
+    def test_stale_while_revalidate(self):
+        self.assertEqual(self.client.get_product('BTC-USD')['n'], 1)
+        self.responses.done.clear()
+        self.clock.now = 12
+        self.assertEqual(self.client.get_product('BTC-USD')['n'], 1)
+        self.assertTrue(self.responses.done.wait(5))
+        for _ in range(100):
+            if self.cache.stats().refreshes:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(self.client.get_product('BTC-USD')['n'], 2)
+        stats = self.cache.stats()
+        self.assertEqual((stats.hits, stats.stale, stats.misses, stats.refreshes), (1, 1, 1, 1))
+
+
+class TestAsyncFetch(unittest.IsolatedAsyncioTestCase):
+
+    async def test_stale_while_revalidate(self):
+        clock = FakeClock()
+        cache = ResponseCache(stale=5, clock=clock)
+        calls = []
+
+        async def load():
+            calls.append(None)
+            return {'n': len(calls)}, True
+
+        self.assertEqual((await cache.fetch_async('GET', '/products/BTC-USD', None, load))['n'], 1)
+        clock.now = 12
+        self.assertEqual((await cache.fetch_async('GET', '/products/BTC-USD', None, load))['n'], 1)
+        for _ in range(100):
+            if cache.stats().refreshes:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual((await cache.fetch_async('GET', '/products/BTC-USD', None, load))['n'], 2)
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.stale, stats.misses, stats.refreshes), (1, 1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
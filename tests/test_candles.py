@@ -0,0 +1,113 @@
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from cbadv.candles import CandleDownloader, CandleError, windows
+from cbadv.rate_limit import TokenBucket
+
+
+class FakeCandleClient(object):
+    """ `get_product_candles` over a synthetic history, newest first like the API. """
+    def __init__(self, fail=(), max_candles=300):
+        self.fail = dict.fromkeys(fail, 1)
+        self.max_candles = max_candles
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_product_candles(self, product_id, start, end, granularity):
+        start, end = int(start), int(end)
+        with self.lock:
+            self.calls.append((product_id, start, end))
+            if self.fail.get((product_id, start), 0) > 0:
+                self.fail[(product_id, start)] -= 1
+                return {'error': 'INTERNAL', 'message': 'try again'}
+        # The API also returns the candle right before `start`.
+        timestamps = range(end - end % 60, start - 61, -60)
+        candles = [{'start': str(t), 'low': str(t % 97), 'high': str(t % 97 + 2),
+                    'open': '1', 'close': str(t / 60.), 'volume': '0.5'}
+                   for t in timestamps]
+        assert len(candles) <= self.max_candles + 1
+        return {'candles': candles}
+
+
+class TestWindows(unittest.TestCase):
+
+    def test_windows(self):
+        self.assertEqual(windows(0, 60 * 599, 'ONE_MINUTE'),
+                         [(0, 60 * 299), (60 * 300, 60 * 599)])
+        self.assertEqual(windows(30, 200, 'ONE_MINUTE', max_candles=2),
+                         [(0, 60), (120, 180)])
+        self.assertEqual(windows(7200, 100, 'ONE_HOUR'), [])
+        with self.assertRaises(ValueError):
+            windows(0, 1, 'ONE_WEEK')
+
+
+class TestCandleDownloader(unittest.TestCase):
+
+    def test_fetch_merges_and_dedupes(self):
+        client = FakeCandleClient()
+        downloader = CandleDownloader(client, rate=1000, workers=4)
+        candles = downloader.fetch('BTC-USD', 0, 60 * 1000, 'ONE_MINUTE')
+        self.assertEqual(len(client.calls), 4)
+        self.assertEqual(len(candles), 1001)
+        self.assertEqual(list(candles.start), list(range(0, 60 * 1001, 60)))
+        self.assertEqual(candles.close[10], 10.)
+        self.assertEqual(candles.start.typecode, 'q')
+
+    def test_retries_failed_windows(self):
+        client = FakeCandleClient(fail=[('ETH-USD', 60 * 300)])
+        downloader = CandleDownloader(client, rate=1000, backoff=0.001)
+        result = downloader.fetch_many(['BTC-USD', 'ETH-USD'], 0, 60 * 599)
+        self.assertEqual({p: len(c) for p, c in result.items()}, {'BTC-USD': 600, 'ETH-USD': 600})
+        self.assertEqual(downloader.retried, 1)
+        self.assertEqual(downloader.requests, 5)
+
+    def test_counts_requests_of_every_worker(self):
+        client = FakeCandleClient(max_candles=2)
+        downloader = CandleDownloader(client, workers=16, max_candles=2)
+        # Frequent thread switches, to interleave the workers' updates.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            downloader.fetch_many(['BTC-USD', 'ETH-USD'], 0, 60 * 999)
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(downloader.requests, len(client.calls))
+        self.assertEqual(downloader.requests, 1000)
+
+    def test_gives_up(self):
+        client = FakeCandleClient()
+        client.fail[('ETH-USD', 0)] = 10
+        downloader = CandleDownloader(client, rate=1000, retries=2, backoff=0.001)
+        with self.assertRaises(CandleError) as cm:
+            downloader.fetch_many(['ETH-USD', 'BTC-USD'], 0, 60 * 10)
+        self.assertEqual([failure[:3] for failure in cm.exception.failures],
+                         [('ETH-USD', 0, 600)])
+
+    def test_download_writes_csv(self):
+        directory = tempfile.mkdtemp()
+        try:
+            downloader = CandleDownloader(FakeCandleClient(), rate=1000)
+            paths = downloader.download(['BTC-USD', 'SOL-USD'], 0, 60 * 5, directory)
+            self.assertEqual(sorted(paths), ['BTC-USD', 'SOL-USD'])
+            with open(paths['SOL-USD']) as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ['start', 'low', 'high', 'open', 'close', 'volume'])
+            self.assertEqual(len(rows), 7)
+            self.assertEqual(os.path.basename(paths['BTC-USD']), 'BTC-USD_ONE_MINUTE.csv')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_rate_budget(self):
+        now = [0.]
+        limiter = TokenBucket(5, capacity=1, clock=lambda: now[0],
+                              sleep=lambda seconds: now.__setitem__(0, now[0] + seconds))
+        downloader = CandleDownloader(FakeCandleClient(), limiter=limiter, workers=1)
+        downloader.fetch('BTC-USD', 0, 60 * 300 * 10 - 1)
+        # 10 requests at 5 per second after the first.
+        self.assertAlmostEqual(now[0], 9 / 5.)
+
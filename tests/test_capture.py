@@ -0,0 +1,223 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+from cbadv.capture import CaptureError, CaptureReader, CaptureWriter, replay
+from cbadv.decoder import JsonDecoder
+from cbadv.order_books import OrderBooks
+from tests.test_order_books import FakeFeed
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'feed.cap')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        frames = ['{"n": %d}' % i for i in range(2500)]
+        for compress in (True, False):
+            path = self.path + str(compress)
+            with CaptureWriter(path, compress=compress, batch_size=1000) as writer:
+                for i, frame in enumerate(frames):
+                    writer.write(frame, timestamp=1000. + i)
+            self.assertEqual(writer.frames, 2500)
+            self.assertGreaterEqual(writer.blocks, 3)
+            records = list(CaptureReader(path))
+            self.assertEqual([frame.decode() for _, frame in records], frames)
+            self.assertEqual(records[-1][0], 3499.)
+
+    def test_append_and_truncated_block(self):
+        with CaptureWriter(self.path) as writer:
+            writer.write('first', 1.)
+        with CaptureWriter(self.path) as writer:
+            writer.write(b'second', 2.)
+        with open(self.path, 'ab') as f:
+            f.write(b'\x01\x01\x00')
+        self.assertEqual(list(CaptureReader(self.path)), [(1., b'first'), (2., b'second')])
+
+    def test_file_object(self):
+        f = io.BytesIO()
+        writer = CaptureWriter(f)
+        writer.write('frame', 5.)
+        writer.close()
+        with open(self.path, 'wb') as out:
+            out.write(f.getvalue())
+        self.assertEqual(list(CaptureReader(self.path)), [(5., b'frame')])
+
+    def test_not_a_capture(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\x80\x04pickle data')
+        with self.assertRaises(CaptureError):
+            CaptureReader(self.path)
+
+    def test_record_and_replay_order_books(self):
+        products = ['BTC-USD', 'ETH-USD']
+        feed = FakeFeed(products)
+        books = OrderBooks('key', 'secret', product_id=products, log_to=self.path)
+        with patch('cbadv.websocket_client.create_connection', return_value=feed):
+            books._connect()
+        feed.update('BTC-USD', 'bid', '99.50', '2')
+        feed.update('ETH-USD', 'offer', '100.50', '3')
+        # What `_listen` does for every frame.
+        while feed.frames:
+            data = feed.recv()
+            books.recorder.write(data)
+            books.on_message(books.decoder.decode(data))
+        books.recorder.close()
+
+        replayed = OrderBooks('key', 'secret', product_id=products)
+        self.assertEqual(replay(self.path, replayed), len(feed.history))
+        for product_id in products:
+            self.assertEqual(replayed.order_books[product_id].get_bid(),
+                             books.order_books[product_id].get_bid())
+            self.assertEqual(replayed.order_books[product_id].get_ask(),
+                             books.order_books[product_id].get_ask())
+
+    def test_replay_speed(self):
+        with CaptureWriter(self.path) as writer:
+            for i in range(3):
+                writer.write(json.dumps({'i': i}), timestamp=100. + i)
+        client = type('Client', (), {})()
+        client.received = []
+        client.on_message = client.received.append
+        client.decoder = JsonDecoder()
+        sleeps = []
+        with patch('time.monotonic', return_value=0.):
+            replay(self.path, client, speed=2, sleep=sleeps.append)
+        self.assertEqual(sleeps, [0.5, 1.])
+        self.assertEqual(client.received, [{'i': 0}, {'i': 1}, {'i': 2}])
+        sleeps = []
+        replay(self.path, client, sleep=sleeps.append)
+        self.assertEqual(sleeps, [])
+        del client.received[:]
+        self.assertEqual(replay(self.path, client, start=100.5, end=101.), 1)
+        self.assertEqual(client.received, [{'i': 1}])
+
+
+class TestCaptureIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'feed.cap')
+        self.products = ['BTC-USD', 'ETH-USD']
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, checkpoint_every=None, updates=60):
+        """ Record a feed one frame per second; returns the book states per time. """
+        feed = FakeFeed(self.products)
+        feed.send(json.dumps({'type': 'subscribe', 'product_ids': self.products}))
+        for i in range(updates):
+            product_id = self.products[i % 2]
+            side = 'bid' if i % 3 else 'offer'
+            price = '{:.2f}'.format(99 - i * 0.01 if side == 'bid' else 101 + i * 0.01)
+            feed.update(product_id, side, price, '0' if i % 7 == 0 else str(i))
+        books = OrderBooks('key', 'secret', product_id=self.products)
+        states = {}
+        with CaptureWriter(self.path, batch_size=8) as writer:
+            for i, frame in enumerate(feed.history):
+                timestamp = 1000. + i
+                writer.write(frame, timestamp)
+                books.on_message(json.loads(frame))
+                states[timestamp] = {product_id: sorted(map(str, book.snapshot()))
+                                     for product_id, book in books.order_books.items()}
+                if checkpoint_every and i % checkpoint_every == checkpoint_every - 1:
+                    writer.checkpoint(books.order_books, timestamp)
+        return states
+
+    def test_index(self):
+        self.record(updates=40)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(reader.frame_count, 43)
+            self.assertEqual(len(reader.blocks), 6)
+            self.assertEqual((reader.start_time, reader.end_time), (1000., 1042.))
+            self.assertEqual([t for t, _ in reader.frames(1010.5, 1013.)], [1011., 1012., 1013.])
+            self.assertEqual(reader.frame(17)[0], 1017.)
+            self.assertEqual(reader.frame(42)[0], 1042.)
+            with self.assertRaises(IndexError):
+                reader.frame(43)
+
+    def test_refresh_indexes_appended_blocks(self):
+        with CaptureWriter(self.path) as writer:
+            writer.write('a', 1.)
+        reader = CaptureReader(self.path)
+        with CaptureWriter(self.path) as writer:
+            writer.write('b', 2.)
+        self.assertEqual(reader.frame_count, 1)
+        reader.refresh()
+        self.assertEqual([frame for _, frame in reader], [b'a', b'b'])
+        reader.close()
+
+    def test_book_at(self):
+        for checkpoint_every in (None, 10):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            states = self.record(checkpoint_every)
+            with CaptureReader(self.path) as reader:
+                self.assertEqual(len(reader.checkpoints), 6 if checkpoint_every else 0)
+                for timestamp in (1003., 1020., 1021.5, 1039., 1062.):
+                    books = reader.books_at(self.products, timestamp)
+                    for product_id in self.products:
+                        self.assertEqual(sorted(map(str, books[product_id].snapshot())),
+                                         states[timestamp // 1][product_id])
+
+    def test_book_at_reads_from_checkpoint(self):
+        states = self.record(checkpoint_every=10)
+        with CaptureReader(self.path) as reader:
+            with patch.object(reader, '_payload', wraps=reader._payload) as payload:
+                book = reader.book_at('ETH-USD', 1052.)
+            # The last checkpoint (1049) and the blocks after it only.
+            self.assertLessEqual(payload.call_count, 3)
+            self.assertEqual(sorted(map(str, book.snapshot())), states[1052.]['ETH-USD'])
+
+    def test_order_books_checkpoints(self):
+        feed = FakeFeed(self.products)
+        books = OrderBooks('key', 'secret', product_id=self.products, log_to=self.path,
+                           checkpoint_interval=1e-9)
+        with patch('cbadv.websocket_client.create_connection', return_value=feed):
+            books._connect()
+        feed.update('BTC-USD', 'bid', '99.50', '2')
+        while feed.frames:
+            data = feed.recv()
+            books.recorder.write(data)
+            books.on_message(books.decoder.decode(data))
+        books.recorder.close()
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader.checkpoints), len(feed.history))
+            last = reader.checkpoint(reader.checkpoints[-1])
+            self.assertEqual(sorted(last['books']), self.products)
+            book = reader.book_at('BTC-USD', reader.end_time + 1)
+            self.assertEqual(book.get_bid()['price_level'], Decimal('99.50'))
+
+    def test_order_books_checkpoints_are_opt_in(self):
+        feed = FakeFeed(self.products)
+        books = OrderBooks('key', 'secret', product_id=self.products, log_to=self.path)
+        with patch('cbadv.websocket_client.create_connection', return_value=feed):
+            books._connect()
+        with patch.object(books.recorder, 'checkpoint') as checkpoint:
+            while feed.frames:
+                books.on_message(books.decoder.decode(feed.recv()))
+        checkpoint.assert_not_called()
+        books.recorder.close()
+
+    def test_checkpoint_copies_books_at_call_time(self):
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD'])
+        book = books.order_books['BTC-USD']
+        book.create_book([{'side': 'bid', 'price_level': '99.00', 'new_quantity': '1'}])
+        with CaptureWriter(self.path) as writer:
+            writer.checkpoint(books.order_books, 1000.)
+            book.update([{'side': 'bid', 'price_level': '98.00', 'new_quantity': '1'}])
+        with CaptureReader(self.path) as reader:
+            state = reader.checkpoint(reader.checkpoints[0])
+        self.assertEqual([level['price_level'] for level in state['books']['BTC-USD']],
+                         ['99.00'])
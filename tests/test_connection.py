@@ -0,0 +1,147 @@
+import json
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from cbadv.cbadv_client import Client
+from cbadv.connection import POOL_MAXSIZE, TIMEOUTS, PooledAdapter, endpoint_class
+from cbadv.rate_limit import RateLimiter
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def setup(self):
+        super(Handler, self).setup()
+        self.connections.add(self.client_address)
+
+    def do_GET(self):
+        body = json.dumps({'path': self.path}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def wait_for_connections(count):
+    # The server registers a connection in its handler thread.
+    for _ in range(200):
+        if len(Handler.connections) >= count:
+            break
+        threading.Event().wait(0.01)
+    return len(Handler.connections)
+
+
+class TestConnection(unittest.TestCase):
+
+    def setUp(self):
+        Handler.connections = set()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.timings = []
+        self.client = Client('key', 'secret',
+                             'http://127.0.0.1:{}/api/v3/brokerage'.format(self.server.server_port),
+                             rate_limiter=RateLimiter(private_rate=1000, public_rate=1000),
+                             on_timing=self.timings.append)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_endpoint_class(self):
+        self.assertEqual(endpoint_class('post', '/orders'), 'order')
+        self.assertEqual(endpoint_class('POST', '/orders/batch_cancel'), 'order')
+        self.assertEqual(endpoint_class('GET', '/market/products'), 'public')
+        self.assertEqual(endpoint_class('GET', '/orders/historical/batch'), 'private')
+
+    def test_timeouts_by_endpoint_class(self):
+        client = Client('key', 'secret', timeouts={'order': 1.5})
+        self.assertEqual(client.timeouts['order'], 1.5)
+        self.assertEqual(client.timeouts['private'], TIMEOUTS['private'])
+        client.close()
+
+    def test_timing_and_reuse(self):
+        self.client.get_product('BTC-USD')
+        self.client.get_product('ETH-USD')
+        first, second = self.timings
+        self.assertEqual((first.method, first.endpoint, first.status),
+                         ('GET', '/products/BTC-USD', 200))
+        self.assertFalse(first.reused)
+        self.assertGreater(first.connect, 0)
+        self.assertTrue(second.reused)
+        self.assertEqual(second.connect, 0)
+        self.assertGreater(second.ttfb, 0)
+        self.assertGreaterEqual(second.total, second.ttfb)
+        self.assertIs(self.client.last_timing, second)
+        self.assertEqual(len(Handler.connections), 1)
+
+    def test_falls_back_to_other_addresses(self):
+        port = self.server.server_port
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, *args, **kwargs):
+            if host != 'books.test':
+                return getaddrinfo(host, *args, **kwargs)
+            # Nothing listens on the first address.
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.2', port)),
+                    (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+
+        client = Client('key', 'secret', 'http://books.test:{}/api/v3/brokerage'.format(port),
+                        rate_limiter=RateLimiter(private_rate=1000, public_rate=1000),
+                        on_timing=self.timings.append)
+        self.addCleanup(client.close)
+        with patch('socket.getaddrinfo', resolve):
+            self.assertEqual(client.get_product('BTC-USD'),
+                             {'path': '/api/v3/brokerage/products/BTC-USD'})
+        self.assertFalse(self.timings[0].reused)
+        self.assertGreater(self.timings[0].dns, 0)
+
+    def test_prewarm(self):
+        self.assertEqual(self.client.prewarm(3), 3)
+        self.assertEqual(self.client.prewarm(3), 0)
+        self.client.get_product('BTC-USD')
+        self.assertTrue(self.timings[0].reused)
+        self.assertEqual(wait_for_connections(3), 3)
+
+    def test_prewarm_capped_by_pool_size(self):
+        client = Client('key', 'secret', self.client.url, pool_maxsize=2, prewarm=5)
+        self.assertEqual(wait_for_connections(2), 2)
+        client.close()
+
+    def test_pool_size_by_host(self):
+        client = Client('key', 'secret', self.client.url,
+                        pool_maxsize={'127.0.0.1': 2, '*': 8}, prewarm=5)
+        self.assertEqual(client.pool_maxsize, 2)
+        self.assertEqual(wait_for_connections(2), 2)
+        pool = client.adapter.poolmanager.connection_from_url(self.client.url)
+        self.assertEqual(pool.pool.maxsize, 2)
+        self.assertEqual(client.adapter.maxsize('https://api.coinbase.com/api/v3'), 8)
+        other = client.adapter.poolmanager.connection_from_url('http://localhost:1/')
+        self.assertEqual(other.pool.maxsize, 8)
+        client.close()
+        adapter = PooledAdapter(pool_maxsize={'API.Coinbase.com': 4})
+        self.assertEqual(adapter.maxsize('https://api.coinbase.com/'), 4)
+        self.assertEqual(adapter.maxsize('https://example.com/'), POOL_MAXSIZE)
+
+    def test_keepalive_reopens_closed_connections(self):
+        client = Client('key', 'secret', self.client.url, prewarm=1, keepalive=0.05)
+        self.assertEqual(wait_for_connections(1), 1)
+        # What the server closing idle connections amounts to.
+        client.adapter.poolmanager.clear()
+        self.assertEqual(wait_for_connections(2), 2)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
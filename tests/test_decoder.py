@@ -0,0 +1,87 @@
+import json
+import unittest
+from decimal import Decimal
+
+import pytest
+
+from cbadv.decoder import JsonDecoder, get_decoder
+from cbadv.order_books import OrderBooks
+
+LEVEL2 = json.dumps({
+    'channel': 'l2_data', 'client_id': '', 'timestamp': '2023-01-01T00:00:00Z', 'sequence_num': 7,
+    'events': [{'type': 'snapshot', 'product_id': 'BTC-USD', 'updates': [
+        {'side': 'bid', 'event_time': '2023-01-01T00:00:00Z', 'price_level': '99.99', 'new_quantity': '1.5'},
+        {'side': 'offer', 'event_time': '2023-01-01T00:00:00Z', 'price_level': '100.01', 'new_quantity': '2'},
+    ]}]}, separators=(',', ':'))
+
+TICKER = json.dumps({
+    'channel': 'ticker', 'timestamp': '2023-01-01T00:00:00Z', 'sequence_num': 0,
+    'events': [{'type': 'snapshot', 'tickers': [
+        {'type': 'ticker', 'product_id': 'BTC-USD', 'price': '100.00', 'best_bid': '99.99'}]}]},
+    separators=(',', ':'))
+
+
+class TestDecoders(unittest.TestCase):
+
+    def backends(self):
+        for backend in ('json', 'orjson', 'msgspec'):
+            try:
+                yield get_decoder(backend)
+            except ImportError:
+                pass
+
+    def test_backends_agree(self):
+        for decoder in self.backends():
+            self.assertEqual(decoder.decode(LEVEL2), json.loads(LEVEL2), decoder.name)
+            self.assertEqual(decoder.decode(LEVEL2.encode()), json.loads(LEVEL2), decoder.name)
+
+    def test_invalid_frame_raises_value_error(self):
+        for decoder in self.backends():
+            with self.assertRaises(ValueError):
+                decoder.decode('{"channel":"l2_data",')
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_decoder('yaml')
+
+    def test_stdlib_fallback(self):
+        self.assertIsInstance(get_decoder('json'), JsonDecoder)
+
+
+class TestTypedDecoder(unittest.TestCase):
+
+    def setUp(self):
+        pytest.importorskip('msgspec')
+
+    def test_level2_numbers_are_parsed(self):
+        msg = get_decoder(typed=True).decode(LEVEL2)
+        update = msg['events'][0]['updates'][0]
+        self.assertEqual(update['price_level'], Decimal('99.99'))
+        self.assertIsInstance(update['new_quantity'], Decimal)
+        self.assertEqual(msg.get('sequence_num'), 7)
+        self.assertNotIn('subscriptions', msg['events'][0])
+        with self.assertRaises(KeyError):
+            msg['missing']
+
+    def test_float_numbers(self):
+        msg = get_decoder(typed=True, number=float).decode(TICKER)
+        ticker = msg['events'][0]['tickers'][0]
+        self.assertEqual(ticker['price'], 100.0)
+        self.assertEqual(ticker['best_bid'], 99.99)
+        self.assertIsNone(ticker['best_ask'])
+
+    def test_other_channels_stay_dicts(self):
+        frame = json.dumps({'channel': 'subscriptions', 'events': [{'subscriptions': {}}]})
+        self.assertIsInstance(get_decoder(typed=True).decode(frame), dict)
+
+    def test_order_books_accept_typed_messages(self):
+        decoder = get_decoder(typed=True)
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD'], decoder=decoder)
+        books.on_message(decoder.decode(LEVEL2))
+        book = books.order_books['BTC-USD']
+        self.assertEqual(book.get_bid()['price_level'], Decimal('99.99'))
+        self.assertEqual(book.get_ask()['new_quantity'], Decimal('2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import socket
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cbadv.cbadv_client import Client
+from cbadv.metrics import (Histogram, HistogramSink, PrometheusSink, StatsdSink,
+                           endpoint_template)
+from cbadv.order_books import OrderBooks
+from tests.test_order_books import FakeFeed
+
+
+class LastFrameFeed(FakeFeed):
+    """ Stops the reading loop of `client` with its last frame. """
+    client = None
+
+    def recv(self):
+        frame = super(LastFrameFeed, self).recv()
+        if not self.frames:
+            self.client.stop = True
+        return frame
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles_within_precision(self):
+        histogram = Histogram(precision=0.01)
+        for i in range(1, 10001):
+            histogram.record(i / 1e6)
+        self.assertEqual(histogram.count, 10000)
+        for p, expected in ((50, 5e-3), (99, 9.9e-3), (100, 1e-2)):
+            self.assertAlmostEqual(histogram.percentile(p), expected, delta=expected * 0.01)
+        self.assertAlmostEqual(histogram.mean, 5.0005e-3)
+        self.assertEqual((histogram.min, histogram.max), (1e-6, 1e-2))
+
+    def test_out_of_range_values(self):
+        histogram = Histogram(lowest=1e-3, highest=1.)
+        histogram.record(-0.5)
+        histogram.record(50.)
+        # Values under `lowest` share the first bucket.
+        self.assertEqual(histogram.percentile(1), 1e-3)
+        self.assertEqual(histogram.min, -0.5)
+        self.assertEqual(histogram.percentile(100), 50.)
+
+    def test_merge_and_reset(self):
+        first, second = Histogram(), Histogram()
+        first.record(0.001)
+        second.record(0.1)
+        first.merge(second)
+        self.assertEqual(first.count, 2)
+        self.assertAlmostEqual(first.percentile(100), 0.1, delta=0.001)
+        first.reset()
+        self.assertEqual((first.count, first.percentile(50)), (0, 0.))
+
+
+class TestSinks(unittest.TestCase):
+
+    def test_histogram_sink(self):
+        sink = HistogramSink()
+        sink.observe('book.apply', 0.002, {'product_id': 'BTC-USD'})
+        sink.observe('book.apply', 0.004, {'product_id': 'BTC-USD'})
+        sink.observe('book.apply', 0.001, {'product_id': 'ETH-USD'})
+        sink.gauge('ws.queue_depth', 3)
+        self.assertEqual(sink.histogram('book.apply', product_id='BTC-USD').count, 2)
+        summary = sink.summary()[('book.apply', (('product_id', 'ETH-USD'),))]
+        self.assertEqual(summary['count'], 1)
+        self.assertAlmostEqual(summary['p99.9'], 0.001)
+        self.assertEqual(sink.gauges[('ws.queue_depth', ())], 3)
+
+    def test_prometheus_render(self):
+        sink = PrometheusSink()
+        sink.observe('rest.latency', 0.25, {'endpoint': '/products/{id}', 'method': 'GET'})
+        sink.gauge('ws.queue_depth', 7)
+        lines = sink.render().splitlines()
+        self.assertIn('# TYPE cbadv_rest_latency_seconds summary', lines)
+        self.assertIn('cbadv_rest_latency_seconds{endpoint="/products/{id}",method="GET",'
+                      'quantile="0.5"} 0.25', lines)
+        self.assertIn('cbadv_rest_latency_seconds_count{endpoint="/products/{id}",'
+                      'method="GET"} 1', lines)
+        self.assertIn('cbadv_ws_queue_depth 7', lines)
+
+    def test_statsd(self):
+        agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        agent.bind(('127.0.0.1', 0))
+        agent.settimeout(2)
+        sink = StatsdSink(port=agent.getsockname()[1])
+        try:
+            sink.observe('ws.latency', 0.0125, {'channel': 'l2_data'})
+            sink.gauge('ws.queue_depth', 4)
+            self.assertEqual(agent.recv(512), b'cbadv.ws.latency:12.500|ms|#channel:l2_data')
+            self.assertEqual(agent.recv(512), b'cbadv.ws.queue_depth:4|g')
+        finally:
+            sink.close()
+            agent.close()
+
+    def test_endpoint_template(self):
+        self.assertEqual(endpoint_template('/products/BTC-USD/candles'), '/products/{id}/candles')
+        self.assertEqual(endpoint_template('/accounts/abc'), '/accounts/{id}')
+        self.assertEqual(endpoint_template('/orders/historical/123'), '/orders/historical/{id}')
+        self.assertEqual(endpoint_template('/orders/historical/batch'), '/orders/historical/batch')
+        self.assertEqual(endpoint_template('/products'), '/products')
+
+
+class TestHooks(unittest.TestCase):
+
+    def listen(self, books, feed):
+        feed.client = books
+        with patch('cbadv.websocket_client.create_connection', return_value=feed):
+            books._connect()
+        books.stop = False
+        books._listen()
+
+    def test_order_books(self):
+        products = ['BTC-USD', 'ETH-USD']
+        sink = HistogramSink()
+        books = OrderBooks('key', 'secret', product_id=products, metrics=sink)
+        feed = LastFrameFeed(products)
+        feed.update('BTC-USD', 'bid', '99.50', '2')
+        self.listen(books, feed)
+        self.assertEqual(sink.histogram('book.apply', product_id='BTC-USD').count, 2)
+        self.assertEqual(sink.histogram('book.apply', product_id='ETH-USD').count, 1)
+        for name in ('ws.decode', 'ws.handler', 'ws.latency'):
+            self.assertEqual(sink.histogram(name, channel='l2_data').count, 3)
+        self.assertEqual(sink.histogram('ws.handler', channel='subscriptions').count, 1)
+        # The feed's timestamps are from 2023.
+        self.assertGreater(sink.histogram('ws.latency', channel='l2_data').min, 1e7)
+
+    def test_disabled(self):
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD'])
+        feed = LastFrameFeed(['BTC-USD'])
+        with patch('cbadv.websocket_client.record_message_metrics') as record:
+            self.listen(books, feed)
+        record.assert_not_called()
+        self.assertIsNotNone(books.order_books['BTC-USD'].get_bid())
+
+    def test_client(self):
+        sink = HistogramSink()
+        client = Client('key', 'secret', metrics=sink)
+        response = MagicMock(status_code=404)
+        client._record_timing('get', '/products/XYZ-USD', response, time.perf_counter())
+        histogram = sink.histogram('rest.latency', method='GET', endpoint='/products/{id}',
+                                   status=404)
+        self.assertEqual(histogram.count, 1)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import json
+import time
+import unittest
+
+import pytest
+
+pytest.importorskip('aiohttp')
+from websocket import create_connection
+
+from cbadv.candles import CandleDownloader
+from cbadv.cbadv_client import Client
+from cbadv.mock_server import MockExchange
+from cbadv.order_books import OrderBooks
+from cbadv.rate_limit import RateLimiter
+from cbadv.websocket_client import WebsocketClient
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestMockRest(unittest.TestCase):
+
+    def setUp(self):
+        self.exchange = MockExchange().start()
+        self.addCleanup(self.exchange.stop)
+        self.client = Client('key', 'secret', api_url=self.exchange.rest_url,
+                             rate_limiter=RateLimiter(private_rate=1000, public_rate=1000))
+        self.addCleanup(self.client.close)
+
+    def test_orders_round_trip(self):
+        results = self.client.place_orders([
+            {'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+             'price': '{}.00'.format(25000 - i), 'size': '0.01'} for i in range(5)])
+        self.assertTrue(all(result.ok for result in results))
+        market = self.client.place_market_order('ETH-USD', 'sell', size='0.5')
+        self.assertTrue(market['success'])
+
+        orders = list(self.client.iter_orders(limit=2))
+        self.assertEqual(len(orders), 6)
+        open_orders = list(self.client.iter_orders(order_status=['OPEN']))
+        self.assertEqual(len(open_orders), 5)
+        fills = list(self.client.iter_fills(product_id='ETH-USD'))
+        self.assertEqual([fill['order_id'] for fill in fills], [market['order_id']])
+
+        order_id = results[0].response['order_id']
+        cancelled = self.client.cancel_orders([order_id, 'unknown'])['results']
+        self.assertEqual([result['success'] for result in cancelled], [True, False])
+        self.assertEqual(self.client.get_order(order_id)['order']['status'], 'CANCELLED')
+
+    def test_orders_with_rounded_catalog_values(self):
+        catalog = self.client.load_catalog()
+        price = catalog.round_price('BTC-USD', 26001.237, side='buy')
+        size = catalog.round_size('BTC-USD', '0.123456789')
+        order_id = self.client.place_limit_order('BTC-USD', 'buy', price, size)['order_id']
+        order = self.client.get_order(order_id)['order']
+        self.assertEqual((order['limit_price'], order['size']), ('26001.23', '0.12345678'))
+        results = self.client.place_orders([{'product_id': 'BTC-USD', 'side': 'buy',
+                                             'order_type': 'limit', 'price': price, 'size': size}])
+        self.assertTrue(results[0].ok)
+
+    def test_accounts(self):
+        accounts = list(self.client.iter_accounts())
+        self.assertEqual(sorted(a['currency'] for a in accounts),
+                         ['BTC', 'ETH', 'LTC', 'SOL', 'USD'])
+        account = self.client.get_account(accounts[0]['uuid'])['account']
+        self.assertEqual(account, accounts[0])
+
+    def test_candle_downloader(self):
+        candles = CandleDownloader(self.client, workers=4).fetch('BTC-USD', 0, 60 * 999)
+        self.assertEqual(list(candles.start), list(range(0, 60 * 1000, 60)))
+
+    def test_rate_limit_and_retry(self):
+        exchange = MockExchange(rate_limit=20).start()
+        self.addCleanup(exchange.stop)
+        client = Client('key', 'secret', api_url=exchange.rest_url, max_retries=10,
+                        rate_limiter=RateLimiter(private_rate=1000, public_rate=1000))
+        for _ in range(40):
+            self.assertEqual(client.get_product('BTC-USD')['product_id'], 'BTC-USD')
+        self.assertGreater(exchange.throttled, 0)
+        self.assertEqual(client.rate_limiter.throttled, exchange.throttled)
+
+    def test_faults(self):
+        self.exchange.faults.error_rate = 1.
+        self.assertEqual(self.client.get_product('BTC-USD')['error'], 'INTERNAL')
+        self.exchange.faults.error_rate = 0.
+        self.exchange.faults.latency = 0.05
+        start = time.perf_counter()
+        self.client.get_product('BTC-USD')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+
+class TestMockFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.exchange = MockExchange(rate=500, depth=20).start()
+        self.addCleanup(self.exchange.stop)
+
+    def subscribe(self, channel, products):
+        ws = create_connection(self.exchange.ws_url)
+        self.addCleanup(ws.close)
+        ws.send(json.dumps({'type': 'subscribe', 'channel': channel, 'product_ids': products}))
+        return ws
+
+    def test_level2_stream(self):
+        ws = self.subscribe('level2', ['BTC-USD', 'ETH-USD'])
+        messages = [json.loads(ws.recv()) for _ in range(20)]
+        self.assertEqual([msg['sequence_num'] for msg in messages], list(range(20)))
+        self.assertEqual(messages[0]['channel'], 'subscriptions')
+        snapshots = [msg['events'][0] for msg in messages[1:3]]
+        self.assertEqual([event['type'] for event in snapshots], ['snapshot', 'snapshot'])
+        self.assertEqual(len(snapshots[0]['updates']), 40)
+        updates = [msg['events'][0] for msg in messages[3:]]
+        self.assertTrue(all(event['type'] == 'update' for event in updates))
+        self.assertEqual({event['product_id'] for event in updates}, {'BTC-USD', 'ETH-USD'})
+
+    def test_ticker_and_unsubscribe(self):
+        ws = self.subscribe('ticker', ['SOL-USD'])
+        self.assertEqual(json.loads(ws.recv())['channel'], 'subscriptions')
+        ticker = json.loads(ws.recv())
+        self.assertEqual(ticker['events'][0]['tickers'][0]['product_id'], 'SOL-USD')
+        ws.send(json.dumps({'type': 'unsubscribe', 'channel': 'ticker',
+                            'product_ids': ['SOL-USD']}))
+        while json.loads(ws.recv())['channel'] != 'subscriptions':
+            pass
+
+    def test_rate(self):
+        self.exchange.rate = 200
+        ws = self.subscribe('level2', ['BTC-USD'])
+        ws.recv()
+        ws.recv()
+        start = time.perf_counter()
+        for _ in range(100):
+            ws.recv()
+        self.assertGreater(time.perf_counter() - start, 0.3)
+
+    def test_multiplexed_client(self):
+        client = WebsocketClient('key', 'secret', url=self.exchange.ws_url, products=['BTC-USD'],
+                                 should_print=False, channel=['level2', 'ticker'])
+        l2, eth = [], []
+        client.on('level2', l2.append)
+        client.on('ticker', lambda msg, ticker: eth.append(ticker), product_id='ETH-USD')
+        client.start()
+        self.addCleanup(client.close)
+        self.assertTrue(wait_for(lambda: len(l2) > 10))
+        self.assertEqual(eth, [])
+        client.subscribe('ticker', ['ETH-USD'])
+        self.assertTrue(wait_for(lambda: len(eth) > 2))
+        self.assertEqual({ticker['product_id'] for ticker in eth}, {'ETH-USD'})
+        self.assertEqual(self.exchange.connections, 1)
+
+    def test_disconnect_after(self):
+        self.exchange.faults.disconnect_after = 5
+        ws = self.subscribe('level2', ['BTC-USD'])
+        for _ in range(5):
+            ws.recv()
+        self.assertTrue(wait_for(lambda: not ws.recv()))
+
+    def test_order_books_resync_on_dropped_messages(self):
+        self.exchange.faults.drop_rate = 0.05
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD'])
+        books.url = self.exchange.ws_url
+        books.start()
+        self.addCleanup(books.close)
+        self.assertTrue(wait_for(lambda: books.resync_count > 0))
+        self.assertGreater(books.gap_count, 0)
+        self.exchange.faults.drop_rate = 0.
+        self.assertTrue(wait_for(lambda: books.order_books['BTC-USD']._sequence != 0))
+        self.assertIsNone(books.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import math
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from cbadv.cache import ResponseCache
+from cbadv.cbadv_client import Client
+from cbadv.models import Account, Candle, Fill, Order, Product, columns, decode_response
+from cbadv.products import ProductCatalog
+
+
+def fill(i):
+    return {'entry_id': str(i), 'trade_id': 't{}'.format(i), 'order_id': 'o1',
+            'trade_time': '2023-05-31T09:59:59Z', 'trade_type': 'FILL',
+            'price': '{}.5'.format(100 + i), 'size': '0.001', 'commission': '',
+            'product_id': 'BTC-USD', 'side': 'BUY', 'unknown_field': 'dropped'}
+
+
+class TestModels(unittest.TestCase):
+
+    def test_lazy_parsing(self):
+        model = Fill.from_json(fill(1))
+        # Stored as received until read.
+        self.assertEqual(Fill.price.slot.__get__(model), '101.5')
+        self.assertEqual(model.price, Decimal('101.5'))
+        self.assertEqual(Fill.price.slot.__get__(model), Decimal('101.5'))
+        self.assertIsNone(model.commission)
+        self.assertIsNone(model.sequence_timestamp)
+        self.assertEqual(model.trade_id, 't1')
+        self.assertFalse(hasattr(model, '__dict__'))
+        self.assertNotIn('unknown_field', model)
+
+    def test_dict_access(self):
+        model = Fill.from_json(fill(2))
+        self.assertEqual(model['size'], Decimal('0.001'))
+        self.assertEqual(model.get('product_id'), 'BTC-USD')
+        self.assertIsNone(model.get('unknown_field'))
+        with self.assertRaises(KeyError):
+            model['unknown_field']
+        self.assertEqual(model.to_dict()['price'], Decimal('102.5'))
+        self.assertEqual(model, Fill.from_json(fill(2)))
+
+    def test_nested_and_numeric_json(self):
+        account = Account.from_json({'uuid': 'a', 'currency': 'BTC',
+                                     'available_balance': {'value': '1.23', 'currency': 'BTC'}})
+        self.assertEqual(account.available_balance, Decimal('1.23'))
+        self.assertIsNone(account.hold)
+        order = Order.from_json({'order_id': 'o', 'number_of_fills': 2, 'filled_size': 0.5})
+        self.assertEqual(order.number_of_fills, 2)
+        self.assertEqual(order.filled_size, Decimal('0.5'))
+
+    def test_decode_response(self):
+        page = {'fills': [fill(i) for i in range(3)], 'cursor': '3'}
+        decoded = decode_response('GET', '/orders/historical/fills', page)
+        self.assertEqual(decoded['cursor'], '3')
+        self.assertTrue(all(isinstance(f, Fill) for f in decoded['fills']))
+        self.assertIsInstance(page['fills'][0], dict)
+        self.assertIsInstance(decode_response('GET', '/products/BTC-USD',
+                                              {'product_id': 'BTC-USD'}), Product)
+        candles = decode_response('GET', '/products/BTC-USD/candles',
+                                  {'candles': [{'start': '60', 'close': '1.5'}]})['candles']
+        self.assertEqual((candles[0].start, candles[0].close), (60, 1.5))
+        order = decode_response('GET', '/orders/historical/abc', {'order': {'order_id': 'abc'}})
+        self.assertIsInstance(order['order'], Order)
+        error = {'error': 'NOT_FOUND'}
+        self.assertIs(decode_response('GET', '/products/BTC-USD', error), error)
+        self.assertIs(decode_response('POST', '/orders', error), error)
+
+    def test_columns(self):
+        fills = [Fill.from_json(fill(i)) for i in range(4)]
+        fills[0].price
+        result = columns(fills, ['price', 'commission'])
+        self.assertEqual(list(result['price']), [100.5, 101.5, 102.5, 103.5])
+        self.assertTrue(all(math.isnan(value) for value in result['commission']))
+        candles = columns([Candle.from_json({'start': '60', 'low': '1'})])
+        self.assertEqual(result['price'].typecode, 'd')
+        self.assertEqual(candles['start'].typecode, 'q')
+        self.assertEqual(columns([]), {})
+
+    def test_catalog_accepts_models(self):
+        product = Product.from_json({'product_id': 'BTC-USD', 'quote_increment': '0.01',
+                                     'base_increment': '0.001', 'limit_only': True})
+        catalog = ProductCatalog([product])
+        self.assertEqual(catalog.round_price('BTC-USD', '1.234'), Decimal('1.23'))
+        self.assertTrue(catalog['BTC-USD'].limit_only)
+
+
+class TestTypedClient(unittest.TestCase):
+
+    def test_typed_client_keeps_cache_raw(self):
+        client = Client('key', 'secret', typed=True, cache=ResponseCache())
+        page = {'products': [{'product_id': 'BTC-USD', 'price': '1.00'}], 'num_products': 1}
+        response = MagicMock(ok=True)
+        response.json.return_value = page
+        with patch.object(client, '_request', return_value=response) as request:
+            first = client.list_products()
+            second = client.list_products()
+        self.assertEqual(request.call_count, 1)
+        self.assertIsInstance(first['products'][0], Product)
+        self.assertEqual(second['products'][0].price, Decimal('1.00'))
+        self.assertIsInstance(page['products'][0], dict)
+
+    def test_iter_fills(self):
+        client = Client('key', 'secret', typed=True)
+        response = MagicMock(ok=True)
+        response.json.return_value = {'fills': [fill(0), fill(1)], 'cursor': ''}
+        with patch.object(client, '_request', return_value=response):
+            fills = list(client.iter_fills())
+        self.assertEqual([f.price for f in fills], [Decimal('100.5'), Decimal('101.5')])
+
+
+if __name__ == '__main__':
+    unittest.main()
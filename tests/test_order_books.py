@@ -0,0 +1,375 @@
+import json
+import threading
+import unittest
+from collections import deque
+from decimal import Decimal
+from unittest.mock import Mock, patch
+
+from cbadv.order_books import OrderBooks, SequenceTracker
+
+
+class FakeFeed(object):
+    """ Stands in for the level2 websocket of one connection.
+
+    Answers subscriptions with a snapshot and numbers every frame like the
+    Advanced Trade feed does. Frames can be dropped or replayed to simulate a
+    lossy network.
+    """
+    def __init__(self, products):
+        self.levels = {product_id: {('bid', '99.00'): '1', ('offer', '101.00'): '1'}
+                       for product_id in products}
+        self.sent = []
+        self.history = []
+        self.frames = deque()
+        self.sequence = 0
+        self.connected = True
+
+    def send(self, data):
+        msg = json.loads(data)
+        self.sent.append(msg)
+        if msg['type'] == 'subscribe':
+            self._emit('subscriptions', [{'subscriptions': {'level2': msg['product_ids']}}])
+            for product_id in msg['product_ids']:
+                self._emit('l2_data', [{'type': 'snapshot', 'product_id': product_id,
+                                        'updates': self._updates(self.levels[product_id].items())}])
+
+    def update(self, product_id, side, price, size, drop=False):
+        if size == '0':
+            self.levels[product_id].pop((side, price), None)
+        else:
+            self.levels[product_id][(side, price)] = size
+        self._emit('l2_data', [{'type': 'update', 'product_id': product_id,
+                                'updates': self._updates([((side, price), size)])}], drop=drop)
+
+    def replay(self, index):
+        self.frames.append(self.history[index])
+
+    def recv(self):
+        return self.frames.popleft()
+
+    def close(self):
+        self.connected = False
+
+    def best(self, product_id, side):
+        prices = [Decimal(price) for s, price in self.levels[product_id] if s == side]
+        return max(prices) if side == 'bid' else min(prices)
+
+    @staticmethod
+    def _updates(levels):
+        return [{'side': side, 'event_time': '2023-01-01T00:00:00Z',
+                 'price_level': price, 'new_quantity': size}
+                for (side, price), size in levels]
+
+    def _emit(self, channel, events, drop=False):
+        frame = json.dumps({'channel': channel, 'client_id': '', 'timestamp': '2023-01-01T00:00:00Z',
+                            'sequence_num': self.sequence, 'events': events})
+        self.sequence += 1
+        self.history.append(frame)
+        if not drop:
+            self.frames.append(frame)
+
+
+class TestSequenceTracker(unittest.TestCase):
+
+    def test_check(self):
+        tracker = SequenceTracker()
+        self.assertEqual(tracker.check(5), SequenceTracker.IN_ORDER)
+        self.assertEqual(tracker.check(6), SequenceTracker.IN_ORDER)
+        self.assertEqual(tracker.check(9), SequenceTracker.GAP)
+        self.assertEqual(tracker.check(7), SequenceTracker.OUT_OF_ORDER)
+        self.assertEqual(tracker.check(None), SequenceTracker.IN_ORDER)
+        self.assertEqual((tracker.gaps, tracker.missed, tracker.out_of_order), (1, 2, 1))
+        tracker.reset()
+        self.assertEqual(tracker.check(0), SequenceTracker.IN_ORDER)
+
+
+class TestOrderBooksSequence(unittest.TestCase):
+
+    def setUp(self):
+        self.products = ['BTC-USD', 'ETH-USD']
+        self.feed = FakeFeed(self.products)
+        self.books = OrderBooks('key', 'secret', product_id=self.products)
+        self.connect()
+
+    def connect(self):
+        with patch('cbadv.websocket_client.create_connection', return_value=self.feed):
+            self.books._connect()
+
+    def pump(self):
+        while self.feed.frames:
+            self.books.on_message(json.loads(self.feed.recv()))
+
+    def assert_books_match_feed(self):
+        for product_id in self.products:
+            book = self.books.order_books[product_id]
+            self.assertEqual(book.get_bid()['price_level'], self.feed.best(product_id, 'bid'))
+            self.assertEqual(book.get_ask()['price_level'], self.feed.best(product_id, 'offer'))
+
+    def test_in_order_stream(self):
+        self.pump()
+        self.feed.update('BTC-USD', 'bid', '99.50', '2')
+        self.feed.update('ETH-USD', 'offer', '100.50', '3')
+        self.pump()
+        self.assert_books_match_feed()
+        self.assertEqual(self.books.gap_count, 0)
+        self.assertEqual(self.books.resync_count, 0)
+
+    def test_gap_triggers_resnapshot_on_live_socket(self):
+        self.pump()
+        self.feed.update('BTC-USD', 'bid', '99.50', '2', drop=True)
+        self.feed.update('ETH-USD', 'offer', '100.50', '3')
+        self.pump()
+        self.assertEqual(self.books.gap_count, 1)
+        self.assertEqual(self.books.resync_count, 1)
+        self.assertEqual([msg['type'] for msg in self.feed.sent],
+                         ['subscribe', 'unsubscribe', 'subscribe'])
+        # The socket was not reopened and the lost update is in the new snapshot.
+        self.assertTrue(self.feed.connected)
+        self.assert_books_match_feed()
+        self.assertEqual(self.books.order_books['BTC-USD'].get_bid()['price_level'],
+                         Decimal('99.50'))
+
+    def test_failed_resync_send_aborts_the_connection(self):
+        self.pump()
+        self.feed.update('BTC-USD', 'bid', '99.50', '2', drop=True)
+        self.feed.update('ETH-USD', 'offer', '100.50', '3')
+        self.feed.abort = Mock()
+        with patch.object(self.feed, 'send', side_effect=BrokenPipeError('broken')):
+            self.pump()
+        self.assertEqual(self.books.resync_count, 1)
+        # The supervisor reconnects, which rebuilds every book.
+        self.feed.abort.assert_called()
+
+    def test_out_of_order_message_is_ignored(self):
+        self.pump()
+        self.feed.update('BTC-USD', 'bid', '99.50', '2')
+        self.feed.update('BTC-USD', 'bid', '99.50', '0')
+        self.pump()
+        self.feed.replay(-2)
+        self.pump()
+        self.assertEqual(self.books.out_of_order_count, 1)
+        self.assertEqual(self.books.gap_count, 0)
+        self.assert_books_match_feed()
+
+    def test_updates_before_snapshot_are_ignored(self):
+        self.books.on_message({'channel': 'l2_data', 'events': [
+            {'type': 'update', 'product_id': 'BTC-USD',
+             'updates': FakeFeed._updates([(('bid', '99.90'), '1')])}]})
+        self.assertEqual(len(self.books.order_books['BTC-USD']._bids), 0)
+
+    def test_resync_only_rebuilds_requested_books(self):
+        self.pump()
+        eth = self.books.order_books['ETH-USD']
+        eth_bids = eth._bids
+        self.books.resync(['BTC-USD'])
+        self.assertEqual(self.feed.sent[-1]['product_ids'], ['BTC-USD'])
+        self.assertEqual(len(self.books.order_books['BTC-USD']._bids), 0)
+        self.pump()
+        self.assertIs(eth._bids, eth_bids)
+        self.assert_books_match_feed()
+
+    def test_failover_resyncs_only_after_a_gap(self):
+        self.pump()
+        self.books._last_frame = self.feed.history[-1]
+        update = json.loads(self.feed.history[-1])
+        update['sequence_num'] = 0
+        update['events'] = [{'type': 'update', 'product_id': 'BTC-USD', 'updates': []}]
+        covered = json.dumps(dict(update, timestamp='2022-12-31T23:59:59Z'))
+        self.books._failover(deque([(0., covered)]))
+        self.assertEqual((self.books.resync_count, self.books.gap_count), (0, 0))
+        self.books._failover(deque([(0., json.dumps(dict(update, timestamp='2023-01-01T00:00:05Z')))]))
+        self.assertEqual((self.books.resync_count, self.books.gap_count), (1, 1))
+        self.assertEqual([msg['type'] for msg in self.feed.sent[-2:]], ['unsubscribe', 'subscribe'])
+        self.pump()
+        self.assert_books_match_feed()
+
+    def test_reconnect_restarts_sequence(self):
+        self.pump()
+        self.feed.sequence = 0
+        self.connect()
+        self.pump()
+        self.assertEqual(self.books.out_of_order_count, 0)
+        self.assertEqual(self.books.gap_count, 0)
+        self.assert_books_match_feed()
+
+
+class TestDynamicProducts(unittest.TestCase):
+
+    def setUp(self):
+        self.feed = FakeFeed(['BTC-USD', 'ETH-USD', 'SOL-USD'])
+        self.books = OrderBooks('key', 'secret', product_id=['BTC-USD', 'ETH-USD'])
+        with patch('cbadv.websocket_client.create_connection', return_value=self.feed):
+            self.books._connect()
+        self.pump()
+
+    def pump(self):
+        while self.feed.frames:
+            self.books.on_message(json.loads(self.feed.recv()))
+
+    def test_add_products_on_live_socket(self):
+        btc = self.books.order_books['BTC-USD']
+        self.assertEqual(self.books.add_products(['SOL-USD', 'BTC-USD']), ['SOL-USD'])
+        self.assertEqual((self.feed.sent[-1]['type'], self.feed.sent[-1]['product_ids']),
+                         ('subscribe', ['SOL-USD']))
+        self.assertEqual(len(self.books.order_books['SOL-USD']._bids), 0)
+        self.pump()
+        self.feed.update('SOL-USD', 'bid', '99.50', '2')
+        self.pump()
+        self.assertEqual(self.books.order_books['SOL-USD'].get_bid()['price_level'],
+                         Decimal('99.50'))
+        self.assertIs(self.books.order_books['BTC-USD'], btc)
+        self.assertEqual((self.books.gap_count, self.books.resync_count), (0, 0))
+        self.assertEqual(self.books.products, ['BTC-USD', 'ETH-USD', 'SOL-USD'])
+
+    def test_remove_products_on_live_socket(self):
+        self.assertEqual(self.books.remove_products(['ETH-USD', 'XRP-USD']), ['ETH-USD'])
+        self.assertEqual((self.feed.sent[-1]['type'], self.feed.sent[-1]['product_ids']),
+                         ('unsubscribe', ['ETH-USD']))
+        self.assertNotIn('ETH-USD', self.books.order_books)
+        # An update already in flight is ignored.
+        self.feed.update('ETH-USD', 'bid', '99.50', '2')
+        self.feed.update('BTC-USD', 'bid', '99.50', '2')
+        self.pump()
+        self.assertNotIn('ETH-USD', self.books.order_books)
+        self.assertEqual(self.books.order_books['BTC-USD'].get_bid()['price_level'],
+                         Decimal('99.50'))
+        self.assertEqual(self.books.product_rates(), {'BTC-USD': 2})
+
+    def test_default_products_are_not_shared(self):
+        books = OrderBooks('key', 'secret')
+        books.add_products(['SOL-USD'])
+        self.assertEqual(OrderBooks('key', 'secret').product_id, ['BTC-USD', 'ETH-USD'])
+
+    def test_sharded(self):
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD', 'ETH-USD', 'SOL-USD'],
+                           shards=2)
+        books.add_products(['LTC-USD'])
+        self.assertEqual([shard.products for shard in books.shards],
+                         [['BTC-USD', 'SOL-USD'], ['ETH-USD', 'LTC-USD']])
+        books.remove_products(['SOL-USD'])
+        self.assertEqual(books.shards[0].products, ['BTC-USD'])
+        self.assertEqual(books.product_id, ['BTC-USD', 'ETH-USD', 'LTC-USD'])
+
+
+class TestShardedOrderBooks(unittest.TestCase):
+
+    def setUp(self):
+        self.products = ['BTC-USD', 'ETH-USD', 'SOL-USD', 'LTC-USD']
+        self.books = OrderBooks('key', 'secret', product_id=self.products, shards=2)
+        self.feeds = []
+        for shard in self.books.shards:
+            feed = FakeFeed(self.products)
+            self.feeds.append(feed)
+            with patch('cbadv.websocket_client.create_connection', return_value=feed):
+                shard._connect()
+        self.pump()
+
+    def pump(self):
+        for shard, feed in zip(self.books.shards, self.feeds):
+            while feed.frames:
+                shard.on_message(json.loads(feed.recv()))
+
+    def test_products_are_spread_over_connections(self):
+        self.assertEqual([shard.products for shard in self.books.shards],
+                         [['BTC-USD', 'SOL-USD'], ['ETH-USD', 'LTC-USD']])
+        self.assertEqual(self.feeds[1].sent[0]['product_ids'], ['ETH-USD', 'LTC-USD'])
+        self.feeds[1].update('ETH-USD', 'bid', '99.50', '2')
+        self.pump()
+        for product_id in self.products:
+            self.assertIn(product_id, self.books.order_books)
+        self.assertEqual(self.books.order_books['ETH-USD'].get_bid()['price_level'],
+                         Decimal('99.50'))
+
+    def test_gap_only_resyncs_its_connection(self):
+        self.feeds[0].update('BTC-USD', 'bid', '99.50', '2', drop=True)
+        self.feeds[0].update('SOL-USD', 'bid', '99.50', '2')
+        self.pump()
+        self.assertEqual(self.feeds[0].sent[-1]['product_ids'], ['BTC-USD', 'SOL-USD'])
+        self.assertEqual(len(self.feeds[1].sent), 1)
+
+    def test_rebalance_moves_busy_products(self):
+        rates = {'BTC-USD': 100, 'SOL-USD': 90, 'ETH-USD': 5, 'LTC-USD': 5}
+        self.assertEqual(self.books.rebalance(rates), {'SOL-USD': 1})
+        loads = [sum(rates[p] for p in shard.products) for shard in self.books.shards]
+        self.assertEqual(loads, [100, 100])
+        self.assertEqual((self.feeds[0].sent[-1]['type'], self.feeds[0].sent[-1]['product_ids']),
+                         ('unsubscribe', ['SOL-USD']))
+        self.assertEqual((self.feeds[1].sent[-1]['type'], self.feeds[1].sent[-1]['product_ids']),
+                         ('subscribe', ['SOL-USD']))
+        # Late updates from the old connection are ignored.
+        self.feeds[0].update('SOL-USD', 'bid', '99.80', '1')
+        self.pump()
+        book = self.books.order_books['SOL-USD']
+        self.assertEqual(book.get_bid()['price_level'], Decimal('99.00'))
+        self.assertEqual(self.books.rebalance(rates), {})
+
+    def test_rebalance_uses_observed_rates(self):
+        for _ in range(10):
+            self.feeds[0].update('BTC-USD', 'bid', '99.50', '2')
+            self.feeds[0].update('SOL-USD', 'bid', '99.50', '2')
+        self.pump()
+        self.books.product_rates()
+        for _ in range(10):
+            self.feeds[0].update('BTC-USD', 'bid', '99.50', '2')
+            self.feeds[0].update('SOL-USD', 'bid', '99.50', '2')
+        self.pump()
+        self.assertEqual(self.books.rebalance(), {'SOL-USD': 1})
+        self.assertEqual(self.books.rebalance_count, 1)
+
+    def test_move_waits_for_the_shard_reading(self):
+        rates = {'BTC-USD': 100, 'SOL-USD': 90, 'ETH-USD': 5, 'LTC-USD': 5}
+        moves = {}
+        shard = self.books.shards[1]
+        with shard.lock:
+            # As while its thread applies a message.
+            mover = threading.Thread(target=lambda: moves.update(self.books.rebalance(rates)))
+            mover.start()
+            mover.join(0.1)
+            self.assertTrue(mover.is_alive())
+            self.assertEqual(shard.products, ['ETH-USD', 'LTC-USD'])
+        mover.join(5)
+        self.assertEqual(moves, {'SOL-USD': 1})
+        self.assertEqual(shard.products, ['ETH-USD', 'LTC-USD', 'SOL-USD'])
+
+    def test_rebalance_while_reading(self):
+        errors = []
+        stop = threading.Event()
+
+        def rebalance():
+            heavy = [{'BTC-USD': 100, 'SOL-USD': 90}, {'ETH-USD': 100, 'LTC-USD': 90}]
+            try:
+                for i in range(200):
+                    self.books.rebalance(heavy[i % 2])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                stop.set()
+
+        mover = threading.Thread(target=rebalance)
+        mover.start()
+        while not stop.is_set():
+            for product_id in self.products:
+                for feed in self.feeds:
+                    feed.update(product_id, 'bid', '99.50', '2')
+            self.pump()
+        mover.join()
+        self.assertEqual(errors, [])
+        self.assertGreater(self.books.rebalance_count, 0)
+        self.assertEqual(sorted(p for shard in self.books.shards for p in shard.products),
+                         sorted(self.products))
+        for shard in self.books.shards:
+            for product_id in shard.products:
+                self.assertIs(self.books._connection_of[product_id], shard)
+
+    def test_shard_stats(self):
+        self.feeds[0].update('BTC-USD', 'bid', '99.50', '2')
+        self.pump()
+        stats = self.books.shard_stats()
+        self.assertEqual([entry['index'] for entry in stats], [0, 1])
+        self.assertEqual(stats[0]['messages'], 4)
+        self.assertEqual(stats[1]['messages'], 3)
+        self.assertGreater(stats[0]['lag'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
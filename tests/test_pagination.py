@@ -0,0 +1,101 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from cbadv.cbadv_client import Client
+
+
+class FakePages(object):
+    """ Serves `items` in pages of `size`, like the cursor paginated endpoints. """
+    def __init__(self, key, items, size, has_next=True):
+        self.key = key
+        self.items = items
+        self.size = size
+        self.has_next = has_next
+        self.calls = []
+        self.threads = set()
+
+    def __call__(self, method, endpoint, params=None, data=None):
+        params = params or {}
+        self.calls.append((endpoint, params))
+        self.threads.add(threading.current_thread().name)
+        start = int(params.get('cursor', 0))
+        end = start + self.size
+        page = {self.key: self.items[start:end]}
+        more = end < len(self.items)
+        if self.has_next:
+            page['has_next'] = more
+            page['cursor'] = str(end) if more else ''
+        else:
+            # Fills pages only carry the cursor.
+            page['cursor'] = str(end) if more else ''
+        return page
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('key', 'secret')
+
+    def test_iter_orders_follows_cursor(self):
+        pages = FakePages('orders', list(range(25)), 10)
+        with patch.object(self.client, '_send_message', pages):
+            orders = list(self.client.iter_orders(product_id='BTC-USD', order_status=['FILLED'],
+                                                  limit=10))
+        self.assertEqual(orders, list(range(25)))
+        self.assertEqual([params.get('cursor') for _, params in pages.calls], [None, '10', '20'])
+        for endpoint, params in pages.calls:
+            self.assertEqual(endpoint, '/orders/historical/batch')
+            self.assertEqual(params['product_id'], 'BTC-USD')
+            self.assertEqual(params['order_status'], ['FILLED'])
+            self.assertNotIn('start_date', params)
+
+    def test_iter_fills_without_has_next(self):
+        pages = FakePages('fills', list(range(7)), 3, has_next=False)
+        with patch.object(self.client, '_send_message', pages):
+            fills = list(self.client.iter_fills(order_id='abc',
+                                                start_sequence_timestamp='2023-01-01T00:00:00Z'))
+        self.assertEqual(fills, list(range(7)))
+        self.assertEqual(len(pages.calls), 3)
+        self.assertEqual(pages.calls[0][1], {'order_id': 'abc',
+                                             'start_sequence_timestamp': '2023-01-01T00:00:00Z'})
+
+    def test_lazy(self):
+        pages = FakePages('accounts', list(range(100)), 10)
+        with patch.object(self.client, '_send_message', pages):
+            accounts = self.client.iter_accounts()
+            self.assertEqual(pages.calls, [])
+            self.assertEqual(next(accounts), 0)
+            self.assertEqual(len(pages.calls), 1)
+            accounts.close()
+        self.assertEqual(len(pages.calls), 1)
+
+    def test_prefetch(self):
+        pages = FakePages('fills', list(range(25)), 10)
+        with patch.object(self.client, '_send_message', pages):
+            fills = self.client.iter_fills(prefetch=True)
+            self.assertEqual(next(fills), 0)
+            # The second page is requested before the first is consumed.
+            for _ in range(100):
+                if len(pages.calls) == 2:
+                    break
+                threading.Event().wait(0.01)
+            self.assertEqual(len(pages.calls), 2)
+            self.assertEqual(list(fills), list(range(1, 25)))
+        self.assertNotIn(threading.current_thread().name, pages.threads)
+
+    def test_empty_page_stops(self):
+        pages = FakePages('orders', [], 10)
+        with patch.object(self.client, '_send_message', pages):
+            self.assertEqual(list(self.client.iter_orders()), [])
+        self.assertEqual(pages.calls, [('/orders/historical/batch', {})])
+
+    def test_list_methods_accept_filters(self):
+        calls = []
+        with patch.object(self.client, '_send_message',
+                          lambda *args, **kwargs: calls.append((args, kwargs))):
+            self.client.list_orders()
+            self.client.list_fills(product_id='ETH-USD', cursor='5')
+        self.assertEqual(calls[0], (('GET', '/orders/historical/batch'), {'params': None}))
+        self.assertEqual(calls[1], (('GET', '/orders/historical/fills'),
+                                    {'params': {'product_id': 'ETH-USD', 'cursor': '5'}}))
@@ -0,0 +1,82 @@
+import json
+import threading
+import unittest
+from unittest.mock import patch
+
+from cbadv.cbadv_client import Client
+
+
+def ladder(levels):
+    return [{'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+             'price': str(100 - level), 'size': '0.01'} for level in range(levels)]
+
+
+class FakeOrders(object):
+    """ Answers order placements, failing the prices in `fail`. """
+    def __init__(self, fail=(), reject=()):
+        self.fail = fail
+        self.reject = reject
+        self.bodies = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, method, endpoint, params=None, data=None):
+        body = json.loads(data)
+        with self.lock:
+            self.bodies.append((method, endpoint, body))
+            self.threads.add(threading.current_thread().name)
+        if body['price'] in self.fail:
+            raise ConnectionError('reset')
+        if body['price'] in self.reject:
+            return {'success': False, 'failure_reason': 'INSUFFICIENT_FUND'}
+        return {'success': True, 'order_id': body['price']}
+
+
+class TestPlaceOrders(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('key', 'secret')
+
+    def test_results_in_input_order(self):
+        orders = ladder(40)
+        fake = FakeOrders()
+        with patch.object(self.client, '_send_message', fake):
+            results = self.client.place_orders(orders, workers=8)
+        self.assertEqual([r.order for r in results], orders)
+        self.assertEqual([r.response['order_id'] for r in results],
+                         [order['price'] for order in orders])
+        self.assertTrue(all(r.ok for r in results))
+        for method, endpoint, body in fake.bodies:
+            self.assertEqual((method, endpoint), ('POST', '/orders'))
+            self.assertEqual(body['type'], 'limit')
+        self.assertNotIn(threading.current_thread().name, fake.threads)
+
+    def test_partial_failure(self):
+        fake = FakeOrders(fail=('98',), reject=('96',))
+        with patch.object(self.client, '_send_message', fake):
+            results = self.client.place_orders(ladder(6))
+        self.assertEqual([r.ok for r in results], [True, True, False, True, False, True])
+        self.assertIsInstance(results[2].error, ConnectionError)
+        self.assertIsNone(results[2].response)
+        self.assertIsNone(results[4].error)
+        self.assertEqual(len(fake.bodies), 6)
+
+    def test_invalid_order_sends_nothing(self):
+        orders = ladder(3)
+        orders[1] = {'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'market',
+                     'size': '1', 'funds': '1'}
+        fake = FakeOrders()
+        with patch.object(self.client, '_send_message', fake):
+            with self.assertRaisesRegex(ValueError, '^order 1: '):
+                self.client.place_orders(orders)
+            with self.assertRaisesRegex(ValueError, '^order 0: '):
+                self.client.place_orders([{'side': 'buy'}])
+        self.assertEqual(fake.bodies, [])
+
+    def test_single_worker_and_empty(self):
+        fake = FakeOrders()
+        with patch.object(self.client, '_send_message', fake):
+            self.assertEqual(self.client.place_orders([]), [])
+            results = self.client.place_orders(ladder(2), workers=1)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(fake.threads, {threading.current_thread().name})
@@ -0,0 +1,111 @@
+import json
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
+from cbadv.cbadv_client import Client
+from cbadv.products import ProductCatalog
+
+
+def product(product_id='BTC-USD', **fields):
+    product = {'product_id': product_id, 'base_increment': '0.00000001',
+               'quote_increment': '0.01', 'base_min_size': '0.0001', 'base_max_size': '100',
+               'quote_min_size': '1', 'quote_max_size': '1000000', 'status': 'online',
+               'trading_disabled': False, 'is_disabled': False, 'cancel_only': False,
+               'limit_only': False, 'post_only': False, 'price': '26000.00'}
+    product.update(fields)
+    return product
+
+
+class TestProductCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = ProductCatalog({'products': [product(), product('ETH-USD')]})
+
+    def test_lookup(self):
+        btc = self.catalog['BTC-USD']
+        self.assertEqual(btc.quote_increment, Decimal('0.01'))
+        self.assertEqual(btc.base_min_size, Decimal('0.0001'))
+        self.assertTrue(btc.tradable)
+        self.assertIn('ETH-USD', self.catalog)
+        self.assertEqual(len(self.catalog), 2)
+        self.assertIsNone(self.catalog.get('DOGE-USD'))
+        with self.assertRaises(KeyError):
+            self.catalog['DOGE-USD']
+
+    def test_rounding(self):
+        self.assertEqual(self.catalog.round_price('BTC-USD', 26001.237, side='buy'),
+                         Decimal('26001.23'))
+        self.assertEqual(self.catalog.round_price('BTC-USD', '26001.231', side='sell'),
+                         Decimal('26001.24'))
+        self.assertEqual(self.catalog.round_price('BTC-USD', '26001.235'), Decimal('26001.24'))
+        self.assertEqual(str(self.catalog.round_price('BTC-USD', 5)), '5.00')
+        self.assertEqual(self.catalog.round_size('BTC-USD', '0.123456789'),
+                         Decimal('0.12345678'))
+
+    def test_incremental_update(self):
+        btc = self.catalog['BTC-USD']
+        # Price moves are not metadata changes.
+        self.assertEqual(self.catalog.update([product(price='1.00')]), [])
+        self.assertIs(self.catalog['BTC-USD'], btc)
+        self.assertEqual(self.catalog.update([product(cancel_only=True)]), ['BTC-USD'])
+        self.assertFalse(self.catalog['BTC-USD'].tradable)
+        self.assertEqual(self.catalog.update({'products': [product()]}, prune=True),
+                         ['BTC-USD', 'ETH-USD'])
+        self.assertNotIn('ETH-USD', self.catalog)
+
+    def test_validate(self):
+        validate = self.catalog.validate
+        validate('BTC-USD', 'buy', 'limit', price='26000.01', size='0.01')
+        validate('BTC-USD', 'buy', 'market', funds='10')
+        for args, kwargs in [(('DOGE-USD', 'buy', 'market'), {'funds': '10'}),
+                             (('BTC-USD', 'buy', 'limit'), {'price': '26000.001', 'size': '1'}),
+                             (('BTC-USD', 'buy', 'limit'), {'price': '26000', 'size': '1e-9'}),
+                             (('BTC-USD', 'buy', 'limit'), {'price': '26000', 'size': '0.00001'}),
+                             (('BTC-USD', 'buy', 'limit'), {'price': '26000', 'size': '101'}),
+                             (('BTC-USD', 'buy', 'market'), {'funds': '0.5'})]:
+            with self.assertRaises(ValueError):
+                validate(*args, **kwargs)
+
+    def test_validate_status(self):
+        self.catalog.update([product(limit_only=True), product('ETH-USD', post_only=True),
+                             product('SOL-USD', trading_disabled=True)])
+        with self.assertRaisesRegex(ValueError, 'only accepts limit orders'):
+            self.catalog.validate('BTC-USD', 'buy', 'market', funds='10')
+        with self.assertRaisesRegex(ValueError, 'post only'):
+            self.catalog.validate('ETH-USD', 'buy', 'limit', price='1', size='1')
+        self.catalog.validate('ETH-USD', 'buy', 'limit', price='1', size='1', post_only=True)
+        with self.assertRaisesRegex(ValueError, 'not open'):
+            self.catalog.validate('SOL-USD', 'sell', 'limit', price='1', size='1')
+
+
+class TestClientCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client('key', 'secret')
+        self.calls = []
+
+        def send(method, endpoint, params=None, data=None):
+            self.calls.append((method, endpoint, data))
+            if endpoint == '/products':
+                return {'products': [product()], 'num_products': 1}
+            return {'success': True, 'order': json.loads(data)}
+
+        patcher = patch.object(self.client, '_send_message', send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_orders_checked_before_sending(self):
+        self.client.place_limit_order('BTC-USD', 'buy', '26000.001', '0.01')
+        self.assertIs(self.client.load_catalog(), self.client.catalog)
+        self.assertEqual(len(self.calls), 2)
+        with self.assertRaises(ValueError):
+            self.client.place_limit_order('BTC-USD', 'buy', '26000.001', '0.01')
+        with self.assertRaisesRegex(ValueError, '^order 1: '):
+            self.client.place_orders([
+                {'product_id': 'BTC-USD', 'side': 'buy', 'order_type': 'limit',
+                 'price': '26000.00', 'size': '0.01'},
+                {'product_id': 'ETH-USD', 'side': 'buy', 'order_type': 'market', 'funds': '10'}])
+        self.assertEqual(len(self.calls), 2)
+        self.client.place_limit_order('BTC-USD', 'buy', '26000.00', '0.01')
+        self.assertEqual(len(self.calls), 3)
@@ -1,76 +1,64 @@
 import pytest
-import time
-from itertools import islice
-import datetime
-from dateutil.relativedelta import relativedelta
-from advtrade.public_client import PublicClient
 
+from cbadv.cbadv_client import Client
+from cbadv.mock_server import MockExchange
+from cbadv.rate_limit import RateLimiter
 
-@pytest.fixture(scope='module')
-def client():
-    return PublicClient()
-
-
-@pytest.mark.usefixtures('client')
-class TestPublicClient(object):
-
-    @staticmethod
-    def teardown_method():
-        time.sleep(.25)  # Avoid rate limit
-
-    def test_get_products(self, client):
-        r = client.get_products()
-        assert type(r) is list
-
-    @pytest.mark.parametrize('level', [1, 2, 3, None])
-    def test_get_product_order_book(self, client, level):
-        r = client.get_product_order_book('BTC-USD', level=level)
-        assert type(r) is dict
-        assert 'asks' in r
-        assert 'bids' in r
-
-        if level in (1, None) and (len(r['asks']) > 1 or len(r['bids']) > 1):
-            pytest.fail('Fail: Level 1 should only return the best ask and bid')
 
-        if level is 2 and (len(r['asks']) > 50 or len(r['bids']) > 50):
-            pytest.fail('Fail: Level 2 should only return the top 50 asks and bids')
-
-        if level is 3 and (len(r['asks']) < 50 or len(r['bids']) < 50):
-            pytest.fail('Fail: Level 3 should return the full order book')
-
-    def test_get_product_ticker(self, client):
-        r = client.get_product_ticker('BTC-USD')
-        assert type(r) is dict
-        assert 'ask' in r
-        assert 'trade_id' in r
-
-    def test_get_product_trades(self, client):
-        r = list(islice(client.get_product_trades('BTC-USD'), 200))
-        assert type(r) is list
-        assert 'trade_id' in r[0]
+@pytest.fixture(scope='module')
+def exchange():
+    pytest.importorskip('aiohttp')
+    with MockExchange(api_secret='secret') as exchange:
+        yield exchange
 
-    current_time = datetime.datetime.now()
 
-    @pytest.mark.parametrize('start,end,granularity',
-                             [(current_time - relativedelta(months=1),
-                               current_time, 21600)])
-    def test_get_historic_rates(self, client, start, end, granularity):
-        r = client.get_product_historic_rates('BTC-USD', start=start, end=end, granularity=granularity)
-        assert type(r) is list
-        for ticker in r:
-            assert( all( [type(x) in (int, float) for x in ticker ] ) )
+@pytest.fixture(scope='module')
+def client(exchange):
+    client = Client('key', 'secret', api_url=exchange.rest_url,
+                    rate_limiter=RateLimiter(private_rate=1000, public_rate=1000))
+    yield client
+    client.close()
 
-    def test_get_product_24hr_stats(self, client):
-        r = client.get_product_24hr_stats('BTC-USD')
-        assert type(r) is dict
-        assert 'volume_30day' in r
 
-    def test_get_currencies(self, client):
-        r = client.get_currencies()
-        assert type(r) is list
-        assert 'name' in r[0]
+@pytest.mark.usefixtures('client')
+class TestPublicClient(object):
 
-    def test_get_time(self, client):
-        r = client.get_time()
+    def test_list_products(self, client):
+        r = client.list_products()
         assert type(r) is dict
-        assert 'iso' in r
+        assert r['num_products'] == len(r['products'])
+        assert 'BTC-USD' in [product['product_id'] for product in r['products']]
+
+    def test_get_product(self, client):
+        r = client.get_product('BTC-USD')
+        assert r['product_id'] == 'BTC-USD'
+        assert r['quote_increment'] == '0.01'
+        assert float(r['price']) > 0
+
+    def test_get_unknown_product(self, client):
+        assert client.get_product('NOPE-USD') == {'error': 'NOT_FOUND'}
+
+    @pytest.mark.parametrize('granularity,step', [('ONE_MINUTE', 60), ('ONE_HOUR', 3600)])
+    def test_get_product_candles(self, client, granularity, step):
+        r = client.get_product_candles('BTC-USD', str(step * 10), str(step * 20), granularity)
+        starts = [int(candle['start']) for candle in r['candles']]
+        assert starts == list(range(step * 20, step * 10 - 1, -step))
+        for candle in r['candles']:
+            assert float(candle['low']) <= float(candle['open']) <= float(candle['high'])
+
+    def test_too_many_candles(self, client):
+        r = client.get_product_candles('BTC-USD', '0', str(60 * 400), 'ONE_MINUTE')
+        assert r['error'] == 'INVALID_ARGUMENT'
+
+    def test_get_market_trades(self, client):
+        r = client.get_market_trades('ETH-USD', limit='20')
+        assert len(r['trades']) == 20
+        assert 'trade_id' in r['trades'][0]
+
+    def test_get_transactions_summary(self, client):
+        r = client.get_transactions_summary()
+        assert 'fee_tier' in r
+
+    def test_bad_signature(self, exchange):
+        client = Client('key', 'wrong', api_url=exchange.rest_url)
+        assert client.get_product('BTC-USD') == {'error': 'unauthorized'}
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cbadv.cbadv_client import Client
+from cbadv.rate_limit import (BULK, HIGH, NORMAL, PriorityBucket, RateLimiter, TokenBucket,
+                              default_limiter, priority)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        now = [0.]
+        bucket = TokenBucket(10, capacity=3, clock=lambda: now[0])
+        self.assertTrue(all(bucket.try_acquire() for _ in range(3)))
+        self.assertFalse(bucket.try_acquire())
+        now[0] = 0.1
+        self.assertTrue(bucket.try_acquire())
+        self.assertEqual(bucket.delay(), 0.1)
+        self.assertAlmostEqual(bucket.delay(), 0.2)
+        now[0] = 10.
+        self.assertTrue(bucket.try_acquire(3))
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def enqueue(bucket, level):
+    with bucket._lock:
+        return bucket._enqueue(level)
+
+
+def poll(bucket, ticket):
+    with bucket._lock:
+        return bucket._poll(ticket)
+
+
+class TestPriorityBucket(unittest.TestCase):
+
+    def test_higher_priority_served_first(self):
+        clock = FakeClock()
+        bucket = PriorityBucket(10, capacity=1, clock=clock)
+        self.assertTrue(bucket.try_acquire())
+        order = []
+
+        def request(level, name):
+            bucket.acquire(level)
+            order.append(name)
+
+        def wait_queued(count):
+            deadline = time.time() + 5
+            while len(bucket._waiting) < count and time.time() < deadline:
+                time.sleep(0.001)
+
+        threads = [threading.Thread(target=request, args=(BULK, 'bulk')),
+                   threading.Thread(target=request, args=(HIGH, 'order'))]
+        threads[0].start()
+        wait_queued(1)
+        threads[1].start()
+        wait_queued(2)
+        # One token: the order queued last gets it.
+        clock.now = 0.1
+        threads[1].join(5)
+        self.assertEqual(order, ['order'])
+        clock.now = 0.2
+        threads[0].join(5)
+        self.assertEqual(order, ['order', 'bulk'])
+
+    def test_bulk_leaves_reserve(self):
+        clock = FakeClock()
+        bucket = PriorityBucket(10, reserve=3, clock=clock)
+        bulk = enqueue(bucket, BULK)
+        for _ in range(7):
+            self.assertEqual(poll(bucket, bulk), 0.)
+            bulk = enqueue(bucket, BULK)
+        self.assertAlmostEqual(poll(bucket, bulk), 0.1)
+        order = enqueue(bucket, HIGH)
+        self.assertEqual(poll(bucket, order), 0.)
+
+    def test_observe_and_penalize(self):
+        clock = FakeClock()
+        bucket = PriorityBucket(10, clock=clock)
+        bucket.observe(remaining=2)
+        self.assertTrue(bucket.try_acquire(2))
+        self.assertFalse(bucket.try_acquire())
+        clock.now = 1.
+        bucket.observe(remaining=0, reset=5)
+        ticket = enqueue(bucket, NORMAL)
+        self.assertEqual(poll(bucket, ticket), 5.)
+        clock.now = 6.
+        self.assertEqual(poll(bucket, ticket), 0.)
+        bucket.penalize(2)
+        ticket = enqueue(bucket, HIGH)
+        self.assertEqual(poll(bucket, ticket), 2.)
+
+    def test_acquire_async(self):
+        bucket = PriorityBucket(200, capacity=1)
+
+        async def burst():
+            start = time.monotonic()
+            await asyncio.gather(*(bucket.acquire_async() for _ in range(5)))
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(burst())
+        self.assertGreaterEqual(elapsed, 4 / 200. - 0.005)
+        self.assertEqual(bucket._waiting, [])
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_classification(self):
+        limiter = RateLimiter()
+        self.assertIs(limiter.bucket('/orders'), limiter.buckets['private'])
+        self.assertIs(limiter.bucket('/market/products'), limiter.buckets['public'])
+        self.assertEqual(limiter.level('POST', '/orders'), HIGH)
+        self.assertEqual(limiter.level('POST', '/orders/batch_cancel'), HIGH)
+        self.assertEqual(limiter.level('GET', '/orders/historical/fills'), NORMAL)
+        with priority(BULK):
+            self.assertEqual(limiter.level('GET', '/products'), BULK)
+        self.assertEqual(limiter.level('GET', '/products'), NORMAL)
+
+    def test_observe(self):
+        limiter = RateLimiter()
+        self.assertEqual(limiter.observe('/accounts', 200, {'x-ratelimit-remaining': '5'}), 0.)
+        self.assertLessEqual(limiter.buckets['private']._tokens, 5)
+        self.assertEqual(limiter.observe('/accounts', 429, {'retry-after': '1.5'}), 1.5)
+        self.assertEqual(limiter.throttled, 1)
+
+
+class TestClientRateLimit(unittest.TestCase):
+
+    def response(self, status, body, headers=None):
+        response = MagicMock(status_code=status, headers=headers or {})
+        response.json.return_value = body
+        return response
+
+    def test_retries_after_429(self):
+        limiter = RateLimiter()
+        client = Client('key', 'secret', rate_limiter=limiter)
+        responses = [self.response(429, {'error': 'rate limited'}, {'retry-after': '0.01'}),
+                     self.response(200, {'accounts': []})]
+        with patch.object(client.session, 'request', side_effect=responses) as request:
+            self.assertEqual(client.list_accounts(), {'accounts': []})
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(limiter.throttled, 1)
+
+    def test_clients_share_default_limiter(self):
+        self.assertIs(Client().rate_limiter, Client().rate_limiter)
+        self.assertIs(Client().rate_limiter, default_limiter())
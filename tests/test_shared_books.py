@@ -0,0 +1,218 @@
+import functools
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from cbadv.capture import CaptureWriter, replay
+from cbadv.shared_books import ProcessOrderBooks, SharedBookTable
+from cbadv.tick_order_book import TickOrderBook
+from tests.test_order_books import FakeFeed
+
+
+class TestSharedBookTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = SharedBookTable.create(['BTC-USD', 'ETH-USD'], depth=3)
+
+    def tearDown(self):
+        self.table.close()
+
+    def test_empty_books_read_nan(self):
+        top = self.table.top('ETH-USD')
+        self.assertTrue(math.isnan(top.bid_price))
+        self.assertTrue(math.isnan(top.ask_price))
+        self.assertEqual(self.table.depth_levels('ETH-USD'), ([], []))
+
+    def test_publish_and_attach(self):
+        self.table.publish('BTC-USD', [(100., 1.), (99., 2.), (98., 3.), (97., 4.)], [(101., 5.)])
+        reader = SharedBookTable.attach(self.table.name, untrack=False)
+        try:
+            self.assertEqual(reader.products, ['BTC-USD', 'ETH-USD'])
+            self.assertEqual(reader.depth, 3)
+            top = reader.top('BTC-USD')
+            self.assertEqual((top.bid_price, top.bid_size, top.ask_price, top.ask_size),
+                             (100., 1., 101., 5.))
+            self.assertEqual(top.version % 2, 0)
+            bids, asks = reader.depth_levels('BTC-USD')
+            self.assertEqual(bids, [(100., 1.), (99., 2.), (98., 3.)])
+            self.assertEqual(asks, [(101., 5.)])
+        finally:
+            reader.close()
+
+    def test_version_advances(self):
+        before = self.table.top('BTC-USD').version
+        self.table.publish('BTC-USD', [(100., 1.)], [(101., 1.)])
+        self.table.publish('BTC-USD', [], [])
+        after = self.table.top('BTC-USD')
+        self.assertEqual(after.version, before + 4)
+        self.assertTrue(math.isnan(after.bid_price))
+
+    def stall(self, product_id, pid):
+        # What a writer killed between the two version updates leaves.
+        word = self.table._offset(self.table._index[product_id]) // 8
+        self.table._words[word] += 1
+        self.table._words[word + 1] = pid
+
+    def test_read_fails_when_writer_died(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        self.stall('ETH-USD', process.pid)
+        start = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            self.table.top('ETH-USD')
+        self.assertLess(time.monotonic() - start, self.table.WRITE_TIMEOUT)
+        self.assertEqual(self.table.top('BTC-USD').version % 2, 0)
+
+    def test_read_times_out_on_stuck_writer(self):
+        self.stall('BTC-USD', os.getpid())
+        with patch.object(SharedBookTable, 'WRITE_TIMEOUT', 0.05):
+            with self.assertRaises(RuntimeError):
+                self.table.depth_levels('BTC-USD')
+
+
+class TestProcessOrderBooks(unittest.TestCase):
+
+    def setUp(self):
+        self.products = ['BTC-USD', 'ETH-USD', 'SOL-USD']
+        self.feed = FakeFeed(self.products)
+        self.books = ProcessOrderBooks('key', 'secret', product_id=self.products, workers=2,
+                                       depth=5, decoder_options={'backend': 'json'})
+        self.books.start_workers()
+        with patch('cbadv.websocket_client.create_connection', return_value=self.feed):
+            self.books._connect()
+
+    def tearDown(self):
+        self.books.close()
+
+    def pump(self):
+        while self.feed.frames:
+            self.books.on_message(self.feed.recv())
+
+    def wait_for(self, product_id, bid, ask, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            top = self.books.top(product_id)
+            if (top.bid_price, top.ask_price) == (bid, ask):
+                return top
+            time.sleep(0.01)
+        self.fail('{} never reached {} / {}: {}'.format(product_id, bid, ask, top))
+
+    def test_workers_publish_books(self):
+        self.pump()
+        self.feed.update('BTC-USD', 'bid', '99.50', '2')
+        self.feed.update('SOL-USD', 'offer', '100.50', '3')
+        self.pump()
+        self.wait_for('BTC-USD', 99.5, 101.)
+        self.wait_for('ETH-USD', 99., 101.)
+        top = self.wait_for('SOL-USD', 99., 100.5)
+        self.assertEqual(top.ask_size, 3.)
+        bids, asks = self.books.table.depth_levels('BTC-USD')
+        self.assertEqual(bids, [(99.5, 2.), (99., 1.)])
+
+    def test_gap_resets_and_resubscribes(self):
+        self.pump()
+        self.feed.update('BTC-USD', 'bid', '99.50', '2', drop=True)
+        self.feed.update('ETH-USD', 'offer', '100.50', '3')
+        self.pump()
+        self.assertEqual(self.books.gap_count, 1)
+        self.assertEqual(self.books.resync_count, 1)
+        self.assertEqual([msg['type'] for msg in self.feed.sent[-2:]], ['unsubscribe', 'subscribe'])
+        # The fresh snapshots carry the dropped update.
+        self.wait_for('BTC-USD', 99.5, 101.)
+        self.wait_for('ETH-USD', 99., 100.5)
+
+    def test_replay_capture(self):
+        self.books.close()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'feed.cap')
+        feed = FakeFeed(['BTC-USD'])
+        feed.send('{"type": "subscribe", "channel": "level2", "product_ids": ["BTC-USD"]}')
+        feed.update('BTC-USD', 'bid', '99.50', '2', drop=True)
+        feed.update('BTC-USD', 'offer', '100.50', '3')
+        # The snapshot that answered the resync of the live session.
+        feed.send('{"type": "subscribe", "channel": "level2", "product_ids": ["BTC-USD"]}')
+        with CaptureWriter(path) as writer:
+            for frame in feed.frames:
+                writer.write(frame)
+        self.books = ProcessOrderBooks('key', 'secret', product_id=['BTC-USD'], workers=1,
+                                       decoder_options={'backend': 'json'})
+        self.books.start_workers()
+        self.assertEqual(replay(path, self.books), 5)
+        self.assertEqual((self.books.gap_count, self.books.resync_count), (1, 1))
+        self.wait_for('BTC-USD', 99.5, 100.5)
+
+    def test_tick_books(self):
+        self.books.close()
+        book_class = functools.partial(TickOrderBook, quote_increment='0.01',
+                                       base_increment='0.00000001')
+        self.books = ProcessOrderBooks('key', 'secret', product_id=['BTC-USD'], workers=1,
+                                       book_class=book_class, decoder_options={'backend': 'json'})
+        self.books.start_workers()
+        self.feed = FakeFeed(['BTC-USD'])
+        with patch('cbadv.websocket_client.create_connection', return_value=self.feed):
+            self.books._connect()
+        self.pump()
+        self.wait_for('BTC-USD', 99., 101.)
+
+    def test_add_and_remove_products(self):
+        self.pump()
+        self.books.remove_products(['ETH-USD'])
+        self.assertNotIn('ETH-USD', self.books.order_books)
+        deadline = time.time() + 10
+        while not math.isnan(self.books.top('ETH-USD').bid_price):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(self.books.add_products(['ETH-USD']), ['ETH-USD'])
+        self.pump()
+        self.wait_for('ETH-USD', 99., 101.)
+        with self.assertRaises(ValueError):
+            self.books.add_products(['LTC-USD'])
+        self.assertNotIn('LTC-USD', self.books.order_books)
+
+
+class TestShardedProcessOrderBooks(unittest.TestCase):
+
+    def setUp(self):
+        self.products = ['BTC-USD', 'ETH-USD', 'SOL-USD', 'LTC-USD']
+        self.books = ProcessOrderBooks('key', 'secret', product_id=self.products, workers=2,
+                                       shards=2, decoder_options={'backend': 'json'})
+        self.addCleanup(self.books.close)
+        self.books.start_workers()
+        self.feeds = []
+        for shard in self.books.shards:
+            feed = FakeFeed(self.products)
+            self.feeds.append(feed)
+            with patch('cbadv.websocket_client.create_connection', return_value=feed):
+                shard._connect()
+        self.pump()
+
+    def pump(self):
+        for shard, feed in zip(self.books.shards, self.feeds):
+            while feed.frames:
+                shard.on_message(feed.recv())
+
+    wait_for = TestProcessOrderBooks.wait_for
+
+    def test_rebalance_moves_products(self):
+        self.assertEqual([shard.products for shard in self.books.shards],
+                         [['BTC-USD', 'SOL-USD'], ['ETH-USD', 'LTC-USD']])
+        moves = self.books.rebalance({'BTC-USD': 10, 'SOL-USD': 10, 'ETH-USD': 1,
+                                      'LTC-USD': 1})
+        self.assertEqual(moves, {'SOL-USD': 1, 'LTC-USD': 0})
+        self.assertIn({'type': 'subscribe', 'product_ids': ['SOL-USD']},
+                      [{'type': msg['type'], 'product_ids': msg['product_ids']}
+                       for msg in self.feeds[1].sent])
+        # The old connection's frames of a moved product are dropped.
+        self.feeds[0].update('SOL-USD', 'bid', '99.50', '2')
+        self.feeds[1].update('SOL-USD', 'offer', '100.50', '3')
+        self.pump()
+        self.wait_for('SOL-USD', 99., 100.5)
+        self.wait_for('LTC-USD', 99., 101.)
+        self.assertEqual(self.books.gap_count, 0)
@@ -0,0 +1,97 @@
+import copy
+import random
+import unittest
+from decimal import Decimal
+
+from cbadv.order_book import OrderBook
+from cbadv.tick_order_book import FixedPoint, TickOrderBook
+
+
+def level(side, price, size):
+    return {'side': side, 'event_time': '2023-01-01T00:00:00Z',
+            'price_level': price, 'new_quantity': size}
+
+
+def random_stream(n_updates, seed=1):
+    rng = random.Random(seed)
+    snapshot = [level('bid', '{:.2f}'.format(100 - i * 0.01), '1.5') for i in range(1, 50)]
+    snapshot += [level('offer', '{:.2f}'.format(100 + i * 0.01), '2.25') for i in range(50)]
+    updates = []
+    for _ in range(n_updates):
+        side = rng.choice(['bid', 'offer'])
+        offset = rng.randint(0, 60) * 0.01
+        price = 100 - 0.01 - offset if side == 'bid' else 100 + offset
+        size = rng.choice(['0', '0.00000001', '0.5', '3.1415'])
+        updates.append([level(side, '{:.2f}'.format(price), size)])
+    return snapshot, updates
+
+
+class TestFixedPoint(unittest.TestCase):
+
+    def test_round_trip(self):
+        fp = FixedPoint('0.01')
+        self.assertEqual(fp.to_int('30000.01'), 3000001)
+        self.assertEqual(fp.to_int('30000.1'), 3000010)
+        self.assertEqual(fp.to_int('30000'), 3000000)
+        self.assertEqual(fp.to_decimal(3000001), Decimal('30000.01'))
+
+    def test_non_decimal_step(self):
+        fp = FixedPoint('0.05')
+        self.assertEqual(fp.to_int('1.15'), 23)
+        self.assertEqual(fp.to_decimal(23), Decimal('1.15'))
+
+    def test_numeric_input(self):
+        fp = FixedPoint('0.00000001')
+        self.assertEqual(fp.to_int(Decimal('0.5')), 50000000)
+
+    def test_invalid_increment(self):
+        with self.assertRaises(ValueError):
+            FixedPoint('0')
+
+
+class TestTickOrderBook(unittest.TestCase):
+
+    def setUp(self):
+        self.book = TickOrderBook('BTC-USD', quote_increment='0.01',
+                                  base_increment='0.00000001')
+
+    def test_snapshot_top_of_book(self):
+        self.book._message([level('bid', '99.98', '1'), level('bid', '99.99', '2'),
+                            level('offer', '100.01', '3'), level('offer', '100.00', '4')])
+        self.assertEqual(self.book.get_bid()['price_level'], Decimal('99.99'))
+        self.assertEqual(self.book.get_bid()['new_quantity'], Decimal('2'))
+        self.assertEqual(self.book.get_ask()['price_level'], Decimal('100.00'))
+        self.assertEqual(self.book.get_ask()['new_quantity'], Decimal('4'))
+
+    def test_update_and_remove(self):
+        self.book._message([level('bid', '99.99', '2'), level('offer', '100.00', '4')])
+        self.book._message([level('bid', '99.99', '0'), level('bid', '99.50', '1'),
+                            level('offer', '99.99', '1')])
+        self.assertEqual(self.book.get_bid()['price_level'], Decimal('99.50'))
+        self.assertEqual(self.book.get_ask()['price_level'], Decimal('99.99'))
+        self.book.remove(level('offer', '99.99', '0'))
+        self.assertEqual(self.book.get_ask()['price_level'], Decimal('100.00'))
+
+    def test_empty_side_raises(self):
+        self.book._message([level('bid', '99.99', '2')])
+        with self.assertRaises(IndexError):
+            self.book.get_ask()
+
+    def test_matches_sorted_dict_book(self):
+        snapshot, updates = random_stream(2000)
+        reference = OrderBook('BTC-USD')
+        reference._message(copy.deepcopy(snapshot))
+        self.book._message(snapshot)
+        for events in updates:
+            reference._message(copy.deepcopy(events))
+            self.book._message(events)
+            for ours, theirs in ((self.book.get_bid(), reference.get_bid()),
+                                 (self.book.get_ask(), reference.get_ask())):
+                self.assertEqual(ours['price_level'], theirs['price_level'])
+                self.assertEqual(ours['new_quantity'], theirs['new_quantity'])
+        self.assertEqual(list(self.book._bid_keys),
+                         [self.book._price.to_int(str(p)) for p in reference._bids.keys()])
+
+
+if __name__ == '__main__':
+    unittest.main()
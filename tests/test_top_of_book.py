@@ -0,0 +1,102 @@
+import functools
+import json
+import time
+import unittest
+from queue import Empty
+from unittest.mock import patch
+
+from cbadv.order_books import OrderBooks
+from cbadv.tick_order_book import TickOrderBook
+from cbadv.top_of_book import TopOfBook, TopOfBookFeed
+from tests.test_order_books import FakeFeed
+
+
+class TestTopOfBookFeed(unittest.TestCase):
+
+    def books(self, feed, **kwargs):
+        self.feed = FakeFeed(['BTC-USD', 'ETH-USD'])
+        books = OrderBooks('key', 'secret', product_id=['BTC-USD', 'ETH-USD'],
+                           top_of_book=feed, **kwargs)
+        with patch('cbadv.websocket_client.create_connection', return_value=self.feed):
+            books._connect()
+        self.addCleanup(feed.close)
+        self.pump(books)
+        return books
+
+    def pump(self, books):
+        while self.feed.frames:
+            books.on_message(json.loads(self.feed.recv()))
+
+    def test_emits_only_changes(self):
+        tops = []
+        books = self.books(TopOfBookFeed(tops.append))
+        self.assertEqual([(top.product_id, top.bids, top.asks) for top in tops],
+                         [('BTC-USD', ((99., 1.),), ((101., 1.),)),
+                          ('ETH-USD', ((99., 1.),), ((101., 1.),))])
+        self.feed.update('BTC-USD', 'bid', '98.00', '5')
+        self.feed.update('ETH-USD', 'offer', '102.00', '5')
+        self.pump(books)
+        self.assertEqual(len(tops), 2)
+        self.feed.update('BTC-USD', 'bid', '99.00', '2')
+        self.feed.update('ETH-USD', 'offer', '100.50', '3')
+        self.pump(books)
+        self.assertEqual([(top.bid, top.bid_size, top.ask, top.ask_size) for top in tops[2:]],
+                         [(99., 2., 101., 1.), (99., 1., 100.5, 3.)])
+        self.assertEqual(tops[-1].mid, 99.75)
+        # A resync rebuilding the same book is not a change.
+        books.resync(['BTC-USD'])
+        self.pump(books)
+        self.assertEqual(books.top_of_book.changes, 4)
+
+    def test_depth(self):
+        tops = []
+        book_class = functools.partial(TickOrderBook, quote_increment='0.01',
+                                       base_increment='0.00000001')
+        books = self.books(TopOfBookFeed(tops.append, depth=2), book_class=book_class)
+        self.feed.update('BTC-USD', 'bid', '98.00', '5')
+        self.feed.update('BTC-USD', 'bid', '97.00', '5')
+        self.pump(books)
+        self.assertEqual(tops[-1].bids, ((99., 1.), (98., 5.)))
+        self.assertEqual(len(tops), 3)
+
+    def test_queue_keeps_the_latest_change(self):
+        feed = TopOfBookFeed()
+        books = self.books(feed)
+        for size in ('2', '3', '4'):
+            self.feed.update('BTC-USD', 'bid', '99.00', size)
+        self.pump(books)
+        self.assertEqual([feed.get().bid_size for _ in range(2)], [4., 1.])
+        self.assertEqual(feed.conflated, 3)
+        with self.assertRaises(Empty):
+            feed.get(timeout=0.01)
+
+    def test_interval(self):
+        tops = []
+        books = self.books(TopOfBookFeed(tops.append, interval={'BTC-USD': 0.05}))
+        for size in ('2', '3', '4'):
+            self.feed.update('BTC-USD', 'bid', '99.00', size)
+            self.feed.update('ETH-USD', 'bid', '99.00', size)
+        self.pump(books)
+        self.assertEqual([(top.product_id, top.bid_size) for top in tops],
+                         [('BTC-USD', 1.), ('ETH-USD', 1.), ('ETH-USD', 2.), ('ETH-USD', 3.),
+                          ('ETH-USD', 4.)])
+        time.sleep(0.1)
+        self.assertEqual((tops[-1].product_id, tops[-1].bid_size), ('BTC-USD', 4.))
+        self.assertEqual(books.top_of_book.conflated, 2)
+
+    def test_removed_products_are_forgotten(self):
+        feed = TopOfBookFeed()
+        books = self.books(feed)
+        books.remove_products(['BTC-USD'])
+        self.assertIsNone(feed.top('BTC-USD'))
+        self.assertEqual(feed.get().product_id, 'ETH-USD')
+        with self.assertRaises(Empty):
+            feed.get(timeout=0)
+
+    def test_empty_book(self):
+        top = TopOfBook('BTC-USD', (), ((1., 2.),), 0.)
+        self.assertEqual((top.bid, top.bid_size, top.ask, top.mid), (None, None, 1., None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,50 +1,247 @@
+import json
+import queue
+import threading
+import time
 import unittest
-from unittest.mock import patch, MagicMock
-from cbadv.websocket_client import WebsocketClient
+from unittest.mock import patch
+
+from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException
+
+from cbadv.websocket_client import WebsocketClient, frame_time
+
+
+def frame(n):
+    return json.dumps({'channel': 'ticker', 'timestamp': '2023-01-01T00:00:{:02d}.5Z'.format(n),
+                       'sequence_num': n, 'events': [{'n': n}]})
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class FakeSocket(object):
+    """ Stands in for a websocket-client socket read by another thread. """
+    def __init__(self, frames=()):
+        self.frames = queue.Queue()
+        self.sent = []
+        self.timeout = None
+        self.connected = True
+        for data in frames:
+            self.push(data)
+
+    def push(self, data):
+        self.frames.put(data)
+
+    def fail(self):
+        self.frames.put(WebSocketConnectionClosedException('Connection drop'))
+
+    def recv(self):
+        try:
+            item = self.frames.get(timeout=self.timeout)
+        except queue.Empty:
+            raise WebSocketTimeoutException('timed out')
+        if isinstance(item, Exception):
+            self.connected = False
+            raise item
+        return item
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def ping(self, payload):
+        pass
+
+    def abort(self):
+        self.fail()
+
+    def shutdown(self):
+        self.connected = False
+
+
+class RecordingClient(WebsocketClient):
+
+    def __init__(self, **kwargs):
+        super(RecordingClient, self).__init__('key', 'secret', channel='ticker',
+                                              should_print=False, **kwargs)
+        self.received = []
+        self.closed = 0
+        self.failovers = 0
+        self.gaps = 0
+
+    def on_message(self, msg):
+        self.received.append(msg['events'][0]['n'])
+
+    def on_failover(self, gap=False):
+        self.failovers += 1
+        self.gaps += gap
+
+    def on_close(self):
+        self.closed += 1
+
+    def on_error(self, e, data=None):
+        self.error = e
+
 
 class TestWebsocketClient(unittest.TestCase):
 
-    @patch('cbadv.websocket_client.create_connection')
-    def setUp(self, mock_create_connection):
-        self.api_key = 'test_api_key'
-        self.api_secret = 'test_api_secret'
-        self.client = WebsocketClient(api_key=self.api_key, api_secret=self.api_secret, channel='ticker')
-        self.client.ws = MagicMock()
-
-    @patch('cbadv.websocket_client.create_connection')
-    def test_reconnect(self, mock_create_connection):
-        self.client._reconnect()
-        self.assertTrue(self.client.ws.close.called)
-        self.assertTrue(mock_create_connection.called)
-
-    @patch('cbadv.websocket_client.create_connection')
-    def test_listen_reconnect_on_error(self, mock_create_connection):
-        self.client.ws.recv.side_effect = Exception("Connection drop")
-        with patch.object(self.client, '_reconnect') as mock_reconnect:
-            self.client._listen()
-            self.assertTrue(mock_reconnect.called)
-
-    @patch('cbadv.websocket_client.create_connection')
-    def test_on_close_reconnect(self, mock_create_connection):
-        with patch.object(self.client, '_reconnect') as mock_reconnect:
-            self.client.on_close()
-            self.assertTrue(mock_reconnect.called)
-
-    @patch('cbadv.websocket_client.create_connection')
-    def test_simulate_connection_drop(self, mock_create_connection):
-        self.client.ws.recv.side_effect = Exception("Connection drop")
-        with patch.object(self.client, '_reconnect') as mock_reconnect:
-            self.client._listen()
-            self.assertTrue(mock_reconnect.called)
-
-    @patch('cbadv.websocket_client.create_connection')
-    def test_verify_reconnect_method(self, mock_create_connection):
-        with patch.object(self.client, '_disconnect') as mock_disconnect:
-            with patch.object(self.client, '_connect') as mock_connect:
-                with patch('time.sleep', return_value=None):
-                    self.client._reconnect()
-                    self.assertTrue(mock_disconnect.called)
-                    self.assertTrue(mock_connect.called)
+    def start(self, client, sockets):
+        patcher = patch('cbadv.websocket_client.create_connection', side_effect=sockets)
+        self.create_connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        client.start()
+        self.addCleanup(client.close)
+        return client
+
+    def test_subscribes_and_delivers(self):
+        socket = FakeSocket([frame(1), frame(2)])
+        client = self.start(RecordingClient(), [socket])
+        self.assertTrue(wait_for(lambda: client.received == [1, 2]))
+        self.assertEqual(socket.sent[0]['type'], 'subscribe')
+        self.assertEqual(socket.sent[0]['product_ids'], ['BTC-USD'])
+        client.close()
+        self.assertEqual(client.closed, 1)
+        self.assertFalse(client.thread.is_alive())
+
+    def test_reconnects_iteratively(self):
+        sockets = [FakeSocket([frame(n)]) for n in range(20)]
+        client = self.start(RecordingClient(), sockets)
+        threads = threading.active_count()
+        for socket in sockets[:-1]:
+            self.assertTrue(wait_for(lambda: self.create_connection.call_count > sockets.index(socket)))
+            socket.fail()
+        self.assertTrue(wait_for(lambda: client.received == list(range(20))))
+        self.assertEqual(client.reconnect_stats.reconnects, 19)
+        self.assertEqual(client.reconnect_stats.failovers, 0)
+        self.assertLessEqual(threading.active_count(), threads)
+        self.assertEqual(client.closed, 0)
+
+    def test_backoff_then_give_up(self):
+        client = RecordingClient(reconnect_delay=0.001, max_retries=3)
+        with patch('cbadv.websocket_client.random.uniform', side_effect=lambda a, b: b) as uniform:
+            self.start(client, ConnectionRefusedError('refused'))
+            self.assertTrue(wait_for(lambda: not client.thread.is_alive()))
+        self.assertEqual([call.args[1] for call in uniform.call_args_list], [0.001, 0.002, 0.004])
+        self.assertEqual(client.reconnect_stats.failed_attempts, 4)
+        self.assertIsInstance(client.error, ConnectionRefusedError)
+        self.assertTrue(client.stop)
+        self.assertEqual(client.closed, 1)
+
+    def test_connection_closed_without_data_backs_off(self):
+        client = RecordingClient(reconnect_delay=0.001)
+        empty = [FakeSocket(['']) for _ in range(3)]
+        with patch('cbadv.websocket_client.random.uniform', side_effect=lambda a, b: b) as uniform:
+            self.start(client, empty + [FakeSocket([frame(1)])])
+            self.assertTrue(wait_for(lambda: client.received == [1]))
+        self.assertEqual(uniform.call_count, 3)
+
+    def test_stale_connection_is_replaced(self):
+        client = RecordingClient(stale_after=0.05)
+        self.start(client, [FakeSocket([frame(1)]), FakeSocket([frame(2)])])
+        self.assertTrue(wait_for(lambda: client.received == [1, 2]))
+        self.assertIsInstance(client.error, WebSocketTimeoutException)
+
+    def test_standby_failover(self):
+        primary = FakeSocket([frame(n) for n in range(1, 4)])
+        standby = FakeSocket([frame(n) for n in range(1, 6)])
+        spare = FakeSocket()
+        client = self.start(RecordingClient(standby=True), [primary, standby, spare])
+        self.assertTrue(wait_for(lambda: client.received == [1, 2, 3]))
+        self.assertTrue(wait_for(lambda: len(client._standby.frames) == 5))
+        primary.fail()
+        self.assertTrue(wait_for(lambda: client.received == [1, 2, 3, 4, 5]))
+        standby.push(frame(6))
+        self.assertTrue(wait_for(lambda: client.received[-1] == 6))
+        stats = client.reconnect_stats
+        self.assertEqual((stats.reconnects, stats.failovers), (1, 1))
+        self.assertEqual((stats.recovered, stats.duplicates, stats.gaps), (2, 3, 0))
+        self.assertEqual((client.failovers, client.gaps), (1, 0))
+        # A new standby is subscribed for the next failure.
+        self.assertTrue(wait_for(lambda: spare.sent))
+        self.assertIsNone(standby.timeout)
+
+    def test_failover_reports_frames_older_than_the_standby_window(self):
+        primary = FakeSocket([frame(n) for n in range(1, 4)])
+        standby = FakeSocket([frame(n) for n in range(5, 7)])
+        client = self.start(RecordingClient(standby=True), [primary, standby, FakeSocket()])
+        self.assertTrue(wait_for(lambda: client.received == [1, 2, 3]))
+        self.assertTrue(wait_for(lambda: len(client._standby.frames) == 2))
+        primary.fail()
+        self.assertTrue(wait_for(lambda: client.received == [1, 2, 3, 5, 6]))
+        self.assertEqual((client.gaps, client.reconnect_stats.gaps), (1, 1))
+
+    def test_subscription_changes_reach_the_standby(self):
+        primary, standby = FakeSocket([frame(1)]), FakeSocket()
+        client = self.start(RecordingClient(standby=True), [primary, standby])
+        self.assertTrue(wait_for(lambda: client._standby is not None and
+                                 client._standby.ready.is_set()))
+        client._send_subscription('subscribe', ['ETH-USD'])
+        self.assertEqual(primary.sent[-1]['product_ids'], ['ETH-USD'])
+        self.assertEqual(standby.sent[-1]['product_ids'], ['ETH-USD'])
+
+    def test_channels_share_one_connection(self):
+        socket = FakeSocket()
+        client = WebsocketClient('key', 'secret', products=['BTC-USD'], should_print=False,
+                                 channel=['level2', 'ticker'])
+        self.start(client, [socket])
+        self.assertTrue(wait_for(lambda: len(socket.sent) == 2))
+        self.assertEqual([(msg['channel'], msg['product_ids']) for msg in socket.sent],
+                         [('level2', ['BTC-USD']), ('ticker', ['BTC-USD'])])
+        self.assertEqual(self.create_connection.call_count, 1)
+
+    def test_runtime_subscriptions_survive_reconnection(self):
+        first, second = FakeSocket([frame(1)]), FakeSocket()
+        client = self.start(RecordingClient(products=['BTC-USD']), [first, second])
+        self.assertTrue(wait_for(lambda: client.received == [1]))
+        client.subscribe('market_trades', ['ETH-USD', 'SOL-USD'])
+        client.subscribe('heartbeats', [])
+        client.unsubscribe('market_trades', ['SOL-USD'])
+        client.subscribe('level2')
+        client.unsubscribe('ticker')
+        self.assertEqual([(msg['type'], msg['channel'], msg['product_ids']) for msg in first.sent],
+                         [('subscribe', 'ticker', ['BTC-USD']),
+                          ('subscribe', 'market_trades', ['ETH-USD', 'SOL-USD']),
+                          ('subscribe', 'heartbeats', []),
+                          ('unsubscribe', 'market_trades', ['SOL-USD']),
+                          ('subscribe', 'level2', ['BTC-USD']),
+                          ('unsubscribe', 'ticker', ['BTC-USD'])])
+        self.assertEqual(client.subscriptions, {'market_trades': ['ETH-USD'], 'heartbeats': [],
+                                                'level2': None})
+        first.fail()
+        self.assertTrue(wait_for(lambda: len(second.sent) == 3))
+        self.assertEqual([(msg['channel'], msg['product_ids']) for msg in second.sent],
+                         [('market_trades', ['ETH-USD']), ('heartbeats', []),
+                          ('level2', ['BTC-USD'])])
+
+    def test_routing(self):
+        client = WebsocketClient('key', 'secret', should_print=False, channel=['level2', 'ticker'])
+        books, tickers, eth = [], [], []
+        client.on('level2', books.append)
+        client.on('ticker', tickers.append)
+        client.on('ticker', lambda msg, ticker: eth.append(ticker['price']), product_id='ETH-USD')
+        l2 = {'channel': 'l2_data', 'events': [{'type': 'update', 'product_id': 'BTC-USD'}]}
+        ticker = {'channel': 'ticker', 'events': [{'type': 'update', 'tickers': [
+            {'product_id': 'BTC-USD', 'price': '1'}, {'product_id': 'ETH-USD', 'price': '2'}]}]}
+        for msg in (l2, ticker, {'channel': 'subscriptions', 'events': []}):
+            client.on_message(msg)
+        self.assertEqual((books, tickers, eth), ([l2], [ticker], ['2']))
+        client.on('ticker', None)
+        client.on('ticker', None, product_id='ETH-USD')
+        client.on_message(ticker)
+        self.assertEqual((len(tickers), len(eth)), (1, 1))
+
+    def test_frame_time(self):
+        self.assertEqual(frame_time(frame(3)), 1672531203.5)
+        self.assertEqual(frame_time(frame(3).encode()), 1672531203.5)
+        self.assertIsNone(frame_time('{"channel": "ticker"}'))
+
 
 if __name__ == '__main__':
     unittest.main()